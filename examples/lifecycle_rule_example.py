@@ -110,6 +110,7 @@ transform("Lifecycle Status Rule", lifecycle_status)
 {
     "name": "Lifecycle Status Rule",
     "attributes": {
+        "requiresPeriodicRefresh": true,
         "pre_hired": {
             "attributes": {
                 "firstDate": {
@@ -30,6 +30,7 @@ transform("Set Description with Today Date", description_value)
 {
     "name": "Set Description with Today Date",
     "attributes": {
+        "requiresPeriodicRefresh": true,
         "values": [
             {
                 "attributes": {
@@ -0,0 +1,115 @@
+import re
+
+from isc_transform_vtl import references
+
+
+DATE_TOOLS = frozenset(["date", "dateTool", "dateUtil"])
+
+# "now" as a word of its own, as it must appear in a Velocity template whose output may be exactly "now".
+_NOW_WORD = re.compile(r"(?<![A-Za-z0-9_])now(?![A-Za-z0-9_])")
+
+
+def join_path(path, key):
+    """
+    Extends a node path with a dictionary key or a list index.
+
+    :param path: The parent path ('' for the root).
+    :param key: A dictionary key (str) or list index (int).
+    :return: The child path, e.g. 'attributes.values[1]'.
+    """
+    if isinstance(key, int):
+        return "%s[%d]" % (path, key)
+    return "%s.%s" % (path, key) if path else key
+
+
+def time_dependencies(tree, transforms=None):
+    """
+    Finds the nodes that make a transform's output depend on the current time.
+
+    Time-dependent nodes are 'dateMath' expressions using 'now', 'dateCompare' with an operand that may evaluate to
+    "now" (see may_evaluate_to_now()) and 'static' Velocity templates using a date tool ($date, $dateTool, $dateUtil)
+    that is not one of their variables.
+
+    :param tree: A transform dictionary.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries; 'reference' transforms
+                       found in it are analyzed too (their paths are prefixed with 'reference(<id>):').
+    :return: A list of (path, reason) tuples, in document order.
+    """
+    transforms = transforms or {}
+    found = []
+    visited = set()
+    pending = [("", tree)]
+    while pending:
+        path, node = pending.pop()
+        if isinstance(node, list):
+            pending.extend((join_path(path, index), item) for index, item in reversed(list(enumerate(node))))
+            continue
+        if not isinstance(node, dict):
+            continue
+        node_type = node.get("type")
+        attributes = node.get("attributes") if isinstance(node.get("attributes"), dict) else {}
+        if node_type == "dateMath" and "now" in str(attributes.get("expression", "")):
+            found.append((path, "dateMath expression %r uses now" % attributes["expression"]))
+        elif node_type == "dateCompare":
+            for key in ("firstDate", "secondDate"):
+                if isinstance(attributes.get(key), str) and attributes[key].lower() == "now":
+                    found.append((join_path(join_path(path, "attributes"), key), "dateCompare against now"))
+                elif may_evaluate_to_now(attributes.get(key), transforms):
+                    found.append((join_path(join_path(path, "attributes"), key), "dateCompare operand may evaluate to now"))
+        elif node_type == "static" and isinstance(attributes.get("value"), str):
+            tools = sorted((references(attributes["value"]) & DATE_TOOLS) - set(attributes))
+            if tools:
+                found.append((join_path(join_path(path, "attributes"), "value"), "Velocity template uses $%s" % ", $".join(tools)))
+        elif node_type == "reference" and attributes.get("id") in transforms and attributes["id"] not in visited:
+            visited.add(attributes["id"])
+            pending.append(("reference(%s):" % attributes["id"], transforms[attributes["id"]]))
+        pending.extend((join_path(path, key), value) for key, value in reversed(list(node.items())))
+    return [(re.sub(r":\.", ":", path), reason) for path, reason in found]
+
+
+def may_evaluate_to_now(value, transforms=None):
+    """
+    Checks whether a 'dateCompare' operand may evaluate to "now", which is compared as the current time.
+
+    Like the evaluator, only the exact, lowercase string "now" counts. Besides the literal string, operands producing
+    it from their own text are detected: static("now"), a Velocity template with "now" as a word of its own, or any
+    transform with a "now" literal inside, such as a 'lookup', 'firstValid' or 'conditional' falling back to it. 'reference' transforms found in transforms are
+    followed. Values read from identities or accounts are not considered.
+
+    :param value: A dateCompare operand: a string or a transform dictionary.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries.
+    :return: True if the operand may evaluate to "now".
+    """
+    transforms = transforms or {}
+    visited = set()
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, str):
+            if value == "now":
+                return True
+        elif isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, dict):
+            attributes = value.get("attributes") if isinstance(value.get("attributes"), dict) else {}
+            text = attributes.get("value")
+            if value.get("type") == "static" and isinstance(text, str) and (
+                    text == "now" or (("#" in text or "$" in text) and _NOW_WORD.search(text))):
+                return True
+            if value.get("type") == "reference" and attributes.get("id") in transforms and attributes["id"] not in visited:
+                visited.add(attributes["id"])
+                pending.append(transforms[attributes["id"]])
+            pending.extend(value.values())
+    return False
+
+
+def infer_periodic_refresh(tree, transforms=None):
+    """
+    Decides whether a transform needs 'requiresPeriodicRefresh'.
+
+    :param tree: A transform dictionary.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries (see time_dependencies()).
+    :return: A tuple (requires_refresh, dependencies) where dependencies is the list returned by time_dependencies().
+    """
+    dependencies = time_dependencies(tree, transforms)
+    return bool(dependencies), dependencies
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import random
+import ssl
+import time
+from urllib.parse import urlencode, urlsplit
+
+from isc_transform_deploy import (CREATED, FAILED, PAGE_SIZE, RETRY_STATUSES, TOKEN_PATH, TRANSFORMS_PATH, UNCHANGED,
+                                  UPDATED, DeployError, DeployResult, parse_retry_after)
+from isc_transform_diff import has_semantic_changes
+
+
+# Errors of a lost or unusable connection; they fail one transform of deploy_many() instead of the whole deployment.
+CONNECTION_ERRORS = (OSError, EOFError, asyncio.TimeoutError)
+
+
+class _HostPool(object):
+    """
+    Keep-alive HTTP/1.1 connections to one host, with a limit on concurrent requests.
+    """
+
+    def __init__(self, host, port, secure, limit, timeout):
+        self.host = host
+        self.port = port
+        # The Host header only names the port when it is not the scheme's default; IPv6 literals are bracketed.
+        self.authority = "[%s]" % host if ":" in host else host
+        if port != (443 if secure else 80):
+            self.authority += ":%d" % port
+        self.ssl = ssl.create_default_context() if secure else None
+        self.semaphore = asyncio.Semaphore(limit)
+        self.idle = []
+        self.timeout = timeout
+        self.opened = 0
+
+    async def _read_head(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("The server closed the connection.")
+        version, status = status_line.decode("latin-1").split(" ", 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return version, int(status), headers
+
+    async def _read_response(self, reader, method):
+        version, status, headers = await self._read_head(reader)
+        # Interim 1xx responses (e.g. 100 Continue) have no body and precede the final response.
+        while 100 <= status < 200:
+            version, status, headers = await self._read_head(reader)
+        if method == "HEAD" or status in (204, 304):
+            # These responses never have a body, whatever their headers say (RFC 7230, section 3.3.3).
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            headers["connection"] = "close"
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return status, headers, body, keep_alive
+
+    async def request(self, method, path, body, headers):
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % self.authority, "Content-Length: %d" % len(body or b"")]
+        lines.extend("%s: %s" % item for item in headers.items())
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b"")
+        async with self.semaphore:
+            for attempt in (0, 1):
+                reused = bool(self.idle)
+                if reused:
+                    reader, writer = self.idle.pop()
+                else:
+                    self.opened += 1
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout)
+                try:
+                    writer.write(message)
+                    await writer.drain()
+                    status, response_headers, data, keep_alive = await asyncio.wait_for(self._read_response(reader, method),
+                                                                                         self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # An idle connection may have been closed by the server in the meantime: retry on a new one.
+                    if reused and not attempt:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self.idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, response_headers, data
+
+    def close(self):
+        while self.idle:
+            self.idle.pop()[1].close()
+
+
+class AsyncTransformClient(object):
+    """
+    asyncio client for the transforms API of an Identity Security Cloud tenant.
+
+    Works like isc_transform_deploy.TransformClient, on keep-alive connections opened with asyncio streams: the
+    number of concurrent requests per host is limited, HTTP 429 pauses every request for the Retry-After delay,
+    and the tenant's transforms can be iterated while the next page is being downloaded. Use it as an async
+    context manager, or call close().
+    """
+
+    def __init__(self, base_url, token=None, client_id=None, client_secret=None, concurrency=8, max_retries=6,
+                 backoff=0.5, max_backoff=30.0, max_retry_after=None, timeout=60):
+        """
+        :param base_url: Tenant API URL, e.g. 'https://acme.api.identitynow.com'.
+        :param token: (optional) An access token. When not given, one is requested with client_id and client_secret.
+        :param client_id: (optional) Personal access token client ID.
+        :param client_secret: (optional) Personal access token client secret.
+        :param concurrency: (optional) Maximum number of concurrent requests per host. Default is 8.
+        :param max_retries: (optional) Retries per request for rate limiting and transient errors. Default is 6.
+        :param backoff: (optional) Base delay in seconds of the exponential backoff. Default is 0.5.
+        :param max_backoff: (optional) Maximum delay in seconds of the exponential backoff. Default is 30.
+        :param max_retry_after: (optional) Maximum delay in seconds honoured from a Retry-After header. Default is
+                                None: the tenant's delay is always honoured.
+        :param timeout: (optional) Timeout in seconds for connecting and for each response. Default is 60.
+        """
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Invalid base URL %r; expected http(s)://host[:port]." % base_url)
+        if token is None and not (client_id and client_secret):
+            raise ValueError("Provide either an access token or a client ID and client secret.")
+        self.base_url = base_url
+        self.prefix = parts.path.rstrip("/")
+        self.token = token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.pools = {}
+        self.paused_until = 0.0
+        self.retries = 0
+        self._token_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        self.close()
+
+    def _pool(self, url):
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        key = (parts.hostname, parts.port or (443 if secure else 80), secure)
+        if key not in self.pools:
+            self.pools[key] = _HostPool(key[0], key[1], secure, self.concurrency, self.timeout)
+        return self.pools[key]
+
+    async def _authenticate(self, expired=None):
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self.token is not None and self.token != expired:
+                return self.token
+            if not (self.client_id and self.client_secret):
+                raise DeployError("The access token was rejected and no client credentials are available.", 401)
+            query = urlencode({"grant_type": "client_credentials", "client_id": self.client_id,
+                               "client_secret": self.client_secret})
+            status, headers, body = await self._pool(self.base_url).request(
+                "POST", "%s%s?%s" % (self.prefix, TOKEN_PATH, query), None, {})
+            if status != 200:
+                raise DeployError("Authentication failed with HTTP %d." % status, status, body)
+            self.token = json.loads(body)["access_token"]
+            return self.token
+
+    async def request(self, method, path, payload=None):
+        """
+        Sends an authenticated JSON request, retrying rate-limited and transient failures.
+
+        :param method: HTTP method.
+        :param path: Path below the base URL, e.g. '/v3/transforms'.
+        :param payload: (optional) JSON-serializable request body.
+        :return: The decoded JSON response, or None for empty responses.
+        """
+        body = None if payload is None else json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        token = self.token or await self._authenticate()
+        pool = self._pool(self.base_url)
+        attempt = 0
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            headers = {"Authorization": "Bearer " + token, "Accept": "application/json"}
+            if body is not None:
+                headers["Content-Type"] = "application/json"
+            status, response_headers, data = await pool.request(method, self.prefix + path, body, headers)
+            if status == 401 and attempt == 0 and self.client_id:
+                token = await self._authenticate(expired=token)
+                attempt += 1
+                continue
+            if status in RETRY_STATUSES and attempt < self.max_retries:
+                attempt += 1
+                self.retries += 1
+                retry_after = parse_retry_after(response_headers.get("retry-after"))
+                if retry_after is not None:
+                    if self.max_retry_after is not None:
+                        retry_after = min(self.max_retry_after, retry_after)
+                    pause = retry_after * random.uniform(1.0, 1.25)
+                    self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                else:
+                    await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+                continue
+            if status >= 400:
+                raise DeployError("%s %s failed with HTTP %d: %s" % (method, path, status, data[:500].decode("utf-8", "replace")),
+                                  status, data)
+            return json.loads(data) if data.strip() else None
+
+    async def fetch_all(self, page_size=PAGE_SIZE):
+        """
+        Iterates over every transform of the tenant.
+
+        Pages are requested one ahead: the next page is downloaded while the transforms of the current one are
+        being consumed.
+
+        :param page_size: (optional) Number of transforms per request. Default is 250, the API maximum.
+        :return: An async generator of transform dictionaries, including their 'id'.
+        """
+        def fetch(offset):
+            query = urlencode({"limit": page_size, "offset": offset})
+            return asyncio.ensure_future(self.request("GET", "%s?%s" % (TRANSFORMS_PATH, query)))
+
+        offset = 0
+        pending = fetch(offset)
+        try:
+            while pending is not None:
+                page = await pending
+                offset += len(page)
+                pending = fetch(offset) if len(page) == page_size else None
+                for tree in page:
+                    yield tree
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def create(self, tree):
+        """
+        Creates a transform.
+
+        :param tree: A named transform, as returned by transform(..., output_enabled=True).
+        :return: The created transform, including its 'id'.
+        """
+        return await self.request("POST", TRANSFORMS_PATH, tree)
+
+    async def update(self, transform_id, tree):
+        """
+        Replaces the definition of an existing transform. The name and type of a transform cannot be changed.
+
+        :param transform_id: The ID of the transform in the tenant.
+        :param tree: A named transform, as returned by transform(..., output_enabled=True).
+        :return: The updated transform.
+        """
+        return await self.request("PUT", "%s/%s" % (TRANSFORMS_PATH, transform_id), tree)
+
+    async def _upsert(self, tree, existing, force):
+        name = tree["name"]
+        try:
+            if existing is None:
+                return DeployResult(name, CREATED, (await self.create(tree)).get("id"), None)
+            if not force and not has_semantic_changes(existing, tree):
+                return DeployResult(name, UNCHANGED, existing.get("id"), None)
+            await self.update(existing["id"], tree)
+            return DeployResult(name, UPDATED, existing["id"], None)
+        except DeployError as exception:
+            return DeployResult(name, FAILED, existing and existing.get("id"), str(exception))
+        except CONNECTION_ERRORS as exception:
+            message = str(exception) or exception.__class__.__name__
+            return DeployResult(name, FAILED, existing and existing.get("id"), "Connection error: %s" % message)
+
+    async def deploy_many(self, transforms, force=False):
+        """
+        Creates or updates many transforms concurrently (see isc_transform_deploy.TransformClient.deploy()).
+
+        A transform whose requests fail, including on connection errors, is reported as failed without cancelling
+        the others.
+
+        :param transforms: An iterable of named transforms, as returned by transform(..., output_enabled=True).
+        :param force: (optional) Boolean indicating whether unchanged transforms are updated anyway. Default is False.
+        :return: A list of DeployResult tuples (name, action, id, error), in the order of transforms.
+        """
+        transforms = [tree.to_dict() if hasattr(tree, "to_dict") else tree for tree in transforms]
+        names = [tree["name"] for tree in transforms]
+        if len(set(names)) != len(names):
+            raise ValueError("Transform names must be unique within a deployment.")
+        existing = {}
+        async for tree in self.fetch_all():
+            existing[tree["name"]] = tree
+        return list(await asyncio.gather(*(self._upsert(tree, existing.get(tree["name"]), force) for tree in transforms)))
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
@@ -0,0 +1,532 @@
+import re
+import time
+from datetime import datetime, timezone
+
+from isc_transform_evaluator import (
+    RESERVED_CONDITIONAL_ATTRIBUTES,
+    RESERVED_STATIC_ATTRIBUTES,
+    TransformEvaluationError,
+    _accounts,
+    _interpolate,
+    _is_true,
+    _java_replacement,
+    _select_account_value,
+    _to_string,
+    apply_date_math,
+    compile_transform,
+    format_date,
+    parse_date,
+)
+from isc_transform_vtl import compile_template
+
+
+# First part of the column keys holding the attributes of referenced identities (see column_keys()).
+REFERENCE = "reference"
+
+
+class _Batch(object):
+    """
+    Column arrays for a whole identity population, shared by every kernel during one batch evaluation.
+    """
+    __slots__ = ("columns", "size", "input", "now", "seed")
+
+    def __init__(self, columns, size, input, now, seed):
+        self.columns = columns
+        self.size = size
+        self.input = input
+        self.now = now
+        self.seed = seed
+
+    def take(self, indices):
+        """
+        Returns a batch holding only the given rows.
+        """
+        columns = {key: [column[index] for index in indices] for key, column in self.columns.items()}
+        return _Batch(columns, len(indices), [self.input[index] for index in indices], self.now, self.seed)
+
+    def row(self, index):
+        """
+        Rebuilds the identity record of one row, in the format expected by the per-identity evaluator.
+        """
+        identity = {"attributes": {}, "accounts": {}, "references": {}}
+        for key, column in self.columns.items():
+            if _is_reference_key(key):
+                identity["references"].setdefault(key[1], {})[key[2]] = column[index]
+            elif isinstance(key, tuple):
+                identity["accounts"].setdefault(key[0], {})[key[1]] = column[index]
+            else:
+                identity["attributes"][key] = column[index]
+        return identity
+
+
+def compile_batch(tree, transforms=None):
+    """
+    Compiles a transform dictionary into column kernels that evaluate a whole population at once.
+
+    Each node type becomes one operation over full columns: string transforms run as list operations,
+    'lookup' as a dictionary mapping step, 'firstValid' as a null-coalescing pass and date transforms
+    parse every distinct value only once. Nodes without a column kernel fall back to the per-identity evaluator.
+
+    :param tree: A transform dictionary as produced by the builders or by transform(..., output_enabled=True).
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :return: A function run(columns, size=None, input=None, now=None, seed=None) returning the list of outputs.
+    """
+    kernel = _compile_kernel(tree, {"transforms": transforms or {}})
+
+    def run(columns, size=None, input=None, now=None, seed=None):
+        if size is None:
+            size = len(next(iter(columns.values()))) if columns else 1
+        if now is None:
+            now = datetime.now(timezone.utc)
+        if not isinstance(input, list):
+            input = [input] * size
+        return kernel(_Batch(columns, size, input, now, seed))
+
+    return run
+
+
+def evaluate_batch(tree, columns, size=None, input=None, now=None, seed=None, transforms=None):
+    """
+    Evaluates a transform over a whole identity population stored as columns.
+
+    :param tree: A transform dictionary as produced by the builders or by transform(..., output_enabled=True).
+    :param columns: Dictionary mapping identity attribute names, and the account column keys of column_keys() for
+                    account attributes, to lists holding one value per identity.
+    :param size: (optional) Number of identities. Default is the length of the first column.
+    :param input: (optional) Implicit input value, or list of values, used by transforms without an explicit 'input'.
+    :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+    :param seed: (optional) Seed for the random generators used by the random* transforms.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :return: A list with the value produced by the transform for each identity.
+    """
+    return compile_batch(tree, transforms)(columns, size=size, input=input, now=now, seed=seed)
+
+
+def column_keys(tree, transforms=None):
+    """
+    Lists the columns a transform reads, including through the 'reference' transforms it uses.
+
+    :param tree: A transform dictionary.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :return: A set of identity attribute names, account column keys: (source_name, attribute_name) tuples, or
+             (source_name, attribute_name, sort_attribute, sort_descending, return_first_link) tuples for
+             'accountAttribute' nodes with account selection options, and (REFERENCE, uid, attribute_name) tuples
+             for the attributes of referenced identities read by 'getReferenceIdentityAttribute' rules.
+    """
+    transforms = transforms or {}
+    keys = set()
+    followed = set()
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            attributes = node.get("attributes") if isinstance(node.get("attributes"), dict) else {}
+            if node.get("type") == "identityAttribute":
+                keys.add(attributes["name"])
+            elif node.get("type") == "accountAttribute":
+                keys.add(_account_column_key(attributes))
+            elif node.get("type") == "rule" and attributes.get("operation") == "getReferenceIdentityAttribute":
+                keys.add((REFERENCE, attributes["uid"], attributes["attributeName"]))
+            elif node.get("type") == "reference" and attributes.get("id") in transforms \
+                    and attributes["id"] not in followed:
+                followed.add(attributes["id"])
+                pending.append(transforms[attributes["id"]])
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return keys
+
+
+def _account_column_key(attributes):
+    key = (attributes["sourceName"], attributes["attributeName"])
+    sort_attribute = attributes.get("accountSortAttribute")
+    return_first_link = _is_true(attributes.get("accountReturnFirstLink"))
+    if sort_attribute is None and not return_first_link:
+        return key
+    return key + (sort_attribute, sort_attribute is not None and _is_true(attributes.get("accountSortDescending")),
+                  return_first_link)
+
+
+def _is_reference_key(key):
+    # Account keys have 2 or 5 parts: the 3 parts of a reference key never clash with them.
+    return isinstance(key, tuple) and len(key) == 3 and key[0] == REFERENCE
+
+
+def columns_from_identities(tree, identities, transforms=None):
+    """
+    Converts identity records into the columns read by a transform.
+
+    Account attributes are resolved with the same account selection rules as the per-identity evaluator.
+
+    :param tree: A transform dictionary.
+    :param identities: List of identity records, in the format accepted by evaluate().
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :return: A dictionary of columns accepted by evaluate_batch().
+    """
+    columns = {}
+    for key in column_keys(tree, transforms):
+        if _is_reference_key(key):
+            columns[key] = [((identity.get("references") or {}).get(key[1]) or {}).get(key[2]) for identity in identities]
+        elif isinstance(key, tuple):
+            source_name, attribute_name = key[:2]
+            columns[key] = [_select_account_value(_accounts(identity, source_name), attribute_name, *key[2:])
+                            for identity in identities]
+        else:
+            columns[key] = [(identity.get("attributes") or {}).get(key) for identity in identities]
+    return columns
+
+
+def columns_from_snapshot(tree, snapshot, start=0, stop=None, transforms=None):
+    """
+    Reads the columns of a transform from a memory-mapped columnar snapshot.
+
+    :param tree: A transform dictionary.
+    :param snapshot: An isc_transform_snapshot.Snapshot.
+    :param start: (optional) First identity. Default is 0.
+    :param stop: (optional) End of the identity range (exclusive). Default is the end of the snapshot.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :return: A dictionary of columns accepted by evaluate_batch(), equal to columns_from_identities() on the same
+             identities.
+    """
+    return snapshot.columns(column_keys(tree, transforms), start, stop)
+
+
+def benchmark(tree, identities, now=None, repeat=3):
+    """
+    Measures the throughput of the per-identity and the columnar engines on the same population.
+
+    :param tree: A transform dictionary.
+    :param identities: List of identity records, in the format accepted by evaluate().
+    :param now: (optional) Timezone-aware datetime used as "now".
+    :param repeat: (optional) Number of runs per engine; the best run is reported.
+    :return: A dictionary with the population size and the identities per second of each engine.
+    """
+    now = now or datetime.now(timezone.utc)
+    run = compile_transform(tree)
+    run_batch = compile_batch(tree)
+    columns = columns_from_identities(tree, identities)
+    per_identity = batch = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for identity in identities:
+            run(identity, now=now)
+        per_identity = min(per_identity, time.perf_counter() - started)
+        started = time.perf_counter()
+        run_batch(columns, size=len(identities), now=now)
+        batch = min(batch, time.perf_counter() - started)
+    return {
+        "identities": len(identities),
+        "per_identity_per_second": len(identities) / per_identity if per_identity else float("inf"),
+        "batch_per_second": len(identities) / batch if batch else float("inf"),
+    }
+
+
+def _compile_kernel(value, env):
+    if isinstance(value, dict):
+        if value.get("type") in _KERNELS:
+            kernel = _KERNELS[value["type"]](value.get("attributes") or {}, env)
+            if kernel is not None:
+                return kernel
+            return _row_kernel(value, env)
+        if isinstance(value.get("transform"), dict):
+            return _compile_kernel(value["transform"], env)
+        return _row_kernel(value, env)
+    return lambda batch: [value] * batch.size
+
+
+def _row_kernel(tree, env):
+    """
+    Evaluates a node row by row with the per-identity evaluator, for nodes that have no column kernel.
+    """
+    run = compile_transform(tree, env["transforms"])
+
+    def row_kernel(batch):
+        return [run(batch.row(index), input=batch.input[index], now=batch.now, seed=batch.seed)
+                for index in range(batch.size)]
+
+    return row_kernel
+
+
+def _input_kernel(attributes, env):
+    if "input" in attributes:
+        return _compile_kernel(attributes["input"], env)
+    return lambda batch: batch.input
+
+
+def _map_distinct(function, column):
+    """
+    Applies function once per distinct value of a column (dictionary encoding) and maps the results back.
+    """
+    results = {None: None}
+    output = []
+    for value in column:
+        if value not in results:
+            results[value] = function(value)
+        output.append(results[value])
+    return output
+
+
+def _strings(column):
+    return [value if value is None or isinstance(value, str) else _to_string(value) for value in column]
+
+
+def _branches(batch, mask, positive, negative):
+    """
+    Evaluates positive on the rows where mask is true and negative on the others: a branch is only evaluated for
+    the rows that take it, so it cannot fail for rows that do not.
+    """
+    output = [None] * batch.size
+    for kernel, taken in ((positive, True), (negative, False)):
+        indices = [index for index, flag in enumerate(mask) if bool(flag) is taken]
+        if not indices:
+            continue
+        subset = batch if len(indices) == batch.size else batch.take(indices)
+        for index, value in zip(indices, kernel(subset)):
+            output[index] = value
+    return output
+
+
+def _raise_at(index, error):
+    raise TransformEvaluationError("Row %d: %s" % (index, error))
+
+
+# ---------------------------------------------------------------------------
+# Kernels
+# ---------------------------------------------------------------------------
+
+def _identity_attribute_kernel(attributes, env):
+    name = attributes["name"]
+    return lambda batch: batch.columns[name] if name in batch.columns else [None] * batch.size
+
+
+def _account_attribute_kernel(attributes, env):
+    key = _account_column_key(attributes)
+    return lambda batch: batch.columns[key] if key in batch.columns else [None] * batch.size
+
+
+def _rule_kernel(attributes, env):
+    if attributes.get("operation") != "getReferenceIdentityAttribute":
+        return None
+    key = (REFERENCE, attributes["uid"], attributes["attributeName"])
+    return lambda batch: batch.columns[key] if key in batch.columns else [None] * batch.size
+
+
+def _string_method_kernel(method):
+    def compiler(attributes, env):
+        input_kernel = _input_kernel(attributes, env)
+        return lambda batch: [None if value is None else method(value) for value in _strings(input_kernel(batch))]
+    return compiler
+
+
+def _pad_kernel(left):
+    def compiler(attributes, env):
+        length = int(attributes["length"])
+        padding = attributes.get("padding", " ") or " "
+        if len(padding) != 1:
+            return None
+        input_kernel = _input_kernel(attributes, env)
+        method = str.rjust if left else str.ljust
+        return lambda batch: [None if value is None else method(value, length, padding) for value in _strings(input_kernel(batch))]
+    return compiler
+
+
+def _substring_kernel(attributes, env):
+    begin = int(attributes["begin"])
+    end = int(attributes.get("end", -1))
+    start = (0 if begin == -1 else begin) + int(attributes.get("beginOffset", 0))
+    end_offset = int(attributes.get("endOffset", 0))
+    input_kernel = _input_kernel(attributes, env)
+
+    def substring(batch):
+        output = []
+        for index, value in enumerate(_strings(input_kernel(batch))):
+            if value is None:
+                output.append(None)
+                continue
+            stop = (len(value) if end == -1 else end) + end_offset
+            if start < 0 or stop > len(value) or start > stop:
+                _raise_at(index, "Substring bounds [%d, %d) are out of range for %r." % (start, stop, value))
+            output.append(value[start:stop])
+        return output
+
+    return substring
+
+
+def _concat_kernel(attributes, env):
+    kernels = [_compile_kernel(value, env) for value in attributes.get("values", [])]
+
+    def concat(batch):
+        columns = [[value or "" for value in _strings(kernel(batch))] for kernel in kernels]
+        if not columns:
+            return [""] * batch.size
+        return ["".join(parts) for parts in zip(*columns)]
+
+    return concat
+
+
+def _lookup_kernel(attributes, env):
+    table = {str(key): value for key, value in attributes["table"].items()}
+    if "default" not in table:
+        return None
+    default = table["default"]
+    input_kernel = _input_kernel(attributes, env)
+    return lambda batch: [table.get(key, default) for key in _strings(input_kernel(batch))]
+
+
+def _first_valid_kernel(attributes, env):
+    if _is_true(attributes.get("ignoreErrors")):
+        return None
+    kernels = [_compile_kernel(value, env) for value in attributes.get("values", [])]
+
+    def first_valid(batch):
+        output = [None] * batch.size
+        missing = list(range(batch.size))
+        for kernel in kernels:
+            # Later values are only evaluated for the rows that are still null, as the tenant does.
+            subset = batch if len(missing) == batch.size else batch.take(missing)
+            column = kernel(subset)
+            still_missing = []
+            for index, value in zip(missing, column):
+                if value is None:
+                    still_missing.append(index)
+                else:
+                    output[index] = value
+            missing = still_missing
+            if not missing:
+                break
+        return output
+
+    return first_valid
+
+
+def _conditional_kernel(attributes, env):
+    match = re.match(r"^\s*(.*?)\s+eq\s+(.*?)\s*$", attributes["expression"])
+    if match is None:
+        return None
+    operands = match.groups()
+    positive = _compile_kernel(attributes.get("positiveCondition"), env)
+    negative = _compile_kernel(attributes.get("negativeCondition"), env)
+    variables = [(name, _compile_kernel(node, env)) for name, node in attributes.items()
+                 if name not in RESERVED_CONDITIONAL_ATTRIBUTES]
+
+    def conditional(batch):
+        names = [name for name, kernel in variables]
+        rows = zip(*[kernel(batch) for name, kernel in variables]) if variables else [()] * batch.size
+        mask = []
+        for row in rows:
+            scope = dict(zip(names, row))
+            mask.append(_interpolate(operands[0], scope) == _interpolate(operands[1], scope))
+        return _branches(batch, mask, positive, negative)
+
+    return conditional
+
+
+def _split_kernel(attributes, env):
+    delimiter = re.compile(attributes["delimiter"])
+    index = int(attributes["index"])
+    throws = attributes.get("throws", True) is not False
+    input_kernel = _input_kernel(attributes, env)
+
+    def split(value):
+        parts = delimiter.split(value)
+        while parts and parts[-1] == "":
+            parts.pop()
+        if 0 <= index < len(parts):
+            return parts[index]
+        if throws:
+            raise TransformEvaluationError("Split index %d is out of range for %r." % (index, value))
+        return None
+
+    return lambda batch: [None if value is None else split(value) for value in _strings(input_kernel(batch))]
+
+
+def _replace_kernel(attributes, env):
+    pattern = re.compile(attributes["regex"])
+    replacement = _java_replacement(attributes["replacement"])
+    input_kernel = _input_kernel(attributes, env)
+    return lambda batch: _map_distinct(lambda value: pattern.sub(replacement, value), _strings(input_kernel(batch)))
+
+
+def _date_format_kernel(attributes, env):
+    input_format = attributes.get("inputFormat", "ISO8601")
+    output_format = attributes.get("outputFormat", "ISO8601")
+    input_kernel = _input_kernel(attributes, env)
+    return lambda batch: _map_distinct(lambda value: format_date(parse_date(value, input_format), output_format), input_kernel(batch))
+
+
+def _date_math_kernel(attributes, env):
+    expression = attributes["expression"]
+    round_up = _is_true(attributes.get("roundUp"))
+    if expression.strip().startswith("now"):
+        return lambda batch: [format_date(apply_date_math(batch.now, expression, round_up))] * batch.size
+    input_kernel = _input_kernel(attributes, env)
+    return lambda batch: _map_distinct(lambda value: format_date(apply_date_math(parse_date(value), expression, round_up)), input_kernel(batch))
+
+
+def _date_compare_kernel(attributes, env):
+    operator = attributes["operator"].upper()
+    compare = {
+        "LT": lambda left, right: left < right,
+        "LTE": lambda left, right: left <= right,
+        "GT": lambda left, right: left > right,
+        "GTE": lambda left, right: left >= right,
+    }.get(operator)
+    if compare is None:
+        raise TransformEvaluationError("Unsupported dateCompare operator %r." % attributes["operator"])
+    first = _compile_kernel(attributes["firstDate"], env)
+    second = _compile_kernel(attributes["secondDate"], env)
+    positive = _compile_kernel(attributes.get("positiveCondition", "true"), env)
+    negative = _compile_kernel(attributes.get("negativeCondition", "false"), env)
+
+    def date_compare(batch):
+        parse = lambda value: batch.now if value == "now" else parse_date(value)
+        dates = []
+        for kernel in (first, second):
+            column = _map_distinct(parse, kernel(batch))
+            if None in column:
+                _raise_at(column.index(None), "dateCompare received a null date.")
+            dates.append(column)
+        mask = [compare(left, right) for left, right in zip(*dates)]
+        return _branches(batch, mask, positive, negative)
+
+    return date_compare
+
+
+def _static_kernel(attributes, env):
+    value = attributes.get("value")
+    if not isinstance(value, str) or ("$" not in value and "#" not in value):
+        return lambda batch: [value] * batch.size
+    template = compile_template(value)
+    variables = [(name, _compile_kernel(node, env)) for name, node in attributes.items() if name not in RESERVED_STATIC_ATTRIBUTES]
+
+    def static(batch):
+        names = [name for name, kernel in variables]
+        columns = [kernel(batch) for name, kernel in variables]
+        if not columns:
+            return [template()] * batch.size
+        return [template(dict(zip(names, row))) for row in zip(*columns)]
+
+    return static
+
+
+_KERNELS = {
+    "accountAttribute": _account_attribute_kernel,
+    "concat": _concat_kernel,
+    "conditional": _conditional_kernel,
+    "dateCompare": _date_compare_kernel,
+    "dateFormat": _date_format_kernel,
+    "dateMath": _date_math_kernel,
+    "firstValid": _first_valid_kernel,
+    "identityAttribute": _identity_attribute_kernel,
+    "leftPad": _pad_kernel(left=True),
+    "lookup": _lookup_kernel,
+    "lower": _string_method_kernel(str.lower),
+    "replace": _replace_kernel,
+    "rightPad": _pad_kernel(left=False),
+    "rule": _rule_kernel,
+    "split": _split_kernel,
+    "static": _static_kernel,
+    "substring": _substring_kernel,
+    "trim": _string_method_kernel(str.strip),
+    "upper": _string_method_kernel(str.upper),
+}
@@ -0,0 +1,214 @@
+import argparse
+import csv
+import importlib
+import importlib.util
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from isc_transform_cache import DEFAULT_MAX_BYTES, BuildCache, module_hash
+from isc_transform_serializer import BufferedWriter, dumps
+
+
+_template = None
+
+
+def load_spec(path):
+    """
+    Loads the parameter rows of a bulk generation spec.
+
+    :param path: Path to a CSV file (one row per transform), a JSON file (a list of objects, or an object with a
+                 'rows' list) or a YAML file with the same structure (requires PyYAML).
+    :return: A list of dictionaries, one per transform to generate.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as spec_file:
+        if extension == ".csv":
+            return [dict(row) for row in csv.DictReader(spec_file)]
+        if extension == ".json":
+            spec = json.load(spec_file)
+        elif extension in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read YAML specs: pip install pyyaml")
+            spec = yaml.safe_load(spec_file)
+        else:
+            raise ValueError("Unsupported spec format %r. Use .csv, .json, .yaml or .yml." % extension)
+    if isinstance(spec, dict):
+        spec = spec.get("rows")
+    if not isinstance(spec, list) or not all(isinstance(row, dict) for row in spec):
+        raise ValueError("The spec must be a list of parameter objects (or an object with a 'rows' list).")
+    return spec
+
+
+def load_template(template, function="generate"):
+    """
+    Loads the generation function of a template module.
+
+    :param template: Path to a Python file, or an importable module name.
+    :param function: (optional) Name of the function that receives a row's parameters as keyword arguments and
+                     returns a transform, as produced by transform(..., output_enabled=True). Default is 'generate'.
+    :return: The generation function.
+    """
+    if template.endswith(".py"):
+        module_name = "_isc_template_" + re.sub(r"\W", "_", os.path.splitext(os.path.basename(template))[0])
+        spec = importlib.util.spec_from_file_location(module_name, template)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(template)
+    if not callable(getattr(module, function, None)):
+        raise ValueError("Template %r does not define a %r function." % (template, function))
+    return getattr(module, function)
+
+
+def _init_worker(template, function):
+    global _template
+    _template = load_template(template, function)
+
+
+def _generate(row, output_format):
+    result = _template(**row)
+    if hasattr(result, "to_dict"):
+        result = result.to_dict()
+    if not isinstance(result, dict) or "name" not in result:
+        raise ValueError("The template must return a named transform (use transform(..., output_enabled=True)): %r" % (row,))
+    return result["name"], dumps(result, output_format)
+
+
+def _generate_row(arguments):
+    return _generate(*arguments)
+
+
+def _generate_all(rows, template, function, workers, output_format):
+    workers = workers or os.cpu_count() or 1
+    arguments = ((row, output_format) for row in rows)
+    if workers == 1:
+        _init_worker(template, function)
+        for argument in arguments:
+            yield _generate_row(argument)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template, function)) as executor:
+        for result in executor.map(_generate_row, arguments, chunksize=32):
+            yield result
+
+
+def _generate_cached(rows, template, function, workers, output_format, cache):
+    template_hash = module_hash(template)
+    rows = list(rows)
+    keys = [cache.key(template_hash, function, output_format, row) for row in rows]
+    cached = [cache.get(key) for key in keys]
+    generated = _generate_all([row for row, hit in zip(rows, cached) if hit is None], template, function, workers,
+                              output_format)
+    for key, hit in zip(keys, cached):
+        if hit is None:
+            hit = next(generated)
+            cache.put(key, *hit)
+        yield hit
+    cache.evict()
+
+
+def generate(rows, template, function="generate", workers=None, output_format="compact", cache=None):
+    """
+    Generates one transform per row, fanning the rows out across a process pool.
+
+    Results are yielded in the order of the rows, so the output is deterministic regardless of the number of workers.
+    With a build cache, rows whose template source and parameters were already generated are read back from the
+    cache without importing the template or serializing anything; the worker pool is only started for the misses.
+
+    :param rows: An iterable of parameter dictionaries (see load_spec()).
+    :param template: Path to a Python file, or an importable module name (see load_template()).
+    :param function: (optional) Name of the generation function in the template. Default is 'generate'.
+    :param workers: (optional) Number of worker processes. Default is the number of CPUs; 1 generates in-process.
+    :param output_format: (optional) 'compact' or 'pretty' serialization of each transform. Default is 'compact'.
+    :param cache: (optional) An isc_transform_cache.BuildCache. Default is no caching.
+    :return: A generator of (name, json_text) tuples.
+    """
+    if cache is not None:
+        return _generate_cached(rows, template, function, workers, output_format, cache)
+    return _generate_all(rows, template, function, workers, output_format)
+
+
+def file_name(name):
+    """
+    Converts a transform name into the file name used when writing a directory of transforms.
+
+    :param name: The transform name.
+    :return: A file name ending in '.json'.
+    """
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") + ".json"
+
+
+def write_ndjson(results, fp):
+    """
+    Writes generated transforms as one NDJSON stream.
+
+    :param results: An iterable of (name, compact_json_text) tuples, as returned by generate().
+    :param fp: A text file-like object.
+    :return: The number of transforms written.
+    """
+    writer = BufferedWriter(fp)
+    count = 0
+    for name, text in results:
+        writer.write(text)
+        writer.write("\n")
+        count += 1
+    writer.flush()
+    return count
+
+
+def write_directory(results, directory):
+    """
+    Writes generated transforms to a directory, one JSON file per transform named after the transform.
+
+    :param results: An iterable of (name, json_text) tuples, as returned by generate().
+    :param directory: Output directory; it is created if needed.
+    :return: The number of transforms written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = set()
+    for name, text in results:
+        path = os.path.join(directory, file_name(name))
+        if path in written:
+            raise ValueError("Two transforms map to the same file %r; transform names must be unique." % path)
+        written.add(path)
+        with open(path, "w", encoding="utf-8") as output:
+            output.write(text)
+            output.write("\n")
+    return len(written)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate ISC transforms in bulk from a spec file and a template module.")
+    parser.add_argument("spec", help="CSV, JSON or YAML file with one row of parameters per transform.")
+    parser.add_argument("template", help="Python file (or module name) defining the generation function.")
+    parser.add_argument("--function", default="generate", help="Name of the generation function (default: generate).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count).")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--output", help="NDJSON output file (default: standard output).")
+    output.add_argument("--directory", help="Write one pretty-printed JSON file per transform to this directory.")
+    parser.add_argument("--cache", help="Build cache directory; unchanged transforms are not regenerated.")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Maximum build cache size in MiB (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    rows = load_spec(args.spec)
+    cache = BuildCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    if args.directory:
+        count = write_directory(generate(rows, args.template, args.function, args.workers, "pretty", cache), args.directory)
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            count = write_ndjson(generate(rows, args.template, args.function, args.workers, cache=cache), output_file)
+    else:
+        count = write_ndjson(generate(rows, args.template, args.function, args.workers, cache=cache), sys.stdout)
+    if cache is not None:
+        sys.stderr.write("Generated %d transforms (%d from the build cache).\n" % (count, cache.hits))
+    else:
+        sys.stderr.write("Generated %d transforms.\n" % count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+import weakref
+from collections.abc import Mapping
+
+from isc_transform_analysis import join_path
+
+
+# Modules whose source, with the local modules they import (see library_modules()), changes the output of every
+# template: the builders, and the bulk builder that serializes and caches their output.
+LIBRARY_MODULES = ("isc_transform_generator", "isc_transform_bulk")
+
+_LIBRARY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_NODE_HASHES = weakref.WeakKeyDictionary()
+
+
+def _default(value):
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError("Object of type %s is not JSON serializable" % value.__class__.__name__)
+
+
+def canonical_json(tree):
+    """
+    Serializes a tree canonically: sorted keys, no whitespace between tokens, non-ASCII characters kept as is.
+
+    Two trees have the same canonical JSON exactly when they are equal, whatever their key order or indentation.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :return: The canonical JSON string.
+    """
+    return json.dumps(tree, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_default)
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _open(value, key, path, stack, paths):
+    """
+    Pushes a frame for a container whose hash is still unknown, or returns the hash of a leaf or known Node.
+    """
+    if isinstance(value, Mapping):
+        cached = _NODE_HASHES.get(value) if not paths and hasattr(value, "to_dict") else None
+        if cached is not None:
+            return cached
+        stack.append((value, key, path, iter(value.items()), []))
+        return None
+    if isinstance(value, (list, tuple)):
+        stack.append((value, key, path, iter(enumerate(value)), []))
+        return None
+    return _sha256(json.dumps(value))
+
+
+def _close(value, children):
+    if isinstance(value, Mapping):
+        digest = _sha256("{" + ",".join("%s:%s" % (json.dumps(key), child) for key, child in sorted(children)) + "}")
+        if hasattr(value, "to_dict"):
+            _NODE_HASHES[value] = digest
+        return digest
+    return _sha256("[" + ",".join(child for index, child in children) + "]")
+
+
+def iter_hashes(tree, paths=False):
+    """
+    Computes the Merkle content hash of every value in a tree, children before parents, without recursion.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :param paths: (optional) Boolean indicating whether paths (see isc_transform_analysis.join_path; '' is the root)
+                  are computed. Default is False: paths are None, and frozen Nodes whose hash is already known are
+                  not descended into.
+    :return: A generator of (path, value, hash) tuples; the last one is the root's.
+    """
+    stack = []
+    digest = _open(tree, None, "" if paths else None, stack, paths)
+    if digest is not None:
+        yield "" if paths else None, tree, digest
+        return
+    while stack:
+        value, key, path, items, children = stack[-1]
+        for child_key, child in items:
+            child_path = join_path(path, child_key) if paths else None
+            digest = _open(child, child_key, child_path, stack, paths)
+            if digest is None:
+                break
+            yield child_path, child, digest
+            children.append((child_key, digest))
+        else:
+            stack.pop()
+            digest = _close(value, children)
+            yield path, value, digest
+            if stack:
+                stack[-1][4].append((key, digest))
+
+
+def content_hash(tree):
+    """
+    Computes the Merkle content hash of a tree.
+
+    The hash of an object or list is computed from the hashes of its children, so equal subtrees always get equal
+    hashes and the result does not depend on key order or formatting. Hashes of frozen Nodes are remembered for as
+    long as the node is alive.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :return: A hexadecimal SHA-256 digest.
+    """
+    digest = None
+    for path, value, digest in iter_hashes(tree):
+        pass
+    return digest
+
+
+def subtree_hashes(tree):
+    """
+    Computes the Merkle content hash of every value in a tree.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :return: A dictionary mapping paths (see isc_transform_analysis.join_path; '' is the root) to hashes.
+    """
+    return {path: digest for path, value, digest in iter_hashes(tree, paths=True)}
+
+
+def _source_path(module):
+    if module.endswith(".py"):
+        return module
+    spec = importlib.util.find_spec(module)
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        raise ValueError("Cannot find the source of module %r." % module)
+    return spec.origin
+
+
+def _find_local(name, directories):
+    parts = name.split(".")
+    for directory in directories:
+        for candidate in (os.path.join(directory, *parts) + ".py", os.path.join(directory, *(parts + ["__init__.py"]))):
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+    return None
+
+
+def _imported_names(path):
+    with open(path, "rb") as source:
+        tree = ast.parse(source.read(), path)
+    for statement in ast.walk(tree):
+        if isinstance(statement, ast.Import):
+            for alias in statement.names:
+                yield None, alias.name
+        elif isinstance(statement, ast.ImportFrom):
+            base = os.path.dirname(path)
+            for level in range(statement.level - 1):
+                base = os.path.dirname(base)
+            module = statement.module or ""
+            for alias in statement.names:
+                # "from package import name" may import a submodule: try both.
+                yield base if statement.level else None, module + "." + alias.name if module else alias.name
+                if module:
+                    yield base if statement.level else None, module
+
+
+def local_modules(module):
+    """
+    Finds the source files of a definition module and of the local modules it imports, directly or indirectly.
+
+    Local modules are the ones found next to the definition module or in the directory of the transform library;
+    installed packages and the standard library are not followed. Imports inside functions and conditional imports
+    are included, whether they run or not.
+
+    :param module: Path to a Python file, or an importable module name.
+    :return: A sorted list of absolute source paths, including the module itself.
+    """
+    path = os.path.abspath(_source_path(module))
+    directories = [os.path.dirname(path), _LIBRARY_DIRECTORY]
+    found = {path}
+    pending = [path]
+    while pending:
+        try:
+            imported = list(_imported_names(pending.pop()))
+        except (SyntaxError, ValueError):
+            # A module that does not parse fails at build time anyway; its own source is already hashed.
+            continue
+        for base, name in imported:
+            source = _find_local(name, [base] if base is not None else directories)
+            if source is not None and source not in found:
+                found.add(source)
+                pending.append(source)
+    return sorted(found)
+
+
+def library_modules():
+    """
+    Finds the source files of the transform library: LIBRARY_MODULES and the local modules they import.
+
+    :return: A sorted list of absolute source paths.
+    """
+    return sorted(set(path for name in LIBRARY_MODULES for path in local_modules(name)))
+
+
+def module_hash(module):
+    """
+    Hashes the source of a definition module together with the local modules it imports and the transform library.
+
+    :param module: Path to a Python file, or an importable module name.
+    :return: A hexadecimal SHA-256 digest that changes whenever the module, a local module it imports (see
+             local_modules()) or the library source changes.
+    """
+    digest = hashlib.sha256()
+    paths = local_modules(module)
+    for library_path in library_modules():
+        if library_path not in paths:
+            paths.append(library_path)
+    for path in paths:
+        with open(path, "rb") as source:
+            digest.update(hashlib.sha256(source.read()).digest())
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    """
+    On-disk cache of serialized transforms, keyed by the definition module hash and the builder parameters.
+
+    Every entry is one file in the cache directory. Reading an entry refreshes its modification time, and evict()
+    removes the least recently used entries once the directory grows beyond max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param directory: Cache directory; it is created if needed.
+        :param max_bytes: (optional) Size limit enforced by evict(). Default is 256 MiB.
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be a positive number of bytes.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts):
+        """
+        Builds an entry key from JSON-serializable parts, e.g. (module_hash(template), function, parameters).
+
+        :return: A hexadecimal SHA-256 digest of the canonical JSON of the parts.
+        """
+        return _sha256(canonical_json(parts))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".entry")
+
+    def get(self, key):
+        """
+        Reads an entry and marks it as recently used.
+
+        :param key: An entry key (see key()).
+        :return: The (name, text) tuple stored by put(), or None when the key is not cached.
+        """
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as entry:
+                name = json.loads(entry.readline())
+                text = entry.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return name, text
+
+    def put(self, key, name, text):
+        """
+        Stores an entry. The file is written atomically, so concurrent builds never read a partial entry.
+
+        :param key: An entry key (see key()).
+        :param name: The transform name.
+        :param text: The serialized transform.
+        """
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "w", encoding="utf-8") as entry:
+                entry.write(json.dumps(name))
+                entry.write("\n")
+                entry.write(text)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+
+        :return: The number of entries removed.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".entry") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        removed = 0
+        for modified, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,459 @@
+import argparse
+import collections
+import contextlib
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import isc_transform_generator
+from isc_transform_analysis import infer_periodic_refresh
+from isc_transform_bulk import file_name
+from isc_transform_cache import canonical_json
+from isc_transform_diff import TENANT_METADATA
+
+
+CHUNK_SIZE = 1024 * 1024
+LINE_WIDTH = 120
+
+RULE_UTILITY = "Cloud Services Deployment Utility"
+
+# Builder signatures: type -> (function, [(attribute, parameter, default)]). Parameters without a default are passed
+# positionally; the others are passed by keyword when the attribute is present and differs from the default.
+REQUIRED = object()
+BUILDERS = {
+    "accountAttribute": ("accountAttribute", [("sourceName", "source_name", REQUIRED), ("attributeName", "attribute_name", REQUIRED),
+                                              ("accountSortAttribute", "account_sort_attribute", None),
+                                              ("accountSortDescending", "account_sort_descending", None),
+                                              ("accountReturnFirstLink", "account_return_first_link", None),
+                                              ("accountPropertyFilter", "account_property_filter", None),
+                                              ("accountFilter", "account_filter", None)]),
+    "concat": ("concat", [("values", "values", REQUIRED)]),
+    "conditional": ("conditional", [("expression", "expression", REQUIRED), ("positiveCondition", "positive_condition", REQUIRED),
+                                    ("negativeCondition", "negative_condition", REQUIRED)]),
+    "dateCompare": ("dateCompare", [("firstDate", "first_date", REQUIRED), ("secondDate", "second_date", REQUIRED),
+                                    ("operator", "operator", REQUIRED), ("positiveCondition", "positive_condition", "yes"),
+                                    ("negativeCondition", "negative_condition", "no")]),
+    "dateFormat": ("dateFormat", [("inputFormat", "input_format", None), ("outputFormat", "output_format", None),
+                                  ("input", "input", None)]),
+    "dateMath": ("dateMath", [("expression", "expression", REQUIRED), ("roundUp", "round_up", None), ("input", "input", None)]),
+    "e164phone": ("e164phone", [("defaultCountry", "default_country", None), ("input", "input", None)]),
+    "firstValid": ("firstValid", [("values", "values", REQUIRED), ("ignoreErrors", "ignore_errors", None)]),
+    "identityAttribute": ("identityAttribute", [("name", "attribute_name", REQUIRED)]),
+    "leftPad": ("leftPad", [("length", "length", REQUIRED), ("padding", "padding", " "), ("input", "input", None)]),
+    "lookup": ("lookup", [("table", "table", REQUIRED), ("input", "input", None)]),
+    "lower": ("lower", [("input", "input", None)]),
+    "normalizeNames": ("normalizeNames", [("input", "input", None)]),
+    "rightPad": ("rightPad", [("length", "length", REQUIRED), ("padding", "padding", " "), ("input", "input", None)]),
+    "randomAlphaNumeric": ("randomAlphaNumeric", [("length", "length", 32)]),
+    "randomNumeric": ("randomNumeric", [("length", "length", 32)]),
+    "reference": ("reference", [("id", "transform_id", REQUIRED), ("input", "input", None)]),
+    "replace": ("replace", [("regex", "regex", REQUIRED), ("replacement", "replacement", REQUIRED), ("input", "input", None)]),
+    "replaceAll": ("replaceAll", [("table", "table", REQUIRED), ("input", "input", None)]),
+    "substring": ("substring", [("begin", "begin", REQUIRED), ("end", "end", None), ("beginOffset", "begin_offset", None),
+                                ("endOffset", "end_offset", None), ("input", "input", None)]),
+    "split": ("split", [("delimiter", "delimiter", REQUIRED), ("index", "index", REQUIRED), ("input", "input", None),
+                        ("throws", "throws", True)]),
+    "static": ("static", [("value", "value", REQUIRED)]),
+    "trim": ("trim", [("input", "input", None)]),
+    "upper": ("upper", [("input", "input", None)]),
+}
+
+# Builders whose remaining attributes are passed as keyword arguments (**variables), or as a 'variables' dictionary.
+KEYWORD_VARIABLES = frozenset(["conditional"])
+DICTIONARY_VARIABLES = frozenset(["static"])
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_END = re.compile(r'["\\]')
+_SEPARATOR = re.compile(r"[\s,]*")
+
+
+def iter_export(fp, chunk_size=CHUNK_SIZE):
+    """
+    Reads the transforms of a tenant export incrementally.
+
+    Supports a JSON list of transforms (as returned by the transforms API) and configuration exports (an object
+    whose 'objects' list holds {"self": {"type": "TRANSFORM", ...}, "object": {...}} entries; other object types are
+    skipped). Only one transform is decoded at a time, so memory use does not grow with the size of the file.
+
+    :param fp: A text file-like object.
+    :param chunk_size: (optional) Number of characters read at a time. Default is 1 MiB.
+    :return: A generator of transform dictionaries.
+    """
+    decoder = json.JSONDecoder()
+    text = ""
+    position = 0
+    depth = 0
+    top = None
+    in_string = False
+    key_start = None
+    last_key = None
+    items_at = None
+    eof = False
+
+    while True:
+        if items_at is not None and depth == items_at:
+            # Inside the list of transforms: decode whole items with the C decoder instead of scanning them.
+            position = _SEPARATOR.match(text, position).end()
+            if position < len(text) and text[position] == "{":
+                try:
+                    item, end = decoder.raw_decode(text, position)
+                except ValueError:
+                    if eof:
+                        raise
+                    match = None
+                else:
+                    position = end
+                    if "self" in item and "object" in item:
+                        if str(item["self"].get("type", "")).upper() == "TRANSFORM":
+                            yield item["object"]
+                    else:
+                        yield item
+                    continue
+            elif position < len(text):
+                if text[position] != "]":
+                    raise ValueError("Unexpected %r in the list of transforms at character %d." % (text[position], position))
+                depth -= 1
+                items_at = None
+                position += 1
+                continue
+            else:
+                match = None
+        else:
+            match = (_STRING_END if in_string else _STRUCTURE).search(text, position)
+            if match is not None and in_string and match.group() == "\\" and match.end() >= len(text):
+                match = None
+        if match is None:
+            if eof:
+                if depth or in_string or top is None:
+                    raise ValueError("Unexpected end of the export file.")
+                return
+            chunk = fp.read(chunk_size)
+            eof = not chunk
+            # Everything before the current position has been processed, except a key still being read.
+            keep = key_start if key_start is not None else position
+            text = text[keep:] + chunk
+            position -= keep
+            if key_start is not None:
+                key_start -= keep
+            continue
+
+        character = match.group()
+        position = match.end()
+        if in_string:
+            if character == "\\":
+                position += 1
+                continue
+            in_string = False
+            if key_start is not None:
+                last_key = json.loads(text[key_start:position])
+                key_start = None
+        elif character == '"':
+            in_string = True
+            if top == "{" and depth == 1:
+                key_start = match.start()
+        elif character in "[{":
+            if depth == 0:
+                top = character
+                if character == "[":
+                    items_at = 1
+            elif character == "[" and top == "{" and depth == 1 and last_key == "objects":
+                items_at = 2
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return
+
+
+class _Call(object):
+    __slots__ = ("function", "arguments", "keywords")
+
+    def __init__(self, function, arguments, keywords):
+        self.function = function
+        self.arguments = arguments
+        self.keywords = keywords
+
+
+def _literal(value):
+    if isinstance(value, str):
+        return json.dumps(value)
+    if value is None or isinstance(value, bool):
+        return repr(value)
+    return json.dumps(value)
+
+
+def _expression(value):
+    """
+    Converts a JSON value into an expression tree of builder calls, lists, dictionaries and literals.
+    """
+    if isinstance(value, dict):
+        call = _decompile_node(value)
+        if call is not None:
+            return call
+        return {key: _expression(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expression(item) for item in value]
+    return value
+
+
+def _builds(function, arguments, keywords, node):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            result = getattr(isc_transform_generator, function)(*arguments, **keywords)
+    except (ValueError, TypeError, KeyError):
+        return False
+    return canonical_json(result) == canonical_json(node)
+
+
+def _boolean(value):
+    return {"true": True, "false": False}.get(value, value)
+
+
+def _decompile_node(node):
+    """
+    Maps a transform node to a builder call, or returns None when no builder reproduces it exactly.
+    """
+    node_type = node.get("type")
+    attributes = node.get("attributes", {})
+    if not isinstance(attributes, dict):
+        return None
+    if set(node) == {"transform", "attributes", "isRequired", "type", "isMultiValued"}:
+        return _decompile_username_generator(node)
+    if set(node) - {"type", "attributes"}:
+        return None
+    if node_type == "rule":
+        return _decompile_rule(node, attributes)
+    if node_type not in BUILDERS:
+        return None
+    function, parameters = BUILDERS[node_type]
+    arguments = []
+    keywords = {}
+    known = set()
+    for attribute, parameter, default in parameters:
+        known.add(attribute)
+        if attribute not in attributes:
+            if default is REQUIRED:
+                return None
+            continue
+        value = attributes[attribute]
+        if default is REQUIRED:
+            arguments.append(value)
+        elif json.dumps(value) != json.dumps(default):
+            keywords[parameter] = value
+    variables = {key: value for key, value in attributes.items() if key not in known}
+    if variables:
+        if node_type in KEYWORD_VARIABLES:
+            keywords.update(variables)
+        elif node_type in DICTIONARY_VARIABLES:
+            keywords["variables"] = variables
+        else:
+            return None
+    if not _builds(function, arguments, keywords, node):
+        return None
+    return _Call(function, [_expression(value) for value in arguments],
+                 [(name, _expression(value)) for name, value in keywords.items()])
+
+
+def _decompile_rule(node, attributes):
+    operation = attributes.get("operation")
+    if attributes.get("name") != RULE_UTILITY:
+        return None
+    if operation == "getReferenceIdentityAttribute" and set(attributes) == {"name", "operation", "uid", "attributeName"}:
+        arguments = [attributes["uid"], attributes["attributeName"]]
+        keywords = {}
+    elif operation == "generateRandomString" and set(attributes) == {"name", "operation", "length", "includeNumbers",
+                                                                    "includeSpecialChars"}:
+        length = attributes["length"]
+        arguments = [int(length) if isinstance(length, str) and length.isdigit() else length]
+        keywords = {}
+        if attributes["includeNumbers"] != "true":
+            keywords["include_numbers"] = _boolean(attributes["includeNumbers"])
+        if attributes["includeSpecialChars"] != "true":
+            keywords["include_special_chars"] = _boolean(attributes["includeSpecialChars"])
+    else:
+        return None
+    if not _builds(operation, arguments, keywords, node):
+        return None
+    return _Call(operation, [_expression(value) for value in arguments],
+                 [(name, _expression(value)) for name, value in keywords.items()])
+
+
+def _decompile_username_generator(node):
+    generator = node["transform"]
+    cloud = node["attributes"]
+    if not isinstance(generator, dict) or generator.get("type") != "usernameGenerator" or set(generator) != {"type", "attributes"}:
+        return None
+    attributes = dict(generator["attributes"])
+    if "patterns" not in attributes or set(cloud) != {"cloudMaxSize", "cloudMaxUniqueChecks", "cloudRequired"}:
+        return None
+    arguments = [attributes.pop("patterns")]
+    keywords = {}
+    source_check = attributes.pop("sourceCheck", None)
+    if source_check is not True:
+        keywords["source_check"] = source_check
+    for key, parameter, default in (("cloudMaxSize", "cloud_max_size", "255"), ("cloudMaxUniqueChecks", "cloud_max_unique_checks", "50")):
+        if cloud[key] != default:
+            keywords[parameter] = int(cloud[key]) if str(cloud[key]).isdigit() else cloud[key]
+    keywords.update(attributes)
+    if not _builds("usernameGenerator", arguments, keywords, node):
+        return None
+    return _Call("usernameGenerator", [_expression(value) for value in arguments],
+                 [(name, _expression(value)) for name, value in keywords.items()])
+
+
+def _format(expression, indent=0):
+    """
+    Renders an expression tree as Python source, breaking calls and containers over several lines when they do not
+    fit in LINE_WIDTH characters.
+    """
+    inline = _format_inline(expression)
+    if indent + len(inline) <= LINE_WIDTH or not isinstance(expression, (_Call, list, dict)) or not _has_items(expression):
+        return inline
+    inner = " " * (indent + 4)
+    if isinstance(expression, _Call):
+        items = [_format(value, indent + 4) for value in expression.arguments]
+        items.extend(_keyword(name, _format(value, indent + 4)) for name, value in expression.keywords)
+        opening, closing = expression.function + "(", ")"
+    elif isinstance(expression, list):
+        items = [_format(value, indent + 4) for value in expression]
+        opening, closing = "[", "]"
+    else:
+        items = ["%s: %s" % (_literal(key), _format(value, indent + 4)) for key, value in expression.items()]
+        opening, closing = "{", "}"
+    return "%s\n%s%s\n%s%s" % (opening, inner, (",\n" + inner).join(items), " " * indent, closing)
+
+
+def _has_items(expression):
+    if isinstance(expression, _Call):
+        return bool(expression.arguments or expression.keywords)
+    return bool(expression)
+
+
+def _keyword(name, text):
+    # Attribute names that are not Python identifiers are passed by unpacking a dictionary.
+    if _IDENTIFIER.match(name):
+        return "%s=%s" % (name, text)
+    return "**{%s: %s}" % (_literal(name), text)
+
+
+def _format_inline(expression):
+    if isinstance(expression, _Call):
+        items = [_format_inline(value) for value in expression.arguments]
+        items.extend(_keyword(name, _format_inline(value)) for name, value in expression.keywords)
+        return "%s(%s)" % (expression.function, ", ".join(items))
+    if isinstance(expression, list):
+        return "[%s]" % ", ".join(_format_inline(value) for value in expression)
+    if isinstance(expression, dict):
+        return "{%s}" % ", ".join("%s: %s" % (_literal(key), _format_inline(value)) for key, value in expression.items())
+    return _literal(expression)
+
+
+def _expected(tree):
+    return {key: value for key, value in tree.items() if key not in TENANT_METADATA}
+
+
+def _render(source):
+    output = io.StringIO()
+    with warnings.catch_warnings(), contextlib.redirect_stdout(output):
+        warnings.simplefilter("ignore")
+        exec(compile(source, "<decompiled>", "exec"), {"__name__": "__decompiled__"})
+    return json.loads(output.getvalue())
+
+
+def decompile(tree):
+    """
+    Converts an exported transform back into builder calls.
+
+    Every node is mapped to the builder of its type when that builder reproduces it exactly; nodes no builder can
+    reproduce (unknown types or attributes, values the builders normalize differently) are kept as dictionary
+    literals, with their children still decompiled. The generated module is executed to check the round trip: its
+    output must have the same canonical JSON (see isc_transform_cache.canonical_json) as the exported transform,
+    tenant metadata ('id', 'created', 'modified') aside.
+
+    :param tree: A transform dictionary as exported from the tenant, including its 'name'.
+    :return: A tuple (source, exact) with the Python source of a module like the ones in examples/, and a boolean
+             indicating whether the round trip is exact.
+    """
+    expected = _expected(tree)
+    body = {key: value for key, value in expected.items() if key not in ("name", "internal")}
+    attributes = body.get("attributes")
+    # transform() adds requiresPeriodicRefresh itself: remove it from the body, and only pass the flag explicitly when
+    # the inferred value would be wrong.
+    refresh = isinstance(attributes, dict) and attributes.get("requiresPeriodicRefresh") is True
+    if refresh:
+        body["attributes"] = {key: value for key, value in attributes.items() if key != "requiresPeriodicRefresh"}
+    keywords = [] if refresh == infer_periodic_refresh(body)[0] else [("requires_periodic_refresh", refresh)]
+    call = _Call("transform", [tree.get("name"), _expression(body)], keywords)
+    source = "from isc_transform_generator import *\n\n%s\n" % _format(call)
+    try:
+        exact = canonical_json(_render(source)) == canonical_json(expected)
+    except Exception:
+        exact = False
+    return source, exact
+
+
+def _decompile_batch(trees):
+    return [(tree.get("name") or "",) + decompile(tree) for tree in trees]
+
+
+def decompile_many(transforms, workers=None, batch_size=16):
+    """
+    Decompiles many transforms across a process pool, in order.
+
+    Transforms are read from the iterable as the workers need them, so a streamed export never sits in memory.
+
+    :param transforms: An iterable of exported transforms, e.g. iter_export(fp).
+    :param workers: (optional) Number of worker processes. Default is the number of CPUs; 1 decompiles in-process.
+    :param batch_size: (optional) Number of transforms sent to a worker at a time. Default is 16.
+    :return: A generator of (name, source, exact) tuples.
+    """
+    workers = workers or os.cpu_count() or 1
+    iterator = iter(transforms)
+    batches = iter(lambda: list(itertools.islice(iterator, batch_size)), [])
+    if workers == 1:
+        for batch in batches:
+            for result in _decompile_batch(batch):
+                yield result
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(_decompile_batch, batch))
+            if len(pending) >= 4 * workers:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert exported transforms back into isc_transform_generator code.")
+    parser.add_argument("export", help="JSON export: a list of transforms or a configuration export with 'objects'.")
+    parser.add_argument("--output", default="decompiled", help="Output directory (default: decompiled).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    count = inexact = 0
+    with open(args.export, encoding="utf-8") as export_file:
+        for name, source, exact in decompile_many(iter_export(export_file), args.workers):
+            with open(os.path.join(args.output, file_name(name)[:-len(".json")] + ".py"), "w", encoding="utf-8") as output:
+                output.write(source)
+            count += 1
+            if not exact:
+                inexact += 1
+                sys.stderr.write("%s: the generated code does not reproduce the exported JSON exactly.\n" % name)
+    sys.stderr.write("Decompiled %d transforms (%d inexact).\n" % (count, inexact))
+    return 1 if inexact else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
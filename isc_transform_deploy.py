@@ -0,0 +1,341 @@
+import argparse
+import email.utils
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from urllib.parse import urlencode, urlsplit
+
+from isc_transform_diff import has_semantic_changes
+from isc_transform_serializer import iter_ndjson
+
+
+TRANSFORMS_PATH = "/v3/transforms"
+TOKEN_PATH = "/oauth/token"
+PAGE_SIZE = 250
+
+# Status codes that are retried after a delay: rate limiting and transient gateway errors.
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+DeployResult = namedtuple("DeployResult", ["name", "action", "id", "error"])
+
+
+class DeployError(Exception):
+    """
+    Raised when the tenant rejects a request, or keeps rate limiting it after every retry.
+    """
+
+    def __init__(self, message, status=None, body=None):
+        super(DeployError, self).__init__(message)
+        self.status = status
+        self.body = body
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections to one host.
+
+    A connection is used by one request at a time; idle connections are kept for the next request instead of
+    opening a new TCP and TLS session per call.
+    """
+
+    def __init__(self, base_url, size=8, timeout=60):
+        """
+        :param base_url: Scheme and host of the tenant API, e.g. 'https://acme.api.identitynow.com'.
+        :param size: (optional) Maximum number of idle connections kept open. Default is 8.
+        :param timeout: (optional) Socket timeout in seconds. Default is 60.
+        """
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError("Invalid base URL %r; expected http(s)://host[:port]." % base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                self.opened += 1
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection):
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends one request on a pooled connection.
+
+        A request that fails because the server closed an idle keep-alive connection is retried once on a new one.
+
+        :return: A tuple (status, headers, body) where headers is an http.client.HTTPMessage and body is bytes.
+        """
+        for attempt in (0, 1):
+            connection = self._acquire()
+            try:
+                connection.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, response.headers, data
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def parse_retry_after(value):
+    """
+    Converts a Retry-After header, either a number of seconds or an HTTP date, into a delay.
+
+    :param value: The header value, or None.
+    :return: The delay in seconds, or None when the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if parsed.tzinfo is None:
+            # "-0000" dates carry no zone information; HTTP dates are always UTC.
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return max(0.0, parsed.timestamp() - time.time())
+    return max(0.0, seconds) if math.isfinite(seconds) else None
+
+
+class TransformClient(object):
+    """
+    Client for the transforms API of an Identity Security Cloud tenant.
+
+    Requests share a pool of keep-alive connections. Rate-limited requests (HTTP 429) wait for the Retry-After
+    delay plus up to 25% jitter, and every other request waits too, so that concurrent workers back off together instead of
+    hammering the tenant. Other transient errors, and responses without Retry-After, are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, base_url, token=None, client_id=None, client_secret=None, workers=8, max_retries=6,
+                 backoff=0.5, max_backoff=30.0, max_retry_after=None):
+        """
+        :param base_url: Tenant API URL, e.g. 'https://acme.api.identitynow.com'.
+        :param token: (optional) An access token. When not given, one is requested with client_id and client_secret.
+        :param client_id: (optional) Personal access token client ID.
+        :param client_secret: (optional) Personal access token client secret.
+        :param workers: (optional) Number of concurrent requests used by deploy(). Default is 8.
+        :param max_retries: (optional) Retries per request for rate limiting and transient errors. Default is 6.
+        :param backoff: (optional) Base delay in seconds of the exponential backoff. Default is 0.5.
+        :param max_backoff: (optional) Maximum delay in seconds of the exponential backoff. Default is 30.
+        :param max_retry_after: (optional) Maximum delay in seconds honoured from a Retry-After header. Default is
+                                None: the tenant's delay is always honoured.
+        """
+        if token is None and not (client_id and client_secret):
+            raise ValueError("Provide either an access token or a client ID and client secret.")
+        self.pool = ConnectionPool(base_url, size=workers)
+        self.token = token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.lock = threading.Lock()
+        self.paused_until = 0.0
+        self.retries = 0
+
+    def _authenticate(self, expired=None):
+        with self.lock:
+            if self.token is not None and self.token != expired:
+                return self.token
+            if not (self.client_id and self.client_secret):
+                raise DeployError("The access token was rejected and no client credentials are available.", 401)
+            query = urlencode({"grant_type": "client_credentials", "client_id": self.client_id,
+                               "client_secret": self.client_secret})
+            status, headers, body = self.pool.request("POST", "%s?%s" % (TOKEN_PATH, query))
+            if status != 200:
+                raise DeployError("Authentication failed with HTTP %d." % status, status, body)
+            self.token = json.loads(body)["access_token"]
+            return self.token
+
+    def _wait(self, delay):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def request(self, method, path, payload=None):
+        """
+        Sends an authenticated JSON request, retrying rate-limited and transient failures.
+
+        :param method: HTTP method.
+        :param path: Path below the base URL, e.g. '/v3/transforms'.
+        :param payload: (optional) JSON-serializable request body.
+        :return: The decoded JSON response, or None for empty responses.
+        """
+        body = None if payload is None else json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        token = self.token or self._authenticate()
+        attempt = 0
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            headers = {"Authorization": "Bearer " + token, "Accept": "application/json"}
+            if body is not None:
+                headers["Content-Type"] = "application/json"
+            status, response_headers, data = self.pool.request(method, path, body, headers)
+            if status == 401 and attempt == 0 and self.client_id:
+                token = self._authenticate(expired=token)
+                attempt += 1
+                continue
+            if status in RETRY_STATUSES and attempt < self.max_retries:
+                attempt += 1
+                self.retries += 1
+                exponential = min(self.max_backoff, self.backoff * 2 ** attempt)
+                retry_after = parse_retry_after(response_headers.get("Retry-After"))
+                if retry_after is not None:
+                    if self.max_retry_after is not None:
+                        retry_after = min(self.max_retry_after, retry_after)
+                    self._wait(retry_after * random.uniform(1.0, 1.25))
+                else:
+                    time.sleep(random.uniform(0, exponential))
+                continue
+            if status >= 400:
+                raise DeployError("%s %s failed with HTTP %d: %s" % (method, path, status, data[:500].decode("utf-8", "replace")),
+                                  status, data)
+            return json.loads(data) if data.strip() else None
+
+    def list_transforms(self):
+        """
+        Lists every transform of the tenant, following pagination.
+
+        :return: A list of transform dictionaries, including their 'id'.
+        """
+        transforms = []
+        while True:
+            page = self.request("GET", "%s?%s" % (TRANSFORMS_PATH, urlencode({"limit": PAGE_SIZE, "offset": len(transforms)})))
+            transforms.extend(page)
+            if len(page) < PAGE_SIZE:
+                return transforms
+
+    def create(self, tree):
+        """
+        Creates a transform.
+
+        :param tree: A named transform, as returned by transform(..., output_enabled=True).
+        :return: The created transform, including its 'id'.
+        """
+        return self.request("POST", TRANSFORMS_PATH, tree)
+
+    def update(self, transform_id, tree):
+        """
+        Replaces the definition of an existing transform. The name and type of a transform cannot be changed.
+
+        :param transform_id: The ID of the transform in the tenant.
+        :param tree: A named transform, as returned by transform(..., output_enabled=True).
+        :return: The updated transform.
+        """
+        return self.request("PUT", "%s/%s" % (TRANSFORMS_PATH, transform_id), tree)
+
+    def _upsert(self, tree, existing, force):
+        name = tree["name"]
+        try:
+            if existing is None:
+                return DeployResult(name, CREATED, self.create(tree).get("id"), None)
+            if not force and not has_semantic_changes(existing, tree):
+                return DeployResult(name, UNCHANGED, existing.get("id"), None)
+            self.update(existing["id"], tree)
+            return DeployResult(name, UPDATED, existing["id"], None)
+        except DeployError as exception:
+            return DeployResult(name, FAILED, existing and existing.get("id"), str(exception))
+        except (OSError, http.client.HTTPException) as exception:
+            # Connection failures (refused, reset, timed out, malformed response) only fail this transform.
+            message = str(exception) or exception.__class__.__name__
+            return DeployResult(name, FAILED, existing and existing.get("id"), "Connection error: %s" % message)
+
+    def deploy(self, transforms, force=False):
+        """
+        Creates or updates many transforms concurrently.
+
+        The tenant's transforms are listed once up front to decide, by name, between creating and updating each
+        transform; transforms without semantic changes (see isc_transform_diff) are skipped unless force is True.
+        A failed transform, whether rejected by the tenant or lost to a connection error, does not stop the others.
+
+        :param transforms: An iterable of named transforms, as returned by transform(..., output_enabled=True).
+        :param force: (optional) Boolean indicating whether unchanged transforms are updated anyway. Default is False.
+        :return: A list of DeployResult tuples (name, action, id, error), in the order of transforms.
+        """
+        transforms = [tree.to_dict() if hasattr(tree, "to_dict") else tree for tree in transforms]
+        names = [tree["name"] for tree in transforms]
+        if len(set(names)) != len(names):
+            raise ValueError("Transform names must be unique within a deployment.")
+        existing = {tree["name"]: tree for tree in self.list_transforms()}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda tree: self._upsert(tree, existing.get(tree["name"]), force), transforms))
+
+    def close(self):
+        self.pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or update transforms in an Identity Security Cloud tenant.")
+    parser.add_argument("transforms", help="NDJSON file of named transforms (e.g. written by isc_transform_bulk.py).")
+    parser.add_argument("--url", default=os.environ.get("ISC_BASE_URL"),
+                        help="Tenant API URL, e.g. https://acme.api.identitynow.com (default: $ISC_BASE_URL).")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent requests (default: 8).")
+    parser.add_argument("--force", action="store_true", help="Also update transforms without semantic changes.")
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("--url or $ISC_BASE_URL is required.")
+
+    client = TransformClient(args.url, token=os.environ.get("ISC_ACCESS_TOKEN"), client_id=os.environ.get("ISC_CLIENT_ID"),
+                             client_secret=os.environ.get("ISC_CLIENT_SECRET"), workers=args.workers)
+    with open(args.transforms, encoding="utf-8") as transforms_file:
+        results = client.deploy(iter_ndjson(transforms_file), force=args.force)
+    client.close()
+    for result in results:
+        if result.action != UNCHANGED:
+            sys.stdout.write("%-9s %s%s\n" % (result.action, result.name, ": " + result.error if result.error else ""))
+    counts = {action: sum(1 for result in results if result.action == action) for action in (CREATED, UPDATED, UNCHANGED, FAILED)}
+    sys.stderr.write("%(created)d created, %(updated)d updated, %(unchanged)d unchanged, %(failed)d failed.\n" % counts)
+    return 1 if counts[FAILED] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import argparse
+import json
+import sys
+from collections import namedtuple
+from difflib import SequenceMatcher
+
+from isc_transform_cache import content_hash, iter_hashes
+from isc_transform_vtl import VelocitySyntaxError, minify
+
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+# Keys the tenant adds to stored transforms; they never come out of the builders.
+TENANT_METADATA = frozenset(["id", "created", "modified"])
+
+Change = namedtuple("Change", ["path", "kind", "old", "new", "semantic"])
+Change.__doc__ = """
+A difference between two versions of a transform.
+
+path is the node path in the new version (the old version for removals), kind is 'added', 'removed' or 'changed',
+old and new are the values on each side (None when absent) and semantic is False for cosmetic changes.
+"""
+
+
+def _same_template(old, new):
+    # Like static(), only values containing "#end" are Velocity templates; whitespace in plain values is output.
+    if "#end" not in old or "#end" not in new:
+        return old == new
+    try:
+        return minify(old) == minify(new)
+    except VelocitySyntaxError:
+        return False
+
+
+def _is_semantic(top_level, key, parent, old, new):
+    if top_level and key in TENANT_METADATA:
+        return False
+    if key == "value" and isinstance(old, str) and isinstance(new, str) and parent is not None \
+            and parent.get("type") == "static":
+        return not _same_template(old, new)
+    return True
+
+
+def _keys(link):
+    # Paths are built lazily as linked (parent, key) pairs: only the paths of reported changes are ever joined.
+    keys = []
+    while link is not None:
+        link, key = link
+        keys.append(key)
+    keys.reverse()
+    return keys
+
+
+def _path(link):
+    # Same format as isc_transform_analysis.join_path, joined once instead of copying the prefix at every level.
+    parts = []
+    started = False
+    for key in _keys(link):
+        part = "[%d]" % key if isinstance(key, int) else ".%s" % key if started else "%s" % key
+        parts.append(part)
+        started = started or bool(part)
+    return "".join(parts)
+
+
+def _static_parent(link, tree):
+    # 'value' attributes only matter inside static transforms: resolve the transform that owns the attributes node.
+    keys = _keys(link)
+    if keys[-2:] != ["attributes", "value"]:
+        return None
+    node = tree
+    for key in keys[:-2]:
+        node = node[key]
+    return node if isinstance(node, dict) else None
+
+
+def _hashes(tree):
+    return {id(value): digest for path, value, digest in iter_hashes(tree)}
+
+
+def _hash(hashes, value):
+    # Children of frozen Nodes whose hash was already known are not in the table.
+    digest = hashes.get(id(value))
+    return digest if digest is not None else content_hash(value)
+
+
+def _compare(old, new):
+    """
+    Compares two trees without recursion and returns their changes in document order.
+    """
+    context = (_hashes(old), _hashes(new), new)
+    changes = []
+    # A stack of _steps() generators: each yields changes, or the arguments of a pair of children to compare first.
+    stack = [_steps(old, new, None, None, None, context)]
+    while stack:
+        for step in stack[-1]:
+            if isinstance(step, Change):
+                changes.append(step)
+            else:
+                stack.append(_steps(*(step + (context,))))
+                break
+        else:
+            stack.pop()
+    return changes
+
+
+def _steps(old, new, old_link, new_link, key, context):
+    old_hashes, new_hashes, new_tree = context
+    if _hash(old_hashes, old) == _hash(new_hashes, new):
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for name in old:
+            if name not in new:
+                yield Change(_path((old_link, name)), REMOVED, old[name], None,
+                             _is_semantic(old_link is None, name, None, old[name], None))
+        for name in new:
+            if name in old:
+                yield old[name], new[name], (old_link, name), (new_link, name), name
+            else:
+                yield Change(_path((new_link, name)), ADDED, None, new[name],
+                             _is_semantic(new_link is None, name, None, None, new[name]))
+        return
+    if isinstance(old, list) and isinstance(new, list):
+        old_items = [_hash(old_hashes, item) for item in old]
+        new_items = [_hash(new_hashes, item) for item in new]
+        matcher = SequenceMatcher(None, old_items, new_items, autojunk=False)
+        for operation, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+            if operation == "equal":
+                continue
+            paired = min(old_end - old_start, new_end - new_start) if operation == "replace" else 0
+            for offset in range(paired):
+                yield (old[old_start + offset], new[new_start + offset], (old_link, old_start + offset),
+                       (new_link, new_start + offset), None)
+            for index in range(old_start + paired, old_end):
+                yield Change(_path((old_link, index)), REMOVED, old[index], None, True)
+            for index in range(new_start + paired, new_end):
+                yield Change(_path((new_link, index)), ADDED, None, new[index], True)
+        return
+    parent = _static_parent(new_link, new_tree) if key == "value" else None
+    yield Change(_path(new_link), CHANGED, old, new, _is_semantic(new_link is not None and new_link[0] is None, key,
+                                                                  parent, old, new))
+
+
+def diff(old, new):
+    """
+    Computes the node-level differences between two versions of a transform.
+
+    Both trees are hashed once (see isc_transform_cache.iter_hashes); the comparison then only descends into
+    branches whose hashes differ, so identical subtrees are skipped whatever their size. Like the hashing, the
+    comparison uses an explicit stack, so deeply nested ladders do not hit the recursion limit. Key order never counts
+    as a difference, list items are aligned by content so an inserted firstValid entry is reported as one
+    addition, and changes are classified as cosmetic when they cannot change the transform's behavior: tenant
+    metadata ('id', 'created', 'modified') and static Velocity templates (values containing "#end", as in static()) that
+    only differ in comments or formatting (see isc_transform_vtl.minify).
+
+    :param old: The previous version, e.g. the transform dictionary stored in the tenant.
+    :param new: The new version, e.g. the dictionary produced by the builders.
+    :return: A list of Change tuples, in document order.
+    """
+    return _compare(_plain(old), _plain(new))
+
+
+def _plain(tree):
+    return tree.to_dict() if hasattr(tree, "to_dict") else tree
+
+
+def has_semantic_changes(old, new):
+    """
+    Decides whether a new version of a transform behaves differently from the old one.
+
+    :param old: The previous version of the transform.
+    :param new: The new version of the transform.
+    :return: True when diff() reports at least one semantic change.
+    """
+    return any(change.semantic for change in diff(old, new))
+
+
+def changed_transforms(deployed, generated):
+    """
+    Selects the generated transforms that need to be deployed.
+
+    :param deployed: An iterable of the transforms currently in the tenant.
+    :param generated: An iterable of named transforms produced by the builders.
+    :return: A list of (name, changes) tuples, in the order of generated, for every transform that is new
+             (changes is None) or has semantic changes (changes lists all of its differences).
+    """
+    deployed = {tree["name"]: tree for tree in map(_plain, deployed)}
+    selected = []
+    for tree in map(_plain, generated):
+        if tree["name"] not in deployed:
+            selected.append((tree["name"], None))
+            continue
+        changes = diff(deployed[tree["name"]], tree)
+        if any(change.semantic for change in changes):
+            selected.append((tree["name"], changes))
+    return selected
+
+
+def _summary(value):
+    text = json.dumps(value)
+    return text if len(text) <= 60 else text[:57] + "..."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the structural differences between two transform JSON files.")
+    parser.add_argument("old", help="JSON file with the previous version (e.g. exported from the tenant).")
+    parser.add_argument("new", help="JSON file with the new version.")
+    parser.add_argument("--semantic", action="store_true", help="Only show semantic changes.")
+    args = parser.parse_args(argv)
+
+    with open(args.old, encoding="utf-8") as old_file, open(args.new, encoding="utf-8") as new_file:
+        changes = diff(json.load(old_file), json.load(new_file))
+    for change in changes:
+        if change.semantic or not args.semantic:
+            sys.stdout.write("%-8s %-9s %s: %s -> %s\n" % (change.kind, "semantic" if change.semantic else "cosmetic",
+                                                           change.path or "(root)", _summary(change.old),
+                                                           _summary(change.new)))
+    return 1 if any(change.semantic for change in changes) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,957 @@
+import calendar
+import functools
+import random
+import re
+import string
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+
+from isc_transform_cache import iter_hashes
+from isc_transform_nodes import Node, thaw
+from isc_transform_vtl import compile_template
+from isc_transform_walk import walk
+
+
+class TransformEvaluationError(ValueError):
+    """
+    Raised when a transform cannot be compiled or produces an error while being evaluated locally.
+    """
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+WIN32_EPOCH = datetime(1601, 1, 1, tzinfo=timezone.utc)
+
+NAMED_DATE_FORMATS = {
+    "ISO8601": "yyyy-MM-dd'T'HH:mm:ss.SSSX",
+    "LDAP": "yyyyMMddHHmmss.S'Z'",
+    "PEOPLE_SOFT": "MM/dd/yyyy",
+}
+
+COUNTRY_CALLING_CODES = {
+    "US": "1", "CA": "1", "GB": "44", "BR": "55", "DE": "49", "FR": "33", "IN": "91",
+    "AU": "61", "MX": "52", "ES": "34", "IT": "39", "JP": "81", "CN": "86", "NL": "31",
+}
+
+NAME_PARTICLES = {"da", "de", "del", "der", "di", "do", "dos", "du", "la", "le", "van", "von"}
+
+RESERVED_STATIC_ATTRIBUTES = {"value", "requiresPeriodicRefresh"}
+RESERVED_CONDITIONAL_ATTRIBUTES = {"expression", "positiveCondition", "negativeCondition"}
+USERNAME_GENERATOR_ATTRIBUTES = {"sourceCheck", "patterns"}
+
+VARIABLE_PATTERN = re.compile(r"\$\{(\w+)\}|\$(\w+)")
+
+
+class _Context(object):
+    """
+    Per-identity state shared by every compiled node during one evaluation.
+    """
+    __slots__ = ("identity", "input", "now", "seed", "_random", "is_unique", "fetch_accounts", "accounts", "memo",
+                 "account_fetches", "fetches_saved", "cache_hits")
+
+    def __init__(self, identity, input, now, seed, is_unique, fetch_accounts):
+        self.identity = identity
+        self.input = input
+        self.now = now
+        self.seed = seed
+        self._random = None
+        self.is_unique = is_unique
+        self.fetch_accounts = fetch_accounts
+        self.accounts = {}
+        self.memo = {}
+        self.account_fetches = 0
+        self.fetches_saved = 0
+        self.cache_hits = 0
+
+    def source_accounts(self, source_name):
+        """
+        Returns the identity's accounts on a source, fetching them at most once per evaluation.
+        """
+        accounts = self.accounts.get(source_name)
+        if accounts is None:
+            accounts = self.accounts[source_name] = self.fetch_accounts(self.identity, source_name)
+            self.account_fetches += 1
+        else:
+            self.fetches_saved += 1
+        return accounts
+
+    @property
+    def random(self):
+        """
+        The random generator of the random* transforms, seeded on first use: seeding costs more than most evaluations.
+        """
+        if self._random is None:
+            self._random = random.Random(self.seed)
+        return self._random
+
+
+NONDETERMINISTIC_TYPES = ("randomAlphaNumeric", "randomNumeric", "generateRandomString", "usernameGenerator")
+
+
+def compile_transform(tree, transforms=None, cache=None):
+    """
+    Compiles a transform dictionary into a tree of Python closures that can be evaluated locally.
+
+    The tree is walked once, without recursion; the returned function can then be called for any number of
+    identities. Structurally identical subtrees (equal Merkle hashes, see isc_transform_cache.iter_hashes) are
+    compiled once and their result is memoized within one identity's evaluation, and all 'accountAttribute' reads
+    of a source share one account fetch per identity.
+
+    :param tree: A transform dictionary as produced by the builders or by transform(..., output_enabled=True), or
+                 a frozen Node (see isc_transform_nodes).
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries, used to resolve 'reference' transforms.
+    :param cache: (optional) A persistent result cache (see isc_transform_result_cache.ResultCache) whose wrap()
+                  method is given each subtree and its compiled closure, and returns the closure to use.
+    :return: A function run(identity, input=None, now=None, seed=None, is_unique=None, fetch_accounts=None, stats=None)
+             returning the transform output. When a stats dictionary is given, the 'evaluations', 'account_fetches',
+             'fetches_saved' and 'cache_hits' counters in it are incremented.
+    """
+    env = {"transforms": transforms or {}, "references": {}, "resolving": set(), "compiled": {}, "occurrences": {},
+           "cache": cache, "keys": {}, "random_references": {}}
+    node = _compile_tree(_thawed(tree), env)
+
+    def run(identity, input=None, now=None, seed=None, is_unique=None, fetch_accounts=None, stats=None):
+        if now is None:
+            now = datetime.now(timezone.utc)
+        context = _Context(identity, input, now, seed, is_unique or _always_unique, fetch_accounts or _accounts)
+        result = node(context)
+        if stats is not None:
+            for counter, value in (("evaluations", 1), ("account_fetches", context.account_fetches),
+                                   ("fetches_saved", context.fetches_saved), ("cache_hits", context.cache_hits)):
+                stats[counter] = stats.get(counter, 0) + value
+        return result
+
+    return run
+
+
+def evaluate(tree, identity, input=None, transforms=None, now=None, seed=None, is_unique=None, fetch_accounts=None, stats=None):
+    """
+    Evaluates a transform against a single local identity record.
+
+    Use compile_transform() instead when evaluating the same transform for many identities.
+
+    :param tree: A transform dictionary as produced by the builders or by transform(..., output_enabled=True).
+    :param identity: Dictionary with the identity's 'attributes', 'accounts' and (optional) 'references'.
+    :param input: (optional) Implicit input value used by transforms without an explicit 'input'.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+    :param seed: (optional) Seed for the random generators used by the random* transforms.
+    :param is_unique: (optional) Callable used by 'usernameGenerator' to check if a candidate value is unique.
+    :param fetch_accounts: (optional) Callable (identity, source_name) returning the list of account attribute
+                           dictionaries of the identity on that source. Default reads identity['accounts'].
+    :param stats: (optional) Dictionary whose evaluation counters are incremented (see compile_transform()).
+    :return: The value produced by the transform.
+    """
+    return compile_transform(tree, transforms)(identity, input=input, now=now, seed=seed, is_unique=is_unique,
+                                               fetch_accounts=fetch_accounts, stats=stats)
+
+
+def _always_unique(value):
+    return True
+
+
+def _thawed(tree):
+    # Frozen nodes, also nested inside dictionaries, are compiled as the dictionaries they stand for.
+    if isinstance(tree, Node) or any(isinstance(value, Node) for value in walk(tree)):
+        return thaw(tree)
+    return tree
+
+
+def _child_nodes(value):
+    """
+    Yields the transform nodes directly below a node, looking through its attributes, lists and plain objects.
+    """
+    pending = list(value.values())
+    while pending:
+        item = pending.pop()
+        if isinstance(item, dict):
+            if item.get("type") in _COMPILERS:
+                yield item
+            else:
+                pending.extend(item.values())
+        elif isinstance(item, list):
+            pending.extend(item)
+
+
+def _is_random_reference(transform_id, env):
+    found = env["random_references"]
+    if transform_id in found:
+        return found[transform_id]
+    # Follows the chain of referenced transforms with a worklist; circular references terminate (they fail to
+    # compile anyway).
+    reached = {transform_id}
+    pending = [transform_id]
+    random_values = False
+    while pending and not random_values:
+        for value in walk(env["transforms"].get(pending.pop())):
+            if not isinstance(value, Mapping):
+                continue
+            if value.get("type") in NONDETERMINISTIC_TYPES:
+                random_values = True
+                break
+            if value.get("type") == "reference" and isinstance(value.get("attributes"), Mapping):
+                target = value["attributes"].get("id")
+                if found.get(target):
+                    random_values = True
+                    break
+                if target not in reached and target not in found:
+                    reached.add(target)
+                    pending.append(target)
+    if random_values:
+        found[transform_id] = True
+    else:
+        # Nothing reachable uses random values: the same holds for every transform reached on the way.
+        found.update((reached_id, False) for reached_id in reached)
+    return found[transform_id]
+
+
+def _index(tree, env, count):
+    """
+    Hashes every transform node of a tree, children first, and records (node, hash, random) under the node's id in
+    env['keys']; random tells whether the subtree uses random values, so its result must not be memoized.
+
+    :return: The transform nodes in post-order.
+    """
+    keys = env["keys"]
+    occurrences = env["occurrences"]
+    nodes = []
+    for path, value, digest in iter_hashes(tree):
+        if not (isinstance(value, dict) and value.get("type") in _COMPILERS):
+            continue
+        node_type = value["type"]
+        random_values = node_type in NONDETERMINISTIC_TYPES or any(keys[id(child)][2] for child in _child_nodes(value))
+        if not random_values and node_type == "reference" and isinstance(value.get("attributes"), dict):
+            random_values = _is_random_reference(value["attributes"].get("id"), env)
+        # The node itself is kept in the entry, so its id cannot be reused by another object while env is alive.
+        keys[id(value)] = (value, digest, random_values)
+        if count:
+            occurrences[digest] = occurrences.get(digest, 0) + 1
+        nodes.append(value)
+    return nodes
+
+
+def _compile_tree(tree, env):
+    # Nodes are compiled children first: a parent then finds each child compiled, so compiling never recurses deeply.
+    for node in _index(tree, env, count=True):
+        _compile_value(node, env)
+    return _compile_value(tree, env)
+
+
+def _memoized(node, slot):
+    def memoized(context):
+        key = (slot, context.input)
+        try:
+            result = context.memo[key]
+        except KeyError:
+            result = context.memo[key] = node(context)
+            return result
+        except TypeError:
+            # Unhashable implicit input: evaluate without memoization.
+            return node(context)
+        context.cache_hits += 1
+        return result
+    return memoized
+
+
+def _compile_value(value, env):
+    if isinstance(value, dict):
+        if "type" in value and value["type"] in _COMPILERS:
+            entry = env["keys"].get(id(value))
+            if entry is None:
+                _index(value, env, count=False)
+                entry = env["keys"][id(value)]
+            node, key, random_values = entry
+            compiled = env["compiled"].get(key)
+            if compiled is None:
+                compiled = _COMPILERS[value["type"]](value.get("attributes") or {}, env)
+                if env["cache"] is not None:
+                    compiled = env["cache"].wrap(value, compiled, env["transforms"])
+                if env["occurrences"].get(key, 0) > 1 and not random_values:
+                    compiled = _memoized(compiled, len(env["compiled"]))
+                env["compiled"][key] = compiled
+            return compiled
+        if isinstance(value.get("transform"), dict):
+            # usernameGenerator() wraps the transform inside an identity profile attribute definition.
+            return _compile_value(value["transform"], env)
+        raise TransformEvaluationError("Unsupported transform type: %r" % value.get("type"))
+    if isinstance(value, list):
+        items = [_compile_value(item, env) for item in value]
+        return lambda context: [item(context) for item in items]
+    return lambda context: value
+
+
+def _compile_input(attributes, env):
+    if "input" in attributes:
+        return _compile_value(attributes["input"], env)
+    return _implicit_input
+
+
+def _implicit_input(context):
+    return context.input
+
+
+def _compile_variables(attributes, exclude, env):
+    return [(name, _compile_value(value, env)) for name, value in attributes.items() if name not in exclude]
+
+
+def _to_string(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+def _accounts(identity, source_name):
+    accounts = identity.get("accounts") or {}
+    if isinstance(accounts, Mapping):
+        found = accounts.get(source_name)
+        if found is None:
+            return []
+        return found if isinstance(found, list) else [found]
+    return [account.get("attributes") or {} for account in accounts if account.get("sourceName") == source_name]
+
+
+# ---------------------------------------------------------------------------
+# Attribute access
+# ---------------------------------------------------------------------------
+
+def _compile_account_attribute(attributes, env):
+    source_name = attributes["sourceName"]
+    attribute_name = attributes["attributeName"]
+    sort_attribute = attributes.get("accountSortAttribute")
+    sort_descending = _is_true(attributes.get("accountSortDescending"))
+    return_first_link = _is_true(attributes.get("accountReturnFirstLink"))
+
+    def account_attribute(context):
+        return _select_account_value(context.source_accounts(source_name), attribute_name, sort_attribute,
+                                     sort_descending, return_first_link)
+
+    return account_attribute
+
+
+def _select_account_value(accounts, attribute_name, sort_attribute=None, sort_descending=False, return_first_link=False):
+    """
+    Picks the value of an account attribute among an identity's accounts on a source, as 'accountAttribute' does:
+    accounts are sorted by sort_attribute when given, then the first non-null value is returned, or the value of the
+    first account when return_first_link is set.
+    """
+    if sort_attribute is not None:
+        accounts = sorted(accounts, key=lambda account: _to_string(account.get(sort_attribute)) or "", reverse=sort_descending)
+    for account in accounts:
+        value = account.get(attribute_name)
+        if value is not None or return_first_link:
+            return value
+    return None
+
+
+def _compile_identity_attribute(attributes, env):
+    name = attributes["name"]
+    return lambda context: (context.identity.get("attributes") or {}).get(name)
+
+
+def _compile_reference(attributes, env):
+    transform_id = attributes["id"]
+    input_node = _compile_input(attributes, env)
+    if transform_id not in env["references"]:
+        if transform_id not in env["transforms"]:
+            raise TransformEvaluationError("Referenced transform %r is not available locally." % transform_id)
+        if transform_id in env["resolving"]:
+            raise TransformEvaluationError("Circular reference to transform %r." % transform_id)
+        env["resolving"].add(transform_id)
+        env["references"][transform_id] = _compile_tree(_thawed(env["transforms"][transform_id]), env)
+        env["resolving"].discard(transform_id)
+    referenced = env["references"][transform_id]
+
+    def reference(context):
+        previous = context.input
+        context.input = input_node(context)
+        try:
+            return referenced(context)
+        finally:
+            context.input = previous
+
+    return reference
+
+
+def _compile_rule(attributes, env):
+    operation = attributes.get("operation")
+    if operation == "getReferenceIdentityAttribute":
+        uid = attributes["uid"]
+        attribute_name = attributes["attributeName"]
+
+        def get_reference_identity_attribute(context):
+            referenced = (context.identity.get("references") or {}).get(uid) or {}
+            return referenced.get(attribute_name)
+
+        return get_reference_identity_attribute
+    if operation == "generateRandomString":
+        length = int(attributes.get("length", 10))
+        alphabet = string.ascii_letters
+        if _is_true(attributes.get("includeNumbers", "true")):
+            alphabet += string.digits
+        if _is_true(attributes.get("includeSpecialChars", "true")):
+            alphabet += "!@#$%^&*"
+        return lambda context: "".join(context.random.choice(alphabet) for _ in range(length))
+    raise TransformEvaluationError("Rule operation %r cannot be evaluated locally." % operation)
+
+
+def _is_true(value):
+    return value is True or (isinstance(value, str) and value.lower() == "true")
+
+
+# ---------------------------------------------------------------------------
+# Control flow
+# ---------------------------------------------------------------------------
+
+def _compile_static(attributes, env):
+    value = attributes.get("value")
+    variables = _compile_variables(attributes, RESERVED_STATIC_ATTRIBUTES, env)
+    if not isinstance(value, str) or ("$" not in value and "#" not in value):
+        return lambda context: value
+    template = compile_template(value)
+
+    def static(context):
+        return template({name: node(context) for name, node in variables})
+
+    return static
+
+
+def _interpolate(template, scope):
+    def substitute(match):
+        name = match.group(1) or match.group(2)
+        if name in scope and scope[name] is not None:
+            return _to_string(scope[name])
+        return match.group(0)
+    return VARIABLE_PATTERN.sub(substitute, template)
+
+
+def _compile_first_valid(attributes, env):
+    values = [_compile_value(value, env) for value in attributes.get("values", [])]
+    ignore_errors = _is_true(attributes.get("ignoreErrors"))
+
+    def first_valid(context):
+        for node in values:
+            try:
+                result = node(context)
+            except Exception:
+                if ignore_errors:
+                    continue
+                raise
+            if result is not None:
+                return result
+        return None
+
+    return first_valid
+
+
+def _compile_conditional(attributes, env):
+    expression = attributes["expression"]
+    match = re.match(r"^\s*(.*?)\s+eq\s+(.*?)\s*$", expression)
+    if match is None:
+        raise TransformEvaluationError("Conditional expression must be formatted as 'ValueA eq ValueB': %r" % expression)
+    operands = match.groups()
+    positive = _compile_value(attributes.get("positiveCondition"), env)
+    negative = _compile_value(attributes.get("negativeCondition"), env)
+    variables = _compile_variables(attributes, RESERVED_CONDITIONAL_ATTRIBUTES, env)
+
+    def conditional(context):
+        scope = {name: node(context) for name, node in variables}
+        left, right = (_interpolate(operand, scope) for operand in operands)
+        return positive(context) if left == right else negative(context)
+
+    return conditional
+
+
+def _compile_concat(attributes, env):
+    values = [_compile_value(value, env) for value in attributes.get("values", [])]
+    return lambda context: "".join(_to_string(node(context)) or "" for node in values)
+
+
+def _compile_lookup(attributes, env):
+    table = {str(key): value for key, value in attributes["table"].items()}
+    input_node = _compile_input(attributes, env)
+
+    def lookup(context):
+        key = _to_string(input_node(context))
+        if key in table:
+            return table[key]
+        if "default" in table:
+            return table["default"]
+        raise TransformEvaluationError("No lookup table entry matches %r and no default is defined." % key)
+
+    return lookup
+
+
+# ---------------------------------------------------------------------------
+# String operations
+# ---------------------------------------------------------------------------
+
+def _compile_string_function(function):
+    def compiler(attributes, env):
+        input_node = _compile_input(attributes, env)
+
+        def string_function(context):
+            value = input_node(context)
+            return None if value is None else function(_to_string(value))
+
+        return string_function
+    return compiler
+
+
+def _compile_pad(left):
+    def compiler(attributes, env):
+        length = int(attributes["length"])
+        padding = attributes.get("padding", " ") or " "
+        input_node = _compile_input(attributes, env)
+
+        def pad(context):
+            value = _to_string(input_node(context))
+            if value is None:
+                return None
+            missing = length - len(value)
+            if missing <= 0:
+                return value
+            fill = (padding * missing)[:missing]
+            return fill + value if left else value + fill
+
+        return pad
+    return compiler
+
+
+def _compile_substring(attributes, env):
+    begin = int(attributes["begin"])
+    end = int(attributes.get("end", -1))
+    begin_offset = int(attributes.get("beginOffset", 0))
+    end_offset = int(attributes.get("endOffset", 0))
+    input_node = _compile_input(attributes, env)
+
+    def substring(context):
+        value = _to_string(input_node(context))
+        if value is None:
+            return None
+        start = (0 if begin == -1 else begin) + begin_offset
+        stop = (len(value) if end == -1 else end) + end_offset
+        if start < 0 or stop > len(value) or start > stop:
+            raise TransformEvaluationError("Substring bounds [%d, %d) are out of range for %r." % (start, stop, value))
+        return value[start:stop]
+
+    return substring
+
+
+def _compile_split(attributes, env):
+    delimiter = re.compile(attributes["delimiter"])
+    index = int(attributes["index"])
+    throws = attributes.get("throws", True) is not False
+    input_node = _compile_input(attributes, env)
+
+    def split(context):
+        value = _to_string(input_node(context))
+        if value is None:
+            return None
+        parts = delimiter.split(value)
+        while parts and parts[-1] == "":
+            parts.pop()
+        if 0 <= index < len(parts):
+            return parts[index]
+        if throws:
+            raise TransformEvaluationError("Split index %d is out of range for %r." % (index, value))
+        return None
+
+    return split
+
+
+def _java_replacement(replacement):
+    # Java uses $1 for group references and backslash for escaping; Python uses \g<1>.
+    return re.sub(r"\\(.)|\$(\d+)", lambda match: match.group(1).replace("\\", "\\\\") if match.group(1) else "\\g<%s>" % match.group(2), replacement)
+
+
+def _compile_replace(attributes, env):
+    pattern = re.compile(attributes["regex"])
+    replacement = _java_replacement(attributes["replacement"])
+    input_node = _compile_input(attributes, env)
+
+    def replace(context):
+        value = _to_string(input_node(context))
+        return None if value is None else pattern.sub(replacement, value)
+
+    return replace
+
+
+def _compile_replace_all(attributes, env):
+    table = [(re.compile(regex), _java_replacement(replacement)) for regex, replacement in attributes["table"].items()]
+    input_node = _compile_input(attributes, env)
+
+    def replace_all(context):
+        value = _to_string(input_node(context))
+        if value is None:
+            return None
+        for pattern, replacement in table:
+            value = pattern.sub(replacement, value)
+        return value
+
+    return replace_all
+
+
+def _normalize_names(value):
+    words = []
+    for position, word in enumerate(re.split(r"(\s+)", value.strip().lower())):
+        if word.isspace() or not word:
+            words.append(word)
+        elif position > 0 and word in NAME_PARTICLES:
+            words.append(word)
+        else:
+            word = re.sub(r"(^|[-'])(\w)", lambda match: match.group(1) + match.group(2).upper(), word)
+            word = re.sub(r"^(Mc|Mac)(\w)", lambda match: match.group(1) + match.group(2).upper(), word) if len(word) > 4 else word
+            words.append(word)
+    return "".join(words)
+
+
+def _compile_e164phone(attributes, env):
+    default_country = attributes.get("defaultCountry", "US")
+    input_node = _compile_input(attributes, env)
+
+    def e164phone(context):
+        value = _to_string(input_node(context))
+        if value is None:
+            return None
+        digits = re.sub(r"\D", "", value)
+        if value.strip().startswith("+"):
+            number = digits
+        elif value.strip().startswith("00"):
+            number = digits[2:]
+        else:
+            code = COUNTRY_CALLING_CODES.get(default_country)
+            if code is None:
+                raise TransformEvaluationError("Unsupported default country %r." % default_country)
+            if code == "1" and len(digits) == 11 and digits.startswith("1"):
+                digits = digits[1:]
+            number = code + digits.lstrip("0")
+        if not 8 <= len(number) <= 15:
+            return None
+        return "+" + number
+
+    return e164phone
+
+
+# ---------------------------------------------------------------------------
+# Random values
+# ---------------------------------------------------------------------------
+
+def _compile_random(alphabet):
+    def compiler(attributes, env):
+        length = int(attributes.get("length", 32))
+        return lambda context: "".join(context.random.choice(alphabet) for _ in range(length))
+    return compiler
+
+
+def _compile_username_generator(attributes, env):
+    patterns = attributes.get("patterns", [])
+    variables = _compile_variables(attributes, USERNAME_GENERATOR_ATTRIBUTES, env)
+
+    def username_generator(context):
+        scope = {name: node(context) for name, node in variables}
+        for pattern in patterns:
+            counters = [""] + [str(counter) for counter in range(1, 51)] if "uniqueCounter" in pattern else [""]
+            for counter in counters:
+                scope["uniqueCounter"] = counter
+                candidate = _interpolate(pattern, scope)
+                if "$" in candidate:
+                    break
+                if context.is_unique(candidate):
+                    return candidate
+        return None
+
+    return username_generator
+
+
+# ---------------------------------------------------------------------------
+# Dates
+# ---------------------------------------------------------------------------
+
+@functools.lru_cache(maxsize=256)
+def _date_pattern(pattern):
+    """
+    Splits a Java SimpleDateFormat pattern into tokens and builds the matching parse regex.
+    """
+    tokens = []
+    for match in re.finditer(r"'([^']*)'|([A-Za-z])\2*|(.)", pattern):
+        if match.group(1) is not None:
+            tokens.append((None, match.group(1) or "'"))
+        elif match.group(2) is not None:
+            tokens.append((match.group(2), len(match.group(0))))
+        else:
+            tokens.append((None, match.group(3)))
+    regex = []
+    for letter, count in tokens:
+        if letter is None:
+            regex.append(re.escape(count))
+        elif letter in "yMdHhmsS" and not (letter == "M" and count >= 3):
+            if count > 1:
+                width = "{%d}" % count
+            else:
+                width = {"y": "{1,4}", "S": "{1,3}"}.get(letter, "{1,2}")
+            regex.append(r"(?P<%s>\d%s)" % (letter, width))
+        elif letter == "M":
+            regex.append(r"(?P<M>[A-Za-z]+)")
+        elif letter == "a":
+            regex.append(r"(?P<a>[AaPp][Mm])")
+        elif letter == "E":
+            regex.append(r"[A-Za-z]+")
+        elif letter in "XZ":
+            regex.append(r"(?P<Z>Z|[+-]\d{2}(?::?\d{2})?)")
+        elif letter == "z":
+            regex.append(r"[A-Za-z]+")
+        else:
+            raise TransformEvaluationError("Unsupported date pattern letter %r in %r." % (letter, pattern))
+    # Like Java's DateFormat.parse(), trailing text after the pattern is ignored.
+    return tuple(tokens), re.compile("^" + "".join(regex))
+
+
+def parse_date(value, date_format="ISO8601"):
+    """
+    Parses a date string using a named ISC date format or a Java SimpleDateFormat pattern.
+
+    :param value: The date string to parse.
+    :param date_format: (optional) Named format (ISO8601, LDAP, PEOPLE_SOFT, EPOCH_TIME_JAVA, EPOCH_TIME_WIN32) or explicit pattern.
+    :return: A timezone-aware datetime.
+    """
+    value = _to_string(value).strip()
+    if date_format == "EPOCH_TIME_JAVA":
+        return EPOCH + timedelta(milliseconds=int(value))
+    if date_format == "EPOCH_TIME_WIN32":
+        return WIN32_EPOCH + timedelta(microseconds=int(value) // 10)
+    if date_format == "ISO8601":
+        try:
+            parsed = datetime.fromisoformat(value.replace("z", "Z"))
+        except ValueError:
+            raise TransformEvaluationError("Unable to parse %r as ISO8601." % value)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    tokens, regex = _date_pattern(NAMED_DATE_FORMATS.get(date_format, date_format))
+    match = regex.match(value)
+    if match is None:
+        raise TransformEvaluationError("Unable to parse %r with date format %r." % (value, date_format))
+    fields = match.groupdict()
+    year = int(fields.get("y") or 1970)
+    if fields.get("y") and len(fields["y"]) <= 2:
+        year += 2000 if year < 50 else 1900
+    month = fields.get("M") or "1"
+    if not month.isdigit():
+        names = [name.lower() for name in (calendar.month_name if len(month) > 3 else calendar.month_abbr)]
+        if month.lower() not in names:
+            raise TransformEvaluationError("Unknown month name %r." % month)
+        month = names.index(month.lower())
+    hour = int(fields.get("H") or fields.get("h") or 0)
+    if fields.get("a"):
+        hour = hour % 12 + (12 if fields["a"].upper() == "PM" else 0)
+    millis = fields.get("S") or "0"
+    result = datetime(year, int(month), int(fields.get("d") or 1), hour, int(fields.get("m") or 0),
+                      int(fields.get("s") or 0), int(millis) * 1000, tzinfo=timezone.utc)
+    zone = fields.get("Z")
+    if zone and zone != "Z":
+        sign = -1 if zone[0] == "-" else 1
+        digits = zone[1:].replace(":", "")
+        offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:4] or 0))
+        result = result.replace(tzinfo=timezone(sign * offset))
+    return result
+
+
+def format_date(value, date_format="ISO8601"):
+    """
+    Formats a datetime using a named ISC date format or a Java SimpleDateFormat pattern.
+
+    :param value: The timezone-aware datetime to format.
+    :param date_format: (optional) Named format (ISO8601, LDAP, PEOPLE_SOFT, EPOCH_TIME_JAVA, EPOCH_TIME_WIN32) or explicit pattern.
+    :return: The formatted date string.
+    """
+    value = value.astimezone(timezone.utc)
+    if date_format == "EPOCH_TIME_JAVA":
+        return str((value - EPOCH) // timedelta(milliseconds=1))
+    if date_format == "EPOCH_TIME_WIN32":
+        return str((value - WIN32_EPOCH) // timedelta(microseconds=1) * 10)
+    tokens, regex = _date_pattern(NAMED_DATE_FORMATS.get(date_format, date_format))
+    output = []
+    for letter, count in tokens:
+        if letter is None:
+            output.append(count)
+        elif letter == "y":
+            output.append("%02d" % (value.year % 100) if count == 2 else "%0*d" % (count, value.year))
+        elif letter == "M":
+            if count >= 4:
+                output.append(calendar.month_name[value.month])
+            elif count == 3:
+                output.append(calendar.month_abbr[value.month])
+            else:
+                output.append("%0*d" % (count, value.month))
+        elif letter == "E":
+            output.append(calendar.day_name[value.weekday()] if count >= 4 else calendar.day_abbr[value.weekday()])
+        elif letter == "S":
+            output.append("%0*d" % (count, value.microsecond // 1000))
+        elif letter == "a":
+            output.append("AM" if value.hour < 12 else "PM")
+        elif letter == "X":
+            output.append("Z")
+        elif letter == "Z":
+            output.append("+0000")
+        elif letter == "z":
+            output.append("UTC")
+        else:
+            number = {"d": value.day, "H": value.hour, "h": value.hour % 12 or 12, "m": value.minute, "s": value.second}[letter]
+            output.append("%0*d" % (count, number))
+    return "".join(output)
+
+
+def _add_months(value, months):
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def _round_date(value, unit, round_up):
+    if unit == "y":
+        start = value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        following = start.replace(year=start.year + 1)
+    elif unit == "M":
+        start = value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        following = _add_months(start, 1)
+    elif unit == "w":
+        start = (value - timedelta(days=value.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        following = start + timedelta(weeks=1)
+    else:
+        size = {"d": timedelta(days=1), "h": timedelta(hours=1), "m": timedelta(minutes=1), "s": timedelta(seconds=1)}[unit]
+        start = value.replace(microsecond=0)
+        if unit in "dhm":
+            start = start.replace(second=0)
+        if unit in "dh":
+            start = start.replace(minute=0)
+        if unit == "d":
+            start = start.replace(hour=0)
+        following = start + size
+    return following - timedelta(milliseconds=1) if round_up else start
+
+
+@functools.lru_cache(maxsize=256)
+def _date_math_operations(expression):
+    expression = expression.strip()
+    anchored = expression.startswith("now")
+    operations = re.findall(r"([+-]\d+|/)([yMwdhms])", expression[3:] if anchored else expression)
+    if re.sub(r"[+-]\d+[yMwdhms]|/[yMwdhms]", "", expression[3:] if anchored else expression):
+        raise TransformEvaluationError("Unsupported dateMath expression %r." % expression)
+    return anchored, tuple(operations)
+
+
+def apply_date_math(value, expression, round_up=False):
+    """
+    Applies a dateMath expression such as 'now-30d/d' or '+3M' to a datetime.
+
+    :param value: The datetime the expression is relative to (ignored when the expression starts with 'now').
+    :param expression: The dateMath expression.
+    :param round_up: (optional) Boolean indicating whether rounding should move to the end of the unit.
+    :return: The resulting datetime.
+    """
+    anchored, operations = _date_math_operations(expression)
+    for operation, unit in operations:
+        if operation == "/":
+            value = _round_date(value, unit, round_up)
+        elif unit == "y":
+            value = _add_months(value, int(operation) * 12)
+        elif unit == "M":
+            value = _add_months(value, int(operation))
+        else:
+            value = value + timedelta(**{{"w": "weeks", "d": "days", "h": "hours", "m": "minutes", "s": "seconds"}[unit]: int(operation)})
+    return value
+
+
+def _compile_date_format(attributes, env):
+    input_format = attributes.get("inputFormat", "ISO8601")
+    output_format = attributes.get("outputFormat", "ISO8601")
+    input_node = _compile_input(attributes, env)
+
+    def date_format(context):
+        value = input_node(context)
+        if value is None:
+            return None
+        return format_date(parse_date(value, input_format), output_format)
+
+    return date_format
+
+
+def _compile_date_math(attributes, env):
+    expression = attributes["expression"]
+    round_up = _is_true(attributes.get("roundUp"))
+    anchored, operations = _date_math_operations(expression)
+    input_node = _compile_input(attributes, env)
+
+    def date_math(context):
+        if anchored:
+            value = context.now
+        else:
+            value = input_node(context)
+            if value is None:
+                return None
+            value = parse_date(value)
+        return format_date(apply_date_math(value, expression, round_up))
+
+    return date_math
+
+
+def _compile_date_compare(attributes, env):
+    operator = attributes["operator"].upper()
+    if operator not in ("LT", "LTE", "GT", "GTE"):
+        raise TransformEvaluationError("Unsupported dateCompare operator %r." % attributes["operator"])
+    first = _compile_value(attributes["firstDate"], env)
+    second = _compile_value(attributes["secondDate"], env)
+    positive = _compile_value(attributes.get("positiveCondition", "true"), env)
+    negative = _compile_value(attributes.get("negativeCondition", "false"), env)
+
+    def date_compare(context):
+        dates = []
+        for node in (first, second):
+            value = node(context)
+            if value is None:
+                raise TransformEvaluationError("dateCompare received a null date.")
+            dates.append(context.now if value == "now" else parse_date(value))
+        left, right = dates
+        if operator == "LT":
+            result = left < right
+        elif operator == "LTE":
+            result = left <= right
+        elif operator == "GT":
+            result = left > right
+        else:
+            result = left >= right
+        return positive(context) if result else negative(context)
+
+    return date_compare
+
+
+_COMPILERS = {
+    "accountAttribute": _compile_account_attribute,
+    "concat": _compile_concat,
+    "conditional": _compile_conditional,
+    "dateCompare": _compile_date_compare,
+    "dateFormat": _compile_date_format,
+    "dateMath": _compile_date_math,
+    "e164phone": _compile_e164phone,
+    "firstValid": _compile_first_valid,
+    "identityAttribute": _compile_identity_attribute,
+    "leftPad": _compile_pad(left=True),
+    "lookup": _compile_lookup,
+    "lower": _compile_string_function(str.lower),
+    "normalizeNames": _compile_string_function(_normalize_names),
+    "randomAlphaNumeric": _compile_random(string.ascii_letters + string.digits),
+    "randomNumeric": _compile_random(string.digits),
+    "reference": _compile_reference,
+    "replace": _compile_replace,
+    "replaceAll": _compile_replace_all,
+    "rightPad": _compile_pad(left=False),
+    "rule": _compile_rule,
+    "split": _compile_split,
+    "static": _compile_static,
+    "substring": _compile_substring,
+    "trim": _compile_string_function(str.strip),
+    "upper": _compile_string_function(str.upper),
+    "usernameGenerator": _compile_username_generator,
+}
+
+TRANSFORM_TYPES = frozenset(_COMPILERS)
@@ -1,5 +1,12 @@
 import json
 import re
+import sys
+import warnings
+
+from isc_transform_analysis import infer_periodic_refresh as _infer_periodic_refresh
+from isc_transform_nodes import thaw as _thaw
+from isc_transform_serializer import dump as _dump
+from isc_transform_vtl import minify as _minify_velocity
 
 def flatten_text(input):
     if isinstance(input, str):
@@ -15,14 +22,27 @@ def fix_velocity_pattern(input):
     return output_string
 
 def transform(name, transform, requires_periodic_refresh=None, output_enabled=False):
+    # Frozen nodes (see isc_transform_nodes), at the root or nested, are converted back to dictionaries; the input is never modified.
+    transform = _thaw(transform)
     transform["internal"] = False
+    # When not given, the flag is inferred from time-dependent nodes; an explicit value that disagrees is warned about.
+    time_dependent, dependencies = _infer_periodic_refresh(transform)
+    if requires_periodic_refresh is None:
+        requires_periodic_refresh = time_dependent
+    elif requires_periodic_refresh and not time_dependent:
+        warnings.warn("Transform %r requests a periodic refresh but does not depend on the current time." % name, stacklevel=2)
+    elif not requires_periodic_refresh and time_dependent:
+        warnings.warn("Transform %r depends on the current time (%s: %s) but periodic refresh is disabled."
+                      % (name, dependencies[0][0] or "root", dependencies[0][1]), stacklevel=2)
     if requires_periodic_refresh is True: transform["attributes"] = {"requiresPeriodicRefresh": True, **transform["attributes"]}
     final_transform = {'name': name, 'type': transform['type']}
     final_transform.update(transform)
     if output_enabled:
         return final_transform
     else:
-        print(json.dumps(final_transform, indent=4))
+        # Stream the pretty-printed JSON instead of building the whole string in memory.
+        _dump(final_transform, sys.stdout)
+        sys.stdout.write("\n")
 
 def accountAttribute(source_name, attribute_name, account_sort_attribute=None, account_sort_descending=None, account_return_first_link=None, account_property_filter=None, account_filter=None):
     """
@@ -527,7 +547,7 @@ def static(value, variables=None):
     if value:
         # If the value contains "#end", it's a Velocity template and needs spaces removed; otherwise, keep it as is.
         if "#end" in value:
-            transform["attributes"]['value'] = fix_velocity_pattern(flatten_text(value))
+            transform["attributes"]['value'] = _minify_velocity(value)
         else:
             transform["attributes"]['value'] = value
     return transform
@@ -0,0 +1,196 @@
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from isc_transform_evaluator import compile_transform
+from isc_transform_snapshot import Snapshot, is_snapshot, iter_snapshot, snapshot_records
+
+
+# Summary label of an evaluation that raised an error.
+ERROR = "<error>"
+
+Difference = namedtuple("Difference", ["identity", "old", "new", "old_error", "new_error"])
+Difference.__doc__ = """
+An identity whose output changes between two versions of a transform.
+
+identity is the identity's 'id' (or 'name', or its position in the snapshot), old and new are the outputs of each
+version, and old_error and new_error hold the error message when a version failed (None otherwise).
+"""
+
+_versions = None
+
+
+def _identity_key(identity, index):
+    for key in ("id", "name"):
+        if identity.get(key) is not None:
+            return identity[key]
+    return index
+
+
+def _init_worker(old_tree, new_tree, transforms, now, seed, snapshot):
+    global _versions
+    _versions = (compile_transform(old_tree, transforms), compile_transform(new_tree, transforms), now, seed, snapshot)
+
+
+def _run(version, identity, now, seed):
+    try:
+        return version(identity, now=now, seed=seed), None
+    except Exception as error:
+        return None, str(error) or error.__class__.__name__
+
+
+def _compare_shard(shard):
+    start, records = shard
+    run_old, run_new, now, seed, snapshot = _versions
+    differences = []
+    errors = 0
+    for index, record in enumerate(records, start):
+        if snapshot is not None:
+            identity = snapshot.identity(record)
+        else:
+            identity = json.loads(record) if isinstance(record, str) else record
+        key = _identity_key(identity, index)
+        # Both versions see the same random sequence, so random transforms only differ when their definition does.
+        identity_seed = "%s:%s" % (seed, key)
+        old, old_error = _run(run_old, identity, now, identity_seed)
+        new, new_error = _run(run_new, identity, now, identity_seed)
+        errors += (old_error is not None) + (new_error is not None)
+        if old != new or old_error != new_error:
+            differences.append(Difference(key, old, new, old_error, new_error))
+    return len(records), errors, differences
+
+
+def impact(old_tree, new_tree, snapshot, transforms=None, now=None, seed=0, workers=None, shard_size=2000, stats=None):
+    """
+    Evaluates two versions of a transform over an identity snapshot and yields the identities whose output changes.
+
+    The snapshot is cut into shards of shard_size identities that are evaluated by a process pool; each worker
+    compiles both versions once, and only the differences travel back to this process. Every identity is evaluated
+    with the same 'now' and the same random seed by both versions. Differences are yielded in snapshot order while
+    the remaining shards are still being evaluated.
+
+    :param old_tree: The current version of the transform.
+    :param new_tree: The new version of the transform.
+    :param snapshot: A columnar isc_transform_snapshot.Snapshot, which every worker maps instead of receiving
+                     identities, or an iterable of identity records (see isc_transform_evaluator.evaluate()) or of
+                     their NDJSON lines, e.g. iter_snapshot(fp).
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+    :param seed: (optional) Seed combined with each identity's key for the random* transforms. Default is 0.
+    :param workers: (optional) Number of worker processes. Default is the number of CPUs; 1 evaluates in-process.
+    :param shard_size: (optional) Number of identities per shard. Default is 2000.
+    :param stats: (optional) Dictionary whose 'identities', 'changed' and 'errors' counters are incremented.
+    :return: A generator of Difference tuples.
+    """
+    now = now or datetime.now(timezone.utc)
+    workers = workers or os.cpu_count() or 1
+    if isinstance(snapshot, Snapshot):
+        # Shards are index ranges; the snapshot is pickled as its path and mapped by each worker.
+        shards = ((start, range(start, min(start + shard_size, len(snapshot)))) for start in range(0, len(snapshot), shard_size))
+    else:
+        iterator = iter(snapshot)
+        shards = ((start, shard) for start, shard in
+                  zip(itertools.count(0, shard_size), iter(lambda: list(itertools.islice(iterator, shard_size)), [])))
+        snapshot = None
+    stats = stats if stats is not None else {}
+    for counter in ("identities", "changed", "errors"):
+        stats.setdefault(counter, 0)
+    for count, errors, differences in _compare_shards(shards, (old_tree, new_tree, transforms, now, seed, snapshot), workers):
+        stats["identities"] += count
+        stats["errors"] += errors
+        stats["changed"] += len(differences)
+        for difference in differences:
+            yield difference
+
+
+def _compare_shards(shards, initargs, workers):
+    if workers == 1:
+        _init_worker(*initargs)
+        for shard in shards:
+            yield _compare_shard(shard)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        # A bounded window of submitted shards keeps memory flat however large the snapshot is.
+        pending = collections.deque()
+        for shard in shards:
+            pending.append(executor.submit(_compare_shard, shard))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _label(value, error):
+    if error is not None:
+        return ERROR
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _pair(difference):
+    return _label(difference.old, difference.old_error), _label(difference.new, difference.new_error)
+
+
+def summarize(differences):
+    """
+    Counts the differences per (old value, new value) pair.
+
+    :param differences: An iterable of Difference tuples, e.g. returned by impact().
+    :return: A Counter mapping (old, new) pairs to numbers of identities; failed evaluations are labelled ERROR and
+             multi-valued outputs are converted to tuples.
+    """
+    return Counter(_pair(difference) for difference in differences)
+
+
+def _load_transform(path):
+    with open(path, encoding="utf-8") as transform_file:
+        return json.load(transform_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show which identities change when a transform is replaced.")
+    parser.add_argument("old", help="JSON file with the current version of the transform.")
+    parser.add_argument("new", help="JSON file with the new version of the transform.")
+    parser.add_argument("snapshot", help="Identity snapshot: a columnar snapshot (see isc_transform_snapshot.py), "
+                                         "NDJSON (one identity per line) or a JSON list.")
+    parser.add_argument("--output", help="NDJSON file receiving the changed identities (default: standard output).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count).")
+    parser.add_argument("--now", help="ISO 8601 timestamp used as the current time (default: now).")
+    parser.add_argument("--top", type=int, default=20, help="Number of (old -> new) pairs in the summary (default: 20).")
+    args = parser.parse_args(argv)
+
+    now = None
+    if args.now:
+        now = datetime.fromisoformat(args.now.replace("Z", "+00:00"))
+        now = now if now.tzinfo else now.replace(tzinfo=timezone.utc)
+    stats = {}
+    summary = Counter()
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        if is_snapshot(args.snapshot):
+            snapshot_file = Snapshot(args.snapshot)
+            records = snapshot_file
+        else:
+            snapshot_file = open(args.snapshot, encoding="utf-8")
+            records = snapshot_records(snapshot_file)
+        with snapshot_file:
+            for difference in impact(_load_transform(args.old), _load_transform(args.new), records, now=now,
+                                     workers=args.workers, stats=stats):
+                output.write(json.dumps(difference._asdict(), default=str) + "\n")
+                summary[_pair(difference)] += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    sys.stderr.write("%(changed)d of %(identities)d identities change (%(errors)d failed evaluations).\n" % stats)
+    for (old, new), count in summary.most_common(args.top):
+        sys.stderr.write("%8d  %s -> %s\n" % (count, json.dumps(old, default=str), json.dumps(new, default=str)))
+    return 1 if stats["changed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
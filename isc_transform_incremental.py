@@ -0,0 +1,364 @@
+import argparse
+import json
+import sqlite3
+import sys
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from isc_transform_analysis import time_dependencies
+from isc_transform_evaluator import compile_transform
+from isc_transform_snapshot import _account_lists, iter_snapshot
+from isc_transform_walk import visit
+
+
+# Account dependency on every attribute of a source, e.g. for accountFilter or accountPropertyFilter.
+ANY_ATTRIBUTE = None
+
+Dependencies = namedtuple("Dependencies", ["identity_attributes", "account_attributes", "reference_attributes",
+                                           "references", "time_dependent"])
+Dependencies.__doc__ = """
+The inputs a transform reads.
+
+identity_attributes is a frozenset of identity attribute names, account_attributes a frozenset of (sourceName,
+attributeName) tuples (attributeName is ANY_ATTRIBUTE when account filters make every attribute of the source
+relevant), reference_attributes a frozenset of (uid, attributeName) tuples read by getReferenceIdentityAttribute
+rules, references the frozenset of 'reference' transform IDs followed, and time_dependent is True when the output
+also depends on the current time.
+"""
+
+Update = namedtuple("Update", ["identity", "transform", "old", "new", "error"])
+Update.__doc__ = """
+A stored result that changed: old and new are the previous and the new output of the transform for the identity
+(None when absent), and error holds the error message when the new evaluation failed.
+"""
+
+
+def dependencies(tree, transforms=None):
+    """
+    Extracts the identity attributes, account attributes and references a transform reads.
+
+    Every node is visited, including the variables of 'static' and 'conditional' transforms, and the transforms
+    of 'reference' nodes found in transforms are followed.
+
+    :param tree: A transform dictionary.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries, used to resolve
+                       'reference' transforms.
+    :return: A Dependencies tuple.
+    """
+    transforms = transforms or {}
+    identity_attributes = set()
+    account_attributes = set()
+    reference_attributes = set()
+    references = set()
+    pending = [tree]
+
+    def attributes_of(node):
+        attributes = node.get("attributes")
+        return attributes if isinstance(attributes, dict) else {}
+
+    def identity_attribute(node, path):
+        identity_attributes.add(attributes_of(node).get("name"))
+
+    def account_attribute(node, path):
+        attributes = attributes_of(node)
+        source_name = attributes.get("sourceName")
+        account_attributes.add((source_name, attributes.get("attributeName")))
+        if attributes.get("accountSortAttribute") is not None:
+            account_attributes.add((source_name, attributes["accountSortAttribute"]))
+        if attributes.get("accountFilter") is not None or attributes.get("accountPropertyFilter") is not None:
+            account_attributes.add((source_name, ANY_ATTRIBUTE))
+
+    def rule(node, path):
+        attributes = attributes_of(node)
+        if attributes.get("operation") == "getReferenceIdentityAttribute":
+            reference_attributes.add((attributes.get("uid"), attributes.get("attributeName")))
+
+    def reference(node, path):
+        transform_id = attributes_of(node).get("id")
+        if transform_id in transforms and transform_id not in references:
+            pending.append(transforms[transform_id])
+        references.add(transform_id)
+
+    handlers = {
+        "accountAttribute": account_attribute,
+        "identityAttribute": identity_attribute,
+        "reference": reference,
+        "rule": rule,
+    }
+    while pending:
+        visit(pending.pop(), handlers)
+    return Dependencies(frozenset(identity_attributes), frozenset(account_attributes), frozenset(reference_attributes),
+                        frozenset(references), bool(time_dependencies(tree, transforms)))
+
+
+def _sorted_accounts(accounts):
+    return sorted(json.dumps(account, sort_keys=True, default=str) for account in accounts)
+
+
+def _merge(record, delta):
+    """
+    Applies a delta record to a stored identity record.
+
+    :return: A tuple (merged, changed) where changed is the set of dependency keys whose value differs: attribute
+             names, ('account', sourceName, attributeName) and ('reference', uid, attributeName) tuples. The
+             attributeName is ANY_ATTRIBUTE when the accounts of a source were added, removed or reordered.
+    """
+    merged = {
+        "id": delta.get("id", record.get("id")),
+        "attributes": dict(record.get("attributes") or {}),
+        "accounts": dict(record.get("accounts") or {}),
+        "references": dict(record.get("references") or {}),
+    }
+    changed = set()
+    for name, value in (delta.get("attributes") or {}).items():
+        if merged["attributes"].get(name) != value:
+            changed.add(name)
+        merged["attributes"][name] = value
+    # Accounts are replaced per source: a delta lists every account the identity now has on the sources it mentions.
+    for source_name, accounts in _account_lists(delta).items():
+        previous = merged["accounts"].get(source_name) or []
+        if previous != accounts:
+            if len(previous) != len(accounts) or _sorted_accounts(previous) == _sorted_accounts(accounts):
+                # Accounts were added, removed or reordered; an edit of one account's values changes its attributes only.
+                changed.add(("account", source_name, ANY_ATTRIBUTE))
+            if len(previous) != len(accounts):
+                names = set(name for account in previous + accounts for name in account)
+            else:
+                names = set(name for old, new in zip(previous, accounts) for name in set(old) | set(new)
+                            if old.get(name) != new.get(name))
+            changed.update(("account", source_name, name) for name in names)
+        merged["accounts"][source_name] = accounts
+    for uid, referenced in (delta.get("references") or {}).items():
+        previous = merged["references"].get(uid) or {}
+        referenced = referenced or {}
+        changed.update(("reference", uid, name) for name in set(previous) | set(referenced)
+                       if previous.get(name) != referenced.get(name))
+        merged["references"][uid] = referenced
+    return merged, changed
+
+
+class IncrementalEngine(object):
+    """
+    Keeps the outputs of a set of transforms for every identity up to date from a feed of changed records.
+
+    Identity records and results are persisted in a SQLite database. When a delta arrives, only the transforms
+    whose dependencies (see dependencies()) intersect the attributes that actually changed are evaluated again,
+    and only for the identities in the delta. Transforms that depend on the current time can change without any
+    input change: they are evaluated again for every identity in a delta, and for every identity by refresh().
+    """
+
+    def __init__(self, path, transforms, references=None):
+        """
+        :param path: Path of the SQLite result store; it is created if needed.
+        :param transforms: Dictionary mapping transform names to transform dictionaries.
+        :param references: (optional) Dictionary mapping transform IDs to transform dictionaries, used to resolve
+                           'reference' transforms.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS identities (id TEXT PRIMARY KEY, record TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS results (
+                transform TEXT NOT NULL, identity TEXT NOT NULL, value TEXT, error TEXT,
+                PRIMARY KEY (transform, identity)
+            );
+            CREATE INDEX IF NOT EXISTS results_by_identity ON results (identity);
+        """)
+        self.transforms = dict(transforms)
+        self.compiled = {name: compile_transform(tree, references) for name, tree in self.transforms.items()}
+        self.dependencies = {name: dependencies(tree, references) for name, tree in self.transforms.items()}
+        # Inverted index: dependency key -> names of the transforms reading it.
+        self.readers = {}
+        for name, found in self.dependencies.items():
+            keys = list(found.identity_attributes)
+            # Only account filters register ('account', sourceName, ANY_ATTRIBUTE) (see dependencies()).
+            keys.extend(("account", source_name, attribute) for source_name, attribute in found.account_attributes)
+            keys.extend(("reference", uid, attribute) for uid, attribute in found.reference_attributes)
+            for key in keys:
+                self.readers.setdefault(key, set()).add(name)
+        self.time_dependent = set(name for name, found in self.dependencies.items() if found.time_dependent)
+        self.stats = {"evaluations": 0, "skipped": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def affected(self, changed):
+        """
+        Selects the transforms that read at least one of the changed keys.
+
+        Transforms reading every attribute of a source (ANY_ATTRIBUTE) are selected by a change to any of them.
+
+        :param changed: An iterable of attribute names and ('account', sourceName, attributeName) or
+                        ('reference', uid, attributeName) tuples.
+        :return: A set of transform names.
+        """
+        names = set()
+        for key in changed:
+            names.update(self.readers.get(key, ()))
+            if isinstance(key, tuple) and key[0] == "account" and key[2] is not ANY_ATTRIBUTE:
+                names.update(self.readers.get(("account", key[1], ANY_ATTRIBUTE), ()))
+        return names
+
+    def _evaluate(self, name, identity_id, record, now):
+        # The identity ID seeds the random* transforms, so unchanged identities keep their generated values.
+        self.stats["evaluations"] += 1
+        try:
+            return self.compiled[name](record, now=now, seed=str(identity_id)), None
+        except Exception as error:
+            return None, str(error) or error.__class__.__name__
+
+    def _store(self, name, identity_id, value, error):
+        self.connection.execute("INSERT OR REPLACE INTO results (transform, identity, value, error) VALUES (?, ?, ?, ?)",
+                                (name, identity_id, json.dumps(value, default=str), error))
+
+    def _stored(self, name, identity_id):
+        row = self.connection.execute("SELECT value, error FROM results WHERE transform = ? AND identity = ?",
+                                      (name, identity_id)).fetchone()
+        if row is None:
+            return None, None
+        return (json.loads(row[0]) if row[0] is not None else None), row[1]
+
+    def load(self, identities, now=None):
+        """
+        Stores a full set of identity records and evaluates every transform for each of them.
+
+        :param identities: An iterable of identity records with an 'id', e.g. isc_transform_snapshot.iter_snapshot(fp).
+        :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+        :return: The number of identities loaded.
+        """
+        now = now or datetime.now(timezone.utc)
+        count = 0
+        with self.connection:
+            for identity in identities:
+                record, changed = _merge({}, identity)
+                if record["id"] is None:
+                    raise ValueError("Identity records need an 'id': %r" % (identity,))
+                identity_id = str(record["id"])
+                self.connection.execute("INSERT OR REPLACE INTO identities (id, record) VALUES (?, ?)",
+                                        (identity_id, json.dumps(record)))
+                for name in self.transforms:
+                    self._store(name, identity_id, *self._evaluate(name, identity_id, record, now))
+                count += 1
+        return count
+
+    def apply(self, delta, now=None):
+        """
+        Applies changed identity records and re-evaluates only the affected (identity, transform) pairs.
+
+        A delta record holds the identity's 'id' and the attributes that changed; the accounts it lists replace the
+        identity's accounts on those sources, and {"id": ..., "deleted": true} removes an identity. Records for
+        unknown IDs create new identities, evaluated for every transform. Time-dependent transforms are always
+        evaluated again for the identities in the delta.
+
+        :param delta: An iterable of delta records.
+        :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+        :return: A list of Update tuples, one per stored result that changed.
+        """
+        now = now or datetime.now(timezone.utc)
+        updates = []
+        with self.connection:
+            for change in delta:
+                identity_id = str(change["id"])
+                row = self.connection.execute("SELECT record FROM identities WHERE id = ?", (identity_id,)).fetchone()
+                if change.get("deleted"):
+                    for name in self.transforms:
+                        old, old_error = self._stored(name, identity_id)
+                        if old is not None:
+                            updates.append(Update(identity_id, name, old, None, None))
+                    self.connection.execute("DELETE FROM identities WHERE id = ?", (identity_id,))
+                    self.connection.execute("DELETE FROM results WHERE identity = ?", (identity_id,))
+                    continue
+                record, changed = _merge(json.loads(row[0]) if row else {}, change)
+                names = set(self.transforms) if row is None else self.affected(changed) | self.time_dependent
+                self.stats["skipped"] += len(self.transforms) - len(names)
+                self.connection.execute("INSERT OR REPLACE INTO identities (id, record) VALUES (?, ?)",
+                                        (identity_id, json.dumps(record)))
+                updates.extend(self._reevaluate(sorted(names), identity_id, record, now))
+        return updates
+
+    def refresh(self, now=None):
+        """
+        Evaluates the time-dependent transforms (see dependencies()) again for every stored identity.
+
+        Their output can change with the current time alone, e.g. a 'dateCompare' against "now", so run refresh()
+        on every scheduled update, with or without a delta.
+
+        :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+        :return: A list of Update tuples, one per stored result that changed.
+        """
+        now = now or datetime.now(timezone.utc)
+        names = sorted(self.time_dependent)
+        updates = []
+        if not names:
+            return updates
+        with self.connection:
+            for identity_id, text in self.connection.execute("SELECT id, record FROM identities ORDER BY id").fetchall():
+                updates.extend(self._reevaluate(names, identity_id, json.loads(text), now))
+        return updates
+
+    def _reevaluate(self, names, identity_id, record, now):
+        updates = []
+        for name in names:
+            old, old_error = self._stored(name, identity_id)
+            new, error = self._evaluate(name, identity_id, record, now)
+            if new != old or error != old_error:
+                self._store(name, identity_id, new, error)
+                updates.append(Update(identity_id, name, old, new, error))
+        return updates
+
+    def result(self, identity_id, name):
+        """
+        Reads a stored result.
+
+        :param identity_id: The identity's ID.
+        :param name: The transform name.
+        :return: A tuple (value, error); both are None when nothing is stored.
+        """
+        return self._stored(name, str(identity_id))
+
+
+def _load_transforms(paths):
+    transforms = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as transform_file:
+            tree = json.load(transform_file)
+        transforms[tree.get("name") or path] = tree
+    return transforms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep transform results up to date from a feed of changed identities.")
+    parser.add_argument("store", help="SQLite result store.")
+    parser.add_argument("transforms", nargs="+", help="JSON files of the named transforms to keep up to date.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--load", help="NDJSON file with every identity: evaluate all transforms for all of them.")
+    action.add_argument("--delta", help="NDJSON file of changed identity records: re-evaluate the affected pairs.")
+    action.add_argument("--refresh", action="store_true",
+                        help="Re-evaluate the transforms that depend on the current time for every identity.")
+    args = parser.parse_args(argv)
+
+    with IncrementalEngine(args.store, _load_transforms(args.transforms)) as engine:
+        if args.load:
+            with open(args.load, encoding="utf-8") as identities_file:
+                count = engine.load(iter_snapshot(identities_file))
+            sys.stderr.write("Loaded %d identities (%d evaluations).\n" % (count, engine.stats["evaluations"]))
+            return 0
+        if args.refresh:
+            updates = engine.refresh()
+        else:
+            with open(args.delta, encoding="utf-8") as delta_file:
+                updates = engine.apply(iter_snapshot(delta_file))
+        for update in updates:
+            sys.stdout.write(json.dumps(update._asdict(), default=str) + "\n")
+        sys.stderr.write("%d results changed (%d evaluations, %d skipped).\n"
+                         % (len(updates), engine.stats["evaluations"], engine.stats["skipped"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import weakref
+from collections.abc import Mapping
+
+
+_INTERNED = weakref.WeakValueDictionary()
+
+
+def _key_of(value):
+    # Primitives are tagged with their class so that True, 1 and 1.0 stay distinct nodes.
+    if isinstance(value, Node):
+        return value
+    if isinstance(value, tuple):
+        return ("list",) + tuple(_key_of(item) for item in value)
+    return (value.__class__, value)
+
+
+class Node(Mapping):
+    """
+    Immutable, interned representation of a transform (or any JSON object inside a transform).
+
+    Structurally identical nodes are the same object, so equality is an identity check and the structural hash is
+    computed once. Keys keep the insertion order of the dictionary they were created from, and lists are stored as
+    tuples. Use freeze() to create nodes and to_dict() to get today's dictionary format back.
+    """
+    __slots__ = ("_items", "_index", "_hash", "__weakref__")
+
+    def __new__(cls, items):
+        key = tuple((name, _key_of(value)) for name, value in items)
+        node = _INTERNED.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            object.__setattr__(node, "_items", items)
+            object.__setattr__(node, "_index", dict(items))
+            object.__setattr__(node, "_hash", hash(key))
+            _INTERNED[key] = node
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Node objects are immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("Node objects are immutable.")
+
+    def __getitem__(self, key):
+        return self._index[key]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __reduce__(self):
+        return (Node, (self._items,))
+
+    def __repr__(self):
+        return "Node(%r)" % (self.to_dict(),)
+
+    @property
+    def type(self):
+        """
+        The transform type, or None for plain JSON objects such as lookup tables.
+        """
+        return self._index.get("type")
+
+    @property
+    def attributes(self):
+        """
+        The 'attributes' node, or None when the transform has no attributes.
+        """
+        return self._index.get("attributes")
+
+    def to_dict(self):
+        """
+        Converts the node back into the dictionary format produced by the builders.
+
+        :return: A new dictionary (with new nested dictionaries and lists) equal to the frozen tree.
+        """
+        return thaw(self)
+
+
+def _convert(tree, descend, build):
+    """
+    Rebuilds a tree bottom-up with an explicit stack, so deeply nested trees do not hit the recursion limit.
+
+    descend(value) tells whether a value is a container to rebuild; build(value, children) creates its replacement
+    from the rebuilt children, listed in the order of the container's values.
+    """
+    if not descend(tree):
+        return tree
+    stack = [(tree, iter(_values(tree)), [])]
+    while True:
+        value, children, results = stack[-1]
+        for child in children:
+            if descend(child):
+                stack.append((child, iter(_values(child)), []))
+                break
+            results.append(child)
+        else:
+            stack.pop()
+            result = build(value, results)
+            if not stack:
+                return result
+            stack[-1][2].append(result)
+
+
+def _values(value):
+    return value.values() if isinstance(value, Mapping) else value
+
+
+def freeze(tree):
+    """
+    Converts a transform dictionary (or any JSON value) into interned, immutable Node objects.
+
+    :param tree: A transform dictionary as produced by the builders, or a value already containing nodes.
+    :return: The Node for dictionaries, a tuple for lists, or the value itself for primitives.
+    """
+    return _convert(tree, lambda value: isinstance(value, (dict, list, tuple)),
+                    lambda value, children: Node(tuple(zip(value, children))) if isinstance(value, dict)
+                    else tuple(children))
+
+
+def thaw(value):
+    """
+    Converts nodes (and tuples of nodes) back into dictionaries and lists, including nodes nested inside
+    dictionaries and lists, e.g. frozen subtrees passed to the builders.
+
+    :param value: A Node, tuple, dictionary, list or primitive value.
+    :return: The equivalent value using dictionaries and lists only. Dictionaries and lists are always copied.
+    """
+    return _convert(value, lambda item: isinstance(item, (Node, dict, list, tuple)),
+                    lambda item, children: dict(zip(item, children)) if isinstance(item, Mapping) else children)
+
+
+def interned_count():
+    """
+    Returns the number of distinct nodes currently alive.
+
+    :return: The size of the interning table.
+    """
+    return len(_INTERNED)
@@ -0,0 +1,584 @@
+import hashlib
+import json
+import re
+
+from isc_transform_analysis import DATE_TOOLS, join_path, may_evaluate_to_now
+from isc_transform_evaluator import (RESERVED_CONDITIONAL_ATTRIBUTES, RESERVED_STATIC_ATTRIBUTES, TRANSFORM_TYPES,
+                                     compile_transform)
+from isc_transform_generator import identityAttribute, lookup, reference, transform
+from isc_transform_vtl import COMMENT, DIRECTIVE, NEWLINE, TEXT, assigned_variables, references, tokenize
+from isc_transform_walk import SKIP, fold, rewrite, visit, walk
+
+
+# Attributes of a root transform that describe the whole transform rather than its root node.
+ROOT_ATTRIBUTES = ("requiresPeriodicRefresh",)
+
+
+def is_transform(value):
+    """
+    Checks whether a value is a transform node (as opposed to a plain string, list or table).
+
+    :param value: Any value found inside a transform tree.
+    :return: True if the value is a dictionary with a known transform 'type'.
+    """
+    return isinstance(value, dict) and value.get("type") in TRANSFORM_TYPES
+
+
+def compact_json(tree):
+    """
+    Serializes a tree the way it is measured by the optimizer passes: compact separators, original key order.
+
+    :param tree: A transform dictionary.
+    :return: The compact JSON string.
+    """
+    return json.dumps(tree, separators=(",", ":"), ensure_ascii=False)
+
+
+def _digest_subtrees(value, digests):
+    """
+    Computes a structural digest for every transform node below value, children first.
+
+    :return: A (digest, size) tuple for value, where size counts transform nodes.
+    """
+    def digest_of(value, children):
+        if children is None:
+            return json.dumps(value, sort_keys=True), 0
+        if isinstance(children, dict):
+            shape = {key: item_digest for key, (item_digest, item_size) in children.items()}
+            size = (1 if is_transform(value) else 0) + sum(item_size for item_digest, item_size in children.values())
+            digest = hashlib.sha1(json.dumps(shape, sort_keys=True).encode("utf-8")).hexdigest()
+            if is_transform(value):
+                digests.append((value, digest, size))
+            return digest, size
+        digest = hashlib.sha1(json.dumps([item_digest for item_digest, item_size in children]).encode("utf-8")).hexdigest()
+        return digest, sum(item_size for item_digest, item_size in children)
+
+    return fold(value, digest_of)
+
+
+def _copy_tree(value):
+    # A deep copy that does not recurse, for subtrees of any depth.
+    return fold(value, lambda item, children: item if children is None else children)
+
+
+def _join_paths(prefix, path):
+    if not prefix or not path:
+        return prefix or path
+    return prefix + path if path.startswith("[") else "%s.%s" % (prefix, path)
+
+
+def _rename_variable(template, old, new):
+    return re.sub(r"\$(!?)(\{?)%s\b(\}?)" % re.escape(old), lambda match: "$%s%s%s%s" % (match.group(1), match.group(2), new, match.group(3)), template)
+
+
+def deduplicate_variables(tree):
+    """
+    Merges structurally identical variables passed to the same 'static' or 'conditional' transform.
+
+    The duplicate is dropped and every '$name', '${name}' or '$!name' reference in the template or expression is
+    renamed to the variable that is kept, so the tenant evaluates the shared subtree only once. Variables that the
+    template reassigns ('#set', '#foreach') are left alone, since their references do not always read the variable.
+
+    :param tree: A transform dictionary. It is not modified.
+    :return: A tuple (new_tree, report) where report holds 'deduplicated' and 'evaluations_avoided'.
+    """
+    report = {"deduplicated": 0, "evaluations_avoided": 0}
+
+    def deduplicate(value):
+        text_key = "value" if value["type"] == "static" else "expression"
+        attributes = value.get("attributes") or {}
+        if not isinstance(attributes, dict) or not isinstance(attributes.get(text_key), str):
+            return value
+        kept = {}
+        text = attributes[text_key]
+        if value["type"] == "static":
+            reserved = RESERVED_STATIC_ATTRIBUTES | assigned_variables(text)
+        else:
+            # The branches of a conditional are not variables: they must never be merged or renamed.
+            reserved = RESERVED_CONDITIONAL_ATTRIBUTES
+        merged = {}
+        for name, item in attributes.items():
+            if not is_transform(item) or name in reserved:
+                merged[name] = item
+                continue
+            digests = []
+            digest, size = _digest_subtrees(item, digests)
+            if digest in kept:
+                text = _rename_variable(text, name, kept[digest])
+                report["deduplicated"] += 1
+                report["evaluations_avoided"] += size
+            else:
+                kept[digest] = name
+                merged[name] = item
+        if len(merged) == len(attributes):
+            return value
+        merged[text_key] = text
+        return dict(value, attributes=merged)
+
+    return rewrite(tree, {"static": deduplicate, "conditional": deduplicate}), report
+
+
+def hoist_common_subtrees(tree, min_size=3, name_prefix="Shared", names=None):
+    """
+    Hoists structurally identical subtrees into separate named transforms wired in with reference().
+
+    Every transform node is hashed; subtrees of at least min_size nodes that occur more than once are replaced,
+    largest first, by a 'reference' to a new transform holding a single copy. Identical variables of the same
+    'static' or 'conditional' are merged beforehand (see deduplicate_variables()). The tenant still evaluates a
+    referenced transform at each occurrence, so only merged variables count towards 'evaluations_avoided'.
+
+    :param tree: A transform dictionary. It is not modified.
+    :param min_size: (optional) Minimum number of transform nodes a subtree needs to be hoisted. Default is 3.
+    :param name_prefix: (optional) Prefix of the generated transform names. Default is "Shared".
+    :param names: (optional) Dictionary mapping subtree digests to explicit names for the hoisted transforms.
+    :return: A tuple (new_tree, hoisted, report), where hoisted is the list of new transforms (in the format of
+             transform(..., output_enabled=True)) and report holds 'hoisted', 'deduplicated', 'bytes_before',
+             'bytes_after', 'bytes_saved' and 'evaluations_avoided'.
+    """
+    bytes_before = len(compact_json(tree))
+    tree, report = deduplicate_variables(tree)
+    names = names or {}
+    hoisted = []
+    while True:
+        digests = []
+        _digest_subtrees(tree, digests)
+        occurrences = {}
+        for node, digest, size in digests:
+            if size >= min_size and node is not tree:
+                occurrences.setdefault(digest, []).append((node, size))
+        candidates = [(nodes[0][1], digest, nodes[0][0]) for digest, nodes in occurrences.items() if len(nodes) > 1]
+        if not candidates:
+            break
+        size, digest, node = max(candidates, key=lambda candidate: (candidate[0], candidate[1]))
+        name = names.get(digest) or "%s %s %s" % (name_prefix, node["type"], digest[:8])
+        hoisted.append(transform(name, _copy_tree(node), output_enabled=True))
+        targets = set(id(item) for item, item_digest, item_size in digests if item_digest == digest)
+        tree = _replace_nodes(tree, targets, reference(name))
+
+    bytes_after = len(compact_json(tree)) + sum(len(compact_json(item)) for item in hoisted)
+    report.update({
+        "hoisted": len(hoisted),
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "bytes_saved": bytes_before - bytes_after,
+    })
+    return tree, hoisted, report
+
+
+def _replace_nodes(value, targets, replacement):
+    # Targets never contain each other (they share one digest), so each is reached unchanged by rewrite().
+    return rewrite(value, {}, default=lambda node: _copy_tree(replacement) if id(node) in targets else node)
+
+
+def eliminate_dead_variables(tree):
+    """
+    Drops 'static' variables that the Velocity template never references.
+
+    The tenant evaluates every variable of a 'static' transform, used or not, so an unreferenced accountAttribute
+    still costs an account fetch per identity. Nested statics are processed first, so variables that only fed a
+    removed variable disappear with it. References to variables that are neither passed in nor defined by the
+    template ('#set', '#foreach') are reported as undefined.
+
+    :param tree: A transform dictionary. It is not modified.
+    :return: A tuple (new_tree, report) where report holds 'removed' and 'undefined' (lists of (path, name)
+             tuples) and 'evaluations_avoided' (number of transform nodes removed).
+    """
+    report = {"removed": [], "undefined": [], "evaluations_avoided": 0}
+
+    def eliminate(value, path):
+        attributes = value.get("attributes")
+        if not isinstance(attributes, dict) or not isinstance(attributes.get("value"), str):
+            return value
+        template = attributes["value"]
+        used = references(template)
+        attributes_path = join_path(path, "attributes")
+        kept = {}
+        for name, item in attributes.items():
+            if name in RESERVED_STATIC_ATTRIBUTES or name in used:
+                kept[name] = item
+                continue
+            report["removed"].append((join_path(attributes_path, name), name))
+            report["evaluations_avoided"] += _digest_subtrees(item, [])[1]
+        defined = set(kept) | assigned_variables(template) | DATE_TOOLS
+        for name in sorted(used - defined):
+            report["undefined"].append((join_path(attributes_path, "value"), name))
+        if len(kept) == len(attributes):
+            return value
+        return dict(value, attributes=kept)
+
+    return rewrite(tree, {"static": eliminate}, paths=True), report
+
+
+FOLDABLE_TYPES = frozenset([
+    "concat", "conditional", "dateCompare", "dateFormat", "dateMath", "e164phone", "leftPad", "lookup", "lower",
+    "normalizeNames", "replace", "replaceAll", "rightPad", "split", "static", "substring", "trim", "upper",
+])
+INPUT_TYPES = frozenset([
+    "dateFormat", "dateMath", "e164phone", "leftPad", "lookup", "lower", "normalizeNames", "replace", "replaceAll",
+    "rightPad", "split", "substring", "trim", "upper",
+])
+
+
+def count_nodes(tree):
+    """
+    Counts the transform nodes of a tree.
+
+    :param tree: A transform dictionary.
+    :return: The number of transform nodes, including the root.
+    """
+    return sum(1 for value in walk(tree) if is_transform(value))
+
+
+def _constant(value):
+    """
+    Returns (True, value) when value is known at generation time: a plain literal or a 'static' without variables.
+    """
+    if not isinstance(value, (dict, list)):
+        return True, value
+    if is_transform(value) and value["type"] == "static":
+        attributes = value.get("attributes") or {}
+        text = attributes.get("value")
+        if set(attributes) <= RESERVED_STATIC_ATTRIBUTES and (not isinstance(text, str) or ("$" not in text and "#" not in text)):
+            return True, text
+    return False, None
+
+
+def _foldable(node):
+    node_type = node["type"]
+    attributes = node.get("attributes") or {}
+    if node_type not in FOLDABLE_TYPES:
+        return False
+    if node_type == "dateMath" and "now" in str(attributes.get("expression")):
+        return False
+    if node_type in INPUT_TYPES and "input" not in attributes:
+        return False
+    if node_type == "dateCompare" and (may_evaluate_to_now(attributes.get("firstDate"))
+                                       or may_evaluate_to_now(attributes.get("secondDate"))):
+        # An operand evaluating to "now" is compared as the current time.
+        return False
+    if node_type == "static":
+        if _constant(node)[0]:
+            return False
+        values = [item for name, item in attributes.items() if name not in RESERVED_STATIC_ATTRIBUTES]
+    elif node_type == "concat":
+        values = attributes.get("values", [])
+    else:
+        values = [item for item in attributes.values() if is_transform(item)]
+    return all(_constant(item)[0] for item in values)
+
+
+def _static_value(text):
+    return {"attributes": {"value": text}, "type": "static"}
+
+
+def _fold_node(node, report):
+    """
+    Evaluates a node whose inputs are all constant and replaces it with a 'static'.
+    """
+    try:
+        result = compile_transform(node)({})
+    except Exception:
+        # Errors are left in place so they still surface when the tenant evaluates the transform.
+        return node
+    # Empty values and text that Velocity would interpret cannot be represented by a plain 'static'.
+    if not isinstance(result, str) or not result or "$" in result or "#" in result:
+        return node
+    report["folded"] += 1
+    return _static_value(result)
+
+
+def _flatten_concat(node, report):
+    values = []
+    for item in node["attributes"].get("values", []):
+        if is_transform(item) and item["type"] == "concat" and set(item.get("attributes") or {}) == {"values"}:
+            values.extend(item["attributes"]["values"])
+            report["flattened"] += 1
+        else:
+            values.append(item)
+    # Each entry is (text, plain) for constant text, where plain tells if it was written as a bare string,
+    # or (item, None) for values only known at evaluation time.
+    entries = []
+    for item in values:
+        constant, text = _constant(item)
+        if not (constant and isinstance(text, str)):
+            entries.append((item, None))
+        elif entries and entries[-1][1] is not None:
+            entries[-1] = (entries[-1][0] + text, entries[-1][1] and not isinstance(item, dict))
+            report["merged"] += 1
+        else:
+            entries.append((text, not isinstance(item, dict)))
+    # Merged text holding '$' or '#' stays a plain value: as a 'static' it would be read as a Velocity template.
+    values = [value if plain is None or plain or _is_template_text(value) else _static_value(value) for value, plain in entries]
+    if len(entries) == 1 and entries[0][1] is not None and not _is_template_text(entries[0][0]):
+        return _static_value(entries[0][0])
+    return dict(node, attributes=dict(node["attributes"], values=values))
+
+
+def _is_template_text(text):
+    return "$" in text or "#" in text
+
+
+def _prune_first_valid(node, report):
+    attributes = node["attributes"]
+    ignore_errors = attributes.get("ignoreErrors")
+    values = []
+    candidates = []
+    for item in attributes.get("values", []):
+        if is_transform(item) and item["type"] == "firstValid" and (item.get("attributes") or {}).get("ignoreErrors") == ignore_errors:
+            inlined = item["attributes"].get("values", [])
+            values.extend(inlined)
+            # Nested values were already pruned (the pass runs bottom-up): only the last one can be a constant.
+            if inlined:
+                candidates.append(len(values) - 1)
+            report["flattened"] += 1
+        else:
+            candidates.append(len(values))
+            values.append(item)
+    for index in candidates:
+        constant, text = _constant(values[index])
+        if constant and text is not None:
+            report["pruned"] += len(values) - index - 1
+            values = values[:index + 1]
+            break
+    if len(values) == 1 and not ignore_errors and (is_transform(values[0]) or values[0] is not None):
+        report["flattened"] += 1
+        return values[0] if is_transform(values[0]) else _static_value(values[0])
+    return dict(node, attributes=dict(attributes, values=values))
+
+
+def _replace_root(root, node):
+    """
+    Replaces the definition of a root transform by node, keeping the root's top-level keys (the 'name' and flags of
+    transform() output) and its ROOT_ATTRIBUTES.
+    """
+    kept = {name: root["attributes"][name] for name in ROOT_ATTRIBUTES
+            if isinstance(root.get("attributes"), dict) and name in root["attributes"]}
+    attributes = dict(kept, **{name: value for name, value in (node.get("attributes") or {}).items() if name not in kept})
+    return dict(root, type=node["type"], attributes=attributes)
+
+
+def fold_constants(tree):
+    """
+    Folds work that can be done at generation time, using the same semantics as the local evaluator.
+
+    Transforms whose inputs are all constants ('static' without variables, or literals) are evaluated and replaced
+    by a 'static'; nested 'concat' and nested 'firstValid' (with the same ignoreErrors) are inlined into their
+    parent; adjacent constant 'concat' values are merged; 'firstValid' values after a constant non-null value are
+    removed as unreachable. Nodes whose evaluation fails are left untouched.
+
+    :param tree: A transform dictionary. It is not modified.
+    :return: A tuple (new_tree, report) where report holds 'folded', 'flattened', 'merged' and 'pruned' counts.
+    """
+    report = {"folded": 0, "flattened": 0, "merged": 0, "pruned": 0}
+
+    def fold_node(value):
+        if not is_transform(value) or not isinstance(value.get("attributes"), dict):
+            return value
+        if value["type"] == "concat":
+            value = _flatten_concat(value, report)
+        elif value["type"] == "firstValid":
+            value = _prune_first_valid(value, report)
+        if is_transform(value) and _foldable(value):
+            value = _fold_node(value, report)
+        return value
+
+    if is_transform(tree) and isinstance(tree.get("attributes"), dict):
+        # The root keeps its name, flags and ROOT_ATTRIBUTES, even when it collapses into one of its values.
+        root = rewrite({"type": tree["type"], "attributes": tree["attributes"]}, {}, default=fold_node)
+        return _replace_root(tree, root), report
+    return rewrite(tree, {}, default=fold_node), report
+
+
+def optimize(tree, passes=None):
+    """
+    Runs optimizer passes over a transform and reports how many nodes were removed.
+
+    :param tree: A transform dictionary. It is not modified.
+    :param passes: (optional) List of pass functions taking a tree and returning (new_tree, report).
+                   Default is [eliminate_dead_variables, deduplicate_variables, fold_constants, rewrite_ladders].
+    :return: A tuple (new_tree, report) where report holds 'nodes_before', 'nodes_after', 'nodes_removed' and the
+             report of each pass under 'passes', keyed by pass name.
+    """
+    if passes is None:
+        passes = [eliminate_dead_variables, deduplicate_variables, fold_constants, rewrite_ladders]
+    nodes_before = count_nodes(tree)
+    report = {"passes": {}}
+    for optimizer_pass in passes:
+        tree, report["passes"][optimizer_pass.__name__] = optimizer_pass(tree)
+    nodes_after = count_nodes(tree)
+    report.update({"nodes_before": nodes_before, "nodes_after": nodes_after, "nodes_removed": nodes_before - nodes_after})
+    return tree, report
+
+
+_PROBE_ID = "__ladder_probe__"
+_CONDITIONAL_VARIABLE = re.compile(r"^\$\{?(\w+)\}?$")
+_VELOCITY_TEST = re.compile(r"""^\(\s*\$!?\{?(\w+)\}?\s*(?:==|eq)\s*(['"])([^'"$#\\]*)\2\s*\)$""")
+
+
+def _constant_text(value):
+    constant, text = _constant(value)
+    return text if constant and isinstance(text, str) else None
+
+
+def _conditional_ladder(node):
+    """
+    Collects the (constant, output) branches of nested conditionals that all compare the same subtree with constants.
+
+    :return: A tuple (subtree, branches, default) or None when node does not start such a ladder.
+    """
+    subtree = digest = None
+    branches = []
+    while is_transform(node) and node["type"] == "conditional":
+        attributes = node.get("attributes") or {}
+        match = re.match(r"^\s*(.*?)\s+eq\s+(.*?)\s*$", str(attributes.get("expression", "")))
+        variables = {name: item for name, item in attributes.items() if name not in RESERVED_CONDITIONAL_ATTRIBUTES}
+        if match is None or len(variables) != 1:
+            break
+        left, right = match.groups()
+        if _CONDITIONAL_VARIABLE.match(right) and "$" not in left:
+            left, right = right, left
+        name = _CONDITIONAL_VARIABLE.match(left)
+        output = _constant_text(attributes.get("positiveCondition"))
+        if name is None or name.group(1) not in variables or "$" in right or output is None:
+            break
+        item_digest = _digest_subtrees(variables[name.group(1)], [])[0]
+        if digest is not None and item_digest != digest:
+            break
+        subtree, digest = variables[name.group(1)], item_digest
+        branches.append((right, output))
+        node = attributes.get("negativeCondition")
+    default = _constant_text(node)
+    if default is None or not branches:
+        return None
+    return subtree, branches, default
+
+
+def _velocity_ladder(node):
+    """
+    Collects the branches of a 'static' whose template is one #if/#elseif/#else chain testing one variable.
+
+    :return: A tuple (subtree, branches, default) or None when the template has another shape.
+    """
+    attributes = node.get("attributes") or {}
+    variables = {name: item for name, item in attributes.items() if name not in RESERVED_STATIC_ATTRIBUTES}
+    if len(variables) != 1 or not isinstance(attributes.get("value"), str):
+        return None
+    name, subtree = next(iter(variables.items()))
+    tokens = [token for token in tokenize(attributes["value"]) if token.kind != COMMENT]
+    branches = []
+    default = ""
+    position = 0
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token.kind != DIRECTIVE:
+            return None
+        if token.name == "end":
+            break
+        body = []
+        while position < len(tokens) and tokens[position].kind in (TEXT, NEWLINE):
+            body.append(tokens[position].text)
+            position += 1
+        text = "".join(body)
+        if "\\" in text or "$" in text or "#" in text:
+            return None
+        if token.name in ("if", "elseif") and (token.name == "if") == (not branches):
+            match = _VELOCITY_TEST.match(token.args or "")
+            if match is None or match.group(1) != name:
+                return None
+            branches.append((match.group(3), text))
+        elif token.name == "else" and branches:
+            default = text
+        else:
+            return None
+    if position != len(tokens) or not branches or tokens[-1].name != "end":
+        return None
+    return subtree, branches, default
+
+
+def _ladder_lookup(subtree, branches, default):
+    table = {}
+    for key, output in branches:
+        # Earlier branches win, exactly like the nested evaluation order.
+        table.setdefault(key, output)
+    if "default" in table:
+        return None
+    table["default"] = default
+    return lookup(table, input=subtree)
+
+
+def _prove_ladder(original, rewritten, subtree, keys):
+    """
+    Evaluates both trees with the compared subtree replaced by probe values: every constant, a value matching
+    none of them and null. Returns the number of probes when all results agree, or None.
+    """
+    digest = _digest_subtrees(subtree, [])[0]
+    probe_original, probe_rewritten = (
+        _replace_nodes(tree, set(id(item) for item, item_digest, size in _collect_digests(tree) if item_digest == digest), reference(_PROBE_ID))
+        for tree in (original, rewritten)
+    )
+    probes = [_static_value(key) for key in keys if key] + [_static_value("␀no match␀"), identityAttribute("␀missing␀")]
+    for probe in probes:
+        transforms = {_PROBE_ID: probe}
+        try:
+            expected = compile_transform(probe_original, transforms)({})
+            actual = compile_transform(probe_rewritten, transforms)({})
+        except Exception:
+            return None
+        if expected != actual:
+            return None
+    return len(probes)
+
+
+def _collect_digests(tree):
+    digests = []
+    _digest_subtrees(tree, digests)
+    return digests
+
+
+def rewrite_ladders(tree, min_branches=2):
+    """
+    Rewrites equality ladders into a single 'lookup' transform.
+
+    Recognized ladders are conditionals nested through 'negativeCondition' (conditional(expression="$x eq A",
+    ...)) and 'static' templates made of one #if/#elseif/#else chain (#if($x == 'A')...), where every branch compares
+    the same subtree with a constant and returns a constant. The compared subtree is then evaluated once and matched
+    with one table probe. Every rewrite is checked by evaluating the original and the rewritten node on each
+    constant, a non-matching value and null; rewrites that do not agree are rejected.
+
+    :param tree: A transform dictionary. It is not modified.
+    :param min_branches: (optional) Minimum number of compared constants for a rewrite. Default is 2.
+    :return: A tuple (new_tree, report) where report holds 'rewritten' (list of (path, branches, probes) tuples)
+             and 'rejected' (list of paths).
+    """
+    report = {"rewritten": [], "rejected": []}
+
+    def rewrite_tree(tree, prefix):
+        replacements = {}
+
+        def check(value, path):
+            ladder = _conditional_ladder(value) if value["type"] == "conditional" else _velocity_ladder(value)
+            if ladder is None or len(ladder[1]) < min_branches:
+                return None
+            path = _join_paths(prefix, path)
+            subtree, branches, default = ladder
+            replacement = _ladder_lookup(subtree, branches, default)
+            probes = replacement and _prove_ladder(value, replacement, subtree, [key for key, output in branches])
+            if not probes:
+                report["rejected"].append(path)
+                return None
+            report["rewritten"].append((path, len(branches), probes))
+            # Only the compared subtree survives the rewrite: it is the only part of the ladder still to visit.
+            replacement["attributes"]["input"] = rewrite_tree(subtree, join_path(join_path(path, "attributes"), "input"))
+            if value is root:
+                replacement = _replace_root(root, replacement)
+            replacements[id(value)] = replacement
+            return SKIP
+
+        visit(tree, {"conditional": check, "static": check})
+        if not replacements:
+            return tree
+        return rewrite(tree, {}, default=lambda node: replacements.get(id(node), node))
+
+    root = tree
+    return rewrite_tree(tree, ""), report
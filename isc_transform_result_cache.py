@@ -0,0 +1,201 @@
+import hashlib
+import json
+import sqlite3
+
+from isc_transform_cache import DEFAULT_MAX_BYTES, content_hash
+from isc_transform_evaluator import NONDETERMINISTIC_TYPES, TRANSFORM_TYPES
+from isc_transform_incremental import ANY_ATTRIBUTE, dependencies
+from isc_transform_walk import walk
+
+
+# Buffered writes and recency updates are committed in one transaction every FLUSH_SIZE operations.
+FLUSH_SIZE = 1000
+
+_MISSING = object()
+
+
+def _fingerprint_function(found):
+    """
+    Builds the function hashing the inputs a subtree reads (see isc_transform_incremental.dependencies()).
+    """
+    attribute_names = sorted(found.identity_attributes, key=str)
+    sources = {}
+    for source_name, attribute in found.account_attributes:
+        sources.setdefault(source_name, set()).add(attribute)
+    # Account filters read every attribute of the source: the whole account list is part of the fingerprint.
+    accounts = [(source_name, None if ANY_ATTRIBUTE in names else sorted(names, key=str))
+                for source_name, names in sorted(sources.items(), key=lambda item: str(item[0]))]
+    references = sorted(found.reference_attributes, key=str)
+
+    def fingerprint(context):
+        attributes = context.identity.get("attributes") or {}
+        parts = [context.input, [attributes.get(name) for name in attribute_names]]
+        for source_name, names in accounts:
+            rows = context.source_accounts(source_name)
+            parts.append(rows if names is None else [[row.get(name) for name in names] for row in rows])
+        referenced = context.identity.get("references") or {}
+        parts.append([(referenced.get(uid) or {}).get(name) for uid, name in references])
+        text = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    return fingerprint
+
+
+class ResultCache(object):
+    """
+    Persistent cache of subtree evaluation results, stored in SQLite.
+
+    Entries are keyed by the content hash of a subtree (see isc_transform_cache.content_hash), combined with the
+    hashes of the 'reference' transforms it reaches, and a fingerprint of the identity values that subtree reads,
+    so a result is shared by every transform containing the same subtree and survives edits elsewhere in the tree. Reads refresh an entry's recency, and evict() removes the least
+    recently used entries once the stored results exceed max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, min_nodes=2):
+        """
+        :param path: Path of the SQLite database; it is created if needed.
+        :param max_bytes: (optional) Size limit of the stored results enforced by evict(). Default is 256 MiB.
+        :param min_nodes: (optional) Minimum number of transform nodes of a cached subtree: smaller subtrees are
+                          cheaper to evaluate than to look up. Default is 2.
+        """
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be a positive number of bytes.")
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_by_use ON results (used);
+        """)
+        self.max_bytes = max_bytes
+        self.min_nodes = min_nodes
+        self.clock = (self.connection.execute("SELECT MAX(used) FROM results").fetchone()[0] or 0) + 1
+        self._pending = {}
+        self._touched = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def wrap(self, node, compiled, transforms=None):
+        """
+        Wraps the compiled closure of a subtree so that its results are read from and written to the cache.
+
+        Called by isc_transform_evaluator.compile_transform(..., cache=cache) for every subtree. Subtrees smaller
+        than min_nodes, depending on the current time, using random values or referencing unknown transforms are
+        returned unwrapped.
+
+        :param node: A transform dictionary.
+        :param compiled: Its compiled closure.
+        :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries.
+        :return: The closure to use for the subtree.
+        """
+        transforms = transforms or {}
+        found = dependencies(node, transforms)
+        if found.time_dependent or not found.references <= set(transforms):
+            return compiled
+        types = [value.get("type") for tree in [node] + [transforms[key] for key in found.references]
+                 for value in walk(tree) if isinstance(value, dict)]
+        if any(node_type in NONDETERMINISTIC_TYPES for node_type in types) \
+                or sum(1 for node_type in types if node_type in TRANSFORM_TYPES) < self.min_nodes:
+            return compiled
+        digest = content_hash(node)
+        if found.references:
+            # The referenced definitions are part of the subtree's behavior: editing one must miss the old entries.
+            digest = content_hash([digest] + [[key, content_hash(transforms[key])] for key in sorted(found.references)])
+        fingerprint = _fingerprint_function(found)
+
+        def cached(context):
+            key = "%s:%s" % (digest, fingerprint(context))
+            value = self.get(key)
+            if value is not _MISSING:
+                return value
+            value = compiled(context)
+            self.put(key, value)
+            return value
+
+        return cached
+
+    def get(self, key, default=_MISSING):
+        """
+        Reads an entry and marks it as recently used.
+
+        :param key: An entry key.
+        :param default: (optional) Value returned when the key is not cached.
+        :return: The cached value, or default.
+        """
+        text = self._pending.get(key)
+        if text is None:
+            row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            text = row[0]
+            self._touched.add(key)
+            self._flush_if_needed()
+        self.hits += 1
+        return json.loads(text)
+
+    def put(self, key, value):
+        """
+        Stores an entry. Writes are buffered and committed by flush().
+
+        :param key: An entry key.
+        :param value: A JSON-serializable result; other values are not cached.
+        """
+        try:
+            self._pending[key] = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        self._flush_if_needed()
+
+    def _flush_if_needed(self):
+        if len(self._pending) + len(self._touched) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Commits buffered entries and recency updates.
+        """
+        if not self._pending and not self._touched:
+            return
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)",
+                                        ((key, text, len(key) + len(text.encode("utf-8")), self.clock)
+                                         for key, text in self._pending.items()))
+            self.connection.executemany("UPDATE results SET used = ? WHERE key = ?",
+                                        ((self.clock, key) for key in self._touched))
+        self._pending = {}
+        self._touched = set()
+        self.clock += 1
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the stored results fit in max_bytes.
+
+        :return: The number of entries removed.
+        """
+        self.flush()
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = []
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY used"):
+            if total <= self.max_bytes:
+                break
+            removed.append((key,))
+            total -= size
+        with self.connection:
+            self.connection.executemany("DELETE FROM results WHERE key = ?", removed)
+        return len(removed)
+
+    def close(self):
+        """
+        Commits buffered writes, enforces the size limit and closes the database.
+        """
+        self.evict()
+        self.connection.close()
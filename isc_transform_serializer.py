@@ -0,0 +1,231 @@
+import functools
+import json
+from json.encoder import encode_basestring, encode_basestring_ascii
+
+
+FORMATS = ("pretty", "compact", "ndjson")
+
+BUFFER_SIZE = 64 * 1024
+
+_END = object()
+
+
+def _default(value):
+    # Frozen nodes (see isc_transform_nodes) and other mappings are serialized like dictionaries.
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError("Object of type %s is not JSON serializable" % value.__class__.__name__)
+
+
+def _float(value):
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "Infinity" if value > 0 else "-Infinity"
+    return float.__repr__(value)
+
+
+def _scalar(value, encode_string):
+    """
+    Encodes a JSON scalar like json.dumps(), or returns None for containers and other objects.
+    """
+    if isinstance(value, str):
+        return encode_string(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return _float(value)
+    return None
+
+
+def _key(key, encode_string):
+    if not isinstance(key, str):
+        if isinstance(key, float):
+            key = _float(key)
+        elif key is True or key is False or key is None:
+            key = _scalar(key, encode_string)
+        elif isinstance(key, int):
+            key = int.__repr__(key)
+        else:
+            raise TypeError("keys must be str, int, float, bool or None, not %s" % key.__class__.__name__)
+    return encode_string(key)
+
+
+def _newline(indent, level):
+    return "\n" + " " * (indent * level) if indent is not None else ""
+
+
+def _iterencode(tree, indent, ensure_ascii):
+    """
+    Encodes a tree in chunks, exactly like json.JSONEncoder(indent=indent, separators=...).iterencode(tree), but
+    with an explicit stack instead of recursion, so the depth of the tree is not limited by the recursion limit.
+    """
+    encode_string = encode_basestring_ascii if ensure_ascii else encode_basestring
+    key_separator = ": " if indent is not None else ":"
+    # Each frame holds the container's id (for the circular reference check), its item iterator, whether it is a
+    # dictionary, and whether an item was written already.
+    stack = []
+    markers = set()
+    value = tree
+    while True:
+        chunk = _scalar(value, encode_string)
+        if chunk is not None:
+            yield chunk
+        elif isinstance(value, (dict, list, tuple)):
+            is_dict = isinstance(value, dict)
+            if not value:
+                yield "{}" if is_dict else "[]"
+            else:
+                if id(value) in markers:
+                    raise ValueError("Circular reference detected")
+                markers.add(id(value))
+                stack.append([id(value), iter(value.items()) if is_dict else iter(value), is_dict, False])
+                yield "{" if is_dict else "["
+        else:
+            value = _default(value)
+            continue
+        while stack:
+            frame = stack[-1]
+            item = next(frame[1], _END)
+            if item is _END:
+                stack.pop()
+                markers.discard(frame[0])
+                yield _newline(indent, len(stack)) + ("}" if frame[2] else "]")
+                continue
+            separator = ("," if frame[3] else "") + _newline(indent, len(stack))
+            frame[3] = True
+            if frame[2]:
+                yield separator + _key(item[0], encode_string) + key_separator
+                value = item[1]
+            else:
+                yield separator
+                value = item
+            break
+        else:
+            return
+
+
+def _encoder(output_format, ensure_ascii):
+    if output_format not in FORMATS:
+        raise ValueError("Unknown output format %r. Use one of: %s." % (output_format, ", ".join(FORMATS)))
+    return functools.partial(_iterencode, indent=4 if output_format == "pretty" else None, ensure_ascii=ensure_ascii)
+
+
+class BufferedWriter(object):
+    """
+    Collects small encoder chunks and writes them to the file object in large blocks.
+    """
+    __slots__ = ("fp", "chunks", "size")
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.chunks = []
+        self.size = 0
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.fp.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+
+def dump(tree, fp, output_format="pretty", ensure_ascii=True):
+    """
+    Writes a single transform incrementally to a file-like object.
+
+    The output is the same as json.dumps() with the same settings. The encoder keeps its own stack, so trees deeper
+    than the recursion limit (e.g. long generated fallback chains) are written too.
+
+    :param tree: A transform dictionary (or frozen Node).
+    :param fp: A text file-like object with a write() method.
+    :param output_format: (optional) 'pretty' (indented like transform()), 'compact' or 'ndjson'. Default is 'pretty'.
+    :param ensure_ascii: (optional) Boolean indicating whether non-ASCII characters are escaped. Default is True.
+    """
+    writer = BufferedWriter(fp)
+    for chunk in _encoder(output_format, ensure_ascii)(tree):
+        writer.write(chunk)
+    if output_format == "ndjson":
+        writer.write("\n")
+    writer.flush()
+
+
+def dumps(tree, output_format="compact", ensure_ascii=True):
+    """
+    Serializes a single transform to a string, exactly like dump() without the trailing newline of 'ndjson'.
+
+    :param tree: A transform dictionary (or frozen Node).
+    :param output_format: (optional) 'pretty', 'compact' or 'ndjson'. Default is 'compact'.
+    :param ensure_ascii: (optional) Boolean indicating whether non-ASCII characters are escaped. Default is True.
+    :return: The JSON text.
+    """
+    encode = _encoder(output_format, ensure_ascii)
+    try:
+        # The C encoder is much faster, but limited by the recursion limit: deep trees use the iterative encoder.
+        if output_format == "pretty":
+            return json.dumps(tree, indent=4, ensure_ascii=ensure_ascii, default=_default)
+        return json.dumps(tree, separators=(",", ":"), ensure_ascii=ensure_ascii, default=_default)
+    except RecursionError:
+        return "".join(encode(tree))
+
+
+def dump_many(trees, fp, output_format="ndjson", ensure_ascii=True):
+    """
+    Writes many transforms incrementally to a file-like object, one tree at a time.
+
+    Trees are consumed lazily, so trees can be a generator and memory use stays flat regardless of the number
+    or size of the transforms. 'pretty' and 'compact' write a JSON array; 'ndjson' writes one transform per line.
+
+    :param trees: An iterable of transform dictionaries (or frozen Nodes).
+    :param fp: A text file-like object with a write() method.
+    :param output_format: (optional) 'pretty', 'compact' or 'ndjson'. Default is 'ndjson'.
+    :param ensure_ascii: (optional) Boolean indicating whether non-ASCII characters are escaped. Default is True.
+    :return: The number of transforms written.
+    """
+    encode = _encoder(output_format, ensure_ascii)
+    writer = BufferedWriter(fp)
+    count = 0
+    if output_format != "ndjson":
+        writer.write("[")
+    for tree in trees:
+        if output_format == "pretty":
+            writer.write(",\n    " if count else "\n    ")
+            for chunk in encode(tree):
+                writer.write(chunk.replace("\n", "\n    "))
+        else:
+            if count and output_format == "compact":
+                writer.write(",")
+            for chunk in encode(tree):
+                writer.write(chunk)
+            if output_format == "ndjson":
+                writer.write("\n")
+        count += 1
+    if output_format == "pretty":
+        writer.write("\n]" if count else "]")
+    elif output_format == "compact":
+        writer.write("]")
+    writer.flush()
+    return count
+
+
+def iter_ndjson(fp):
+    """
+    Reads transforms back from an NDJSON stream, one line at a time.
+
+    :param fp: A text file-like object.
+    :return: A generator of transform dictionaries.
+    """
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
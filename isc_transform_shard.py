@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+
+from isc_transform_batch import columns_from_snapshot, compile_batch
+from isc_transform_evaluator import compile_transform
+from isc_transform_snapshot import Snapshot, write_snapshot
+
+
+BATCH = "batch"
+IDENTITY = "identity"
+ENGINES = (BATCH, IDENTITY)
+
+# Result codes: 0 is null, FAILED marks an identity whose evaluation raised an error, other codes index the
+# distinct values returned by the worker that evaluated the range.
+NULL = 0
+FAILED = 0xFFFFFFFF
+
+_worker = None
+
+
+class _Worker(object):
+    """
+    Per-process state: the compiled transform, the mapped snapshot and the attached result buffer.
+    """
+
+    def __init__(self, payload):
+        tree, transforms, now, seed, snapshot, buffer_name, engine = pickle.loads(payload)
+        self.snapshot = snapshot
+        self.now = now
+        self.seed = seed
+        self.engine = engine
+        self.tree = tree
+        self.transforms = transforms
+        self.run = compile_transform(tree, transforms)
+        self.run_batch = compile_batch(tree, transforms) if engine == BATCH else None
+        # Workers share the resource tracker of the process that created the buffer, which unlinks it.
+        self.buffer = shared_memory.SharedMemory(name=buffer_name)
+        self.codes = self.buffer.buf.cast("I")
+
+    def evaluate_range(self, start, stop):
+        outputs = None
+        if self.run_batch is not None:
+            try:
+                outputs = self.run_batch(columns_from_snapshot(self.tree, self.snapshot, start, stop, self.transforms),
+                                         size=stop - start, now=self.now, seed=self.seed)
+            except Exception:
+                # The column kernels stop at the first error: evaluate the range per identity to isolate it.
+                outputs = None
+        errors = {}
+        if outputs is None:
+            outputs = []
+            for index in range(start, stop):
+                try:
+                    outputs.append(self.run(self.snapshot.identity(index), now=self.now, seed=self.seed))
+                except Exception as error:
+                    errors[index] = str(error) or error.__class__.__name__
+                    outputs.append(None)
+        # Only the distinct values of the range travel back; each identity's result is a code in the shared buffer.
+        values = [None]
+        codes = {}
+        for index, value in enumerate(outputs, start):
+            if index in errors:
+                self.codes[index] = FAILED
+                continue
+            if value is None:
+                self.codes[index] = NULL
+                continue
+            key = (value.__class__, tuple(value) if isinstance(value, list) else value)
+            code = codes.get(key)
+            if code is None:
+                code = codes[key] = len(values)
+                values.append(value)
+            self.codes[index] = code
+        return start, stop, values, errors
+
+
+def _init_worker(payload):
+    global _worker
+    _worker = _Worker(payload)
+
+
+def _evaluate_range(bounds):
+    return _worker.evaluate_range(*bounds)
+
+
+def evaluate_sharded(tree, snapshot, workers=None, engine=BATCH, transforms=None, now=None, seed=None, shard_size=None,
+                     errors=None):
+    """
+    Evaluates a transform for every identity of a snapshot, across a process pool.
+
+    The identities stay in the memory-mapped columnar snapshot (see isc_transform_snapshot), which every worker
+    maps once, and each worker receives the transform pickled once at start-up and compiles it once; tasks are then
+    just index ranges. Workers write one code per identity into a pre-allocated shared-memory buffer and only send
+    back the distinct values of their range, so per-identity results are never pickled.
+
+    :param tree: A transform dictionary as produced by the builders or by transform(..., output_enabled=True).
+    :param snapshot: An isc_transform_snapshot.Snapshot, or a list of identity records that is converted into a
+                     temporary snapshot first.
+    :param workers: (optional) Number of worker processes. Default is the number of CPUs.
+    :param engine: (optional) 'batch' to use the column kernels of isc_transform_batch (ranges that fail are
+                   evaluated again per identity) or 'identity' for the per-identity evaluator. Default is 'batch'.
+    :param transforms: (optional) Dictionary mapping transform IDs to transform dictionaries for 'reference' transforms.
+    :param now: (optional) Timezone-aware datetime used as "now". Default is the current UTC time.
+    :param seed: (optional) Seed for the random generators used by the random* transforms.
+    :param shard_size: (optional) Number of identities per task. Default splits the snapshot in 4 tasks per worker.
+    :param errors: (optional) Dictionary receiving the position and error message of each failed identity.
+    :return: A list with the output for each identity, in snapshot order (None for failed identities).
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine %r. Use one of: %s." % (engine, ", ".join(ENGINES)))
+    if not isinstance(snapshot, Snapshot):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "identities.snapshot")
+            write_snapshot(snapshot, path)
+            with Snapshot(path) as temporary:
+                return evaluate_sharded(tree, temporary, workers, engine, transforms, now, seed, shard_size, errors)
+    size = len(snapshot)
+    if not size:
+        return []
+    workers = workers or os.cpu_count() or 1
+    shard_size = shard_size or max(1, -(-size // (4 * workers)))
+    now = now or datetime.now(timezone.utc)
+    buffer = shared_memory.SharedMemory(create=True, size=4 * size)
+    try:
+        payload = pickle.dumps((tree, transforms, now, seed, snapshot, buffer.name, engine), pickle.HIGHEST_PROTOCOL)
+        ranges = [(start, min(start + shard_size, size)) for start in range(0, size, shard_size)]
+        results = [None] * size
+        codes = buffer.buf.cast("I")
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(payload,)) as executor:
+                for start, stop, values, failed in executor.map(_evaluate_range, ranges):
+                    results[start:stop] = [values[code] if code != FAILED else None for code in codes[start:stop]]
+                    if errors is not None:
+                        errors.update(failed)
+        finally:
+            codes.release()
+    finally:
+        buffer.close()
+        buffer.unlink()
+    return results
+
+
+def scaling(tree, snapshot, worker_counts=None, engine=BATCH, now=None):
+    """
+    Measures how the sharded evaluation scales with the number of worker processes.
+
+    :param tree: A transform dictionary.
+    :param snapshot: An isc_transform_snapshot.Snapshot.
+    :param worker_counts: (optional) Worker counts to measure. Default is 1, 2, 4, ... up to the number of CPUs.
+    :param engine: (optional) 'batch' or 'identity' (see evaluate_sharded()). Default is 'batch'.
+    :param now: (optional) Timezone-aware datetime used as "now".
+    :return: A list of dictionaries with 'workers', 'seconds', 'per_second' and 'speedup' (relative to the first
+             worker count).
+    """
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted(set([2 ** power for power in range(cpus.bit_length()) if 2 ** power <= cpus] + [cpus]))
+    now = now or datetime.now(timezone.utc)
+    measurements = []
+    for workers in worker_counts:
+        started = time.perf_counter()
+        evaluate_sharded(tree, snapshot, workers=workers, engine=engine, now=now)
+        seconds = time.perf_counter() - started
+        measurements.append({
+            "workers": workers,
+            "seconds": seconds,
+            "per_second": len(snapshot) / seconds if seconds else float("inf"),
+            "speedup": measurements[0]["seconds"] / seconds if measurements and seconds else 1.0,
+        })
+    return measurements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a transform for every identity of a snapshot across processes.")
+    parser.add_argument("transform", help="JSON file with the transform.")
+    parser.add_argument("snapshot", help="Columnar snapshot written by isc_transform_snapshot.py.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count).")
+    parser.add_argument("--engine", choices=ENGINES, default=BATCH, help="Evaluation engine (default: batch).")
+    parser.add_argument("--scaling", action="store_true", help="Measure the throughput for 1, 2, 4, ... workers instead.")
+    args = parser.parse_args(argv)
+
+    with open(args.transform, encoding="utf-8") as transform_file:
+        tree = json.load(transform_file)
+    with Snapshot(args.snapshot) as snapshot:
+        if args.scaling:
+            for measurement in scaling(tree, snapshot, engine=args.engine):
+                sys.stdout.write("%(workers)3d workers: %(seconds)8.3f s  %(per_second)12.0f identities/s  x%(speedup).2f\n"
+                                 % measurement)
+            return 0
+        errors = {}
+        results = evaluate_sharded(tree, snapshot, workers=args.workers, engine=args.engine, errors=errors)
+        for index, value in enumerate(results):
+            record = {"identity": snapshot.identity_id(index), "value": value}
+            if index in errors:
+                record["error"] = errors[index]
+            sys.stdout.write(json.dumps(record, default=str) + "\n")
+    sys.stderr.write("Evaluated %d identities (%d failed).\n" % (len(results), len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
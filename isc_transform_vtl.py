@@ -0,0 +1,794 @@
+import functools
+import re
+from collections import namedtuple
+
+
+Token = namedtuple("Token", ["kind", "text", "name", "args"])
+Token.__doc__ = """
+A lexical token of a Velocity (VTL) template.
+
+kind is one of TEXT, DIRECTIVE, REFERENCE, COMMENT or NEWLINE. For directives, name is the directive name
+('if', 'elseif', 'else', 'end', 'set', ...) and args the parenthesized argument text including the parentheses
+(or None). For references, name is the root variable name and args the rest of the reference ('.method(...)' chains).
+"""
+
+TEXT = "TEXT"
+DIRECTIVE = "DIRECTIVE"
+REFERENCE = "REFERENCE"
+COMMENT = "COMMENT"
+NEWLINE = "NEWLINE"
+
+DIRECTIVES = ("elseif", "else", "end", "if", "set", "foreach", "break", "stop", "macro", "parse", "include", "define", "evaluate")
+BRACED_DIRECTIVES = ("elseif", "else")
+
+_DIRECTIVE_PATTERN = re.compile(r"#(?:\{(%s)\}|(%s)(?![A-Za-z0-9_]))" % ("|".join(DIRECTIVES), "|".join(DIRECTIVES)))
+_LOOSE_DIRECTIVE_PATTERN = re.compile(r"#(else|end)")
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_-]*")
+_WHITESPACE_PATTERN = re.compile(r"[ \t]*")
+_NEWLINE_PATTERN = re.compile(r"\s*[\r\n]\s*")
+_SPECIAL_PATTERN = re.compile(r"[#$\\\r\n]")
+_IDENTIFIER_CHARACTER = re.compile(r"[A-Za-z0-9_]")
+
+
+class VelocitySyntaxError(ValueError):
+    """
+    Raised when a Velocity template cannot be tokenized or parsed.
+    """
+
+
+def _scan_balanced(source, position, opening, closing):
+    """
+    Returns the position just after the bracket that closes the one at source[position], honoring quoted strings.
+    """
+    depth = 0
+    quote = None
+    index = position
+    while index < len(source):
+        character = source[index]
+        if quote:
+            if character == quote:
+                quote = None
+        elif character in "'\"":
+            quote = character
+        elif character == opening:
+            depth += 1
+        elif character == closing:
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        index += 1
+    raise VelocitySyntaxError("Unbalanced %r starting at position %d." % (opening, position))
+
+
+def _scan_reference(source, position):
+    """
+    Scans a reference starting at the '$' in source[position].
+
+    :return: A tuple (end, name, rest) or None when the '$' does not start a reference.
+    """
+    index = position + 1
+    if source.startswith("!", index):
+        index += 1
+    braced = source.startswith("{", index)
+    if braced:
+        index += 1
+    match = _IDENTIFIER_PATTERN.match(source, index)
+    if match is None:
+        return None
+    name = match.group(0)
+    if not braced:
+        # Hyphens are only valid inside ${...}; '$first-name' is '$first' followed by text.
+        name = re.match(r"[A-Za-z_][A-Za-z0-9_]*", name).group(0)
+    index = match.start() + len(name)
+    rest_start = index
+    while index < len(source):
+        if source[index] == "." and _IDENTIFIER_PATTERN.match(source, index + 1):
+            index = _IDENTIFIER_PATTERN.match(source, index + 1).end()
+            if source.startswith("(", index):
+                index = _scan_balanced(source, index, "(", ")")
+        elif source[index] == "[":
+            index = _scan_balanced(source, index, "[", "]")
+        else:
+            break
+    rest = source[rest_start:index]
+    if braced:
+        if not source.startswith("}", index):
+            return None
+        index += 1
+    return index, name, rest
+
+
+@functools.lru_cache(maxsize=1024)
+def tokenize(source):
+    """
+    Splits a Velocity template into tokens in a single left-to-right pass.
+
+    Results are cached by source text, so templates that are built repeatedly are only tokenized once.
+
+    :param source: The template text.
+    :return: A tuple of Token objects.
+    """
+    tokens = []
+    text_start = 0
+    index = 0
+    length = len(source)
+
+    def flush_text(end):
+        if end > text_start:
+            tokens.append(Token(TEXT, source[text_start:end], None, None))
+
+    while True:
+        match = _SPECIAL_PATTERN.search(source, index)
+        if match is None:
+            break
+        index = match.start()
+        character = source[index]
+        token = None
+        end = index + 1
+        if character == "\\":
+            # Escaped '#' or '$' is plain text.
+            index += 2
+            continue
+        if character in "\r\n":
+            end = _NEWLINE_PATTERN.match(source, index).end()
+            start = index - (len(source[text_start:index]) - len(source[text_start:index].rstrip(" \t")))
+            flush_text(start)
+            tokens.append(Token(NEWLINE, source[start:end], None, None))
+            text_start = index = end
+            continue
+        if character == "#":
+            if source.startswith("##", index):
+                # A line comment takes the indentation before it, so the line minifies like one without it.
+                newline = source.find("\n", index)
+                end = length if newline == -1 else newline
+                index -= len(source[text_start:index]) - len(source[text_start:index].rstrip(" \t"))
+                token = Token(COMMENT, source[index:end], None, None)
+            elif source.startswith("#*", index):
+                close = source.find("*#", index + 2)
+                if close == -1:
+                    raise VelocitySyntaxError("Unterminated block comment at position %d." % index)
+                end = close + 2
+                token = Token(COMMENT, source[index:end], None, None)
+            else:
+                directive = _DIRECTIVE_PATTERN.match(source, index) or _LOOSE_DIRECTIVE_PATTERN.match(source, index)
+                if directive is not None:
+                    name = directive.group(1) or (directive.group(2) if directive.re is _DIRECTIVE_PATTERN else None)
+                    end = directive.end()
+                    args = None
+                    if name not in ("else", "end", "break", "stop"):
+                        spaces = _WHITESPACE_PATTERN.match(source, end).end()
+                        if source.startswith("(", spaces):
+                            args_end = _scan_balanced(source, spaces, "(", ")")
+                            args = source[spaces:args_end]
+                            end = args_end
+                    token = Token(DIRECTIVE, source[index:end], name, args)
+        else:
+            reference = _scan_reference(source, index)
+            if reference is not None:
+                end, name, rest = reference
+                token = Token(REFERENCE, source[index:end], name, rest)
+        if token is None:
+            index += 1
+            continue
+        flush_text(index)
+        tokens.append(token)
+        text_start = index = end
+    flush_text(length)
+    return tuple(tokens)
+
+
+@functools.lru_cache(maxsize=1024)
+def minify(source):
+    """
+    Minifies a Velocity template in one pass over its tokens.
+
+    Line breaks and the indentation around them are removed, comments are dropped (joining lines would otherwise
+    turn a '##' comment into a comment over the rest of the template) and '#elseif'/'#else' are written in their
+    braced '#{elseif}'/'#{else}' form. Other directives are braced only when text follows them directly.
+
+    :param source: The template text.
+    :return: The minified template.
+    """
+    tokens = [token for token in tokenize(source.strip()) if token.kind not in (NEWLINE, COMMENT)]
+    output = []
+    for position, token in enumerate(tokens):
+        if token.kind != DIRECTIVE:
+            output.append(token.text)
+            continue
+        args = _NEWLINE_PATTERN.sub("", token.args) if token.args else ""
+        following = tokens[position + 1].text if position + 1 < len(tokens) else ""
+        if token.name in BRACED_DIRECTIVES or (not args and _IDENTIFIER_CHARACTER.match(following)):
+            output.append("#{%s}%s" % (token.name, args))
+        else:
+            output.append("#%s%s" % (token.name, args))
+    return "".join(output)
+
+
+def references(source):
+    """
+    Lists the variable names referenced by a Velocity template.
+
+    :param source: The template text.
+    :return: A set of root variable names ('$user.name' references 'user').
+    """
+    names = set()
+    for token in tokenize(source):
+        if token.kind == REFERENCE:
+            names.add(token.name)
+        elif token.kind == DIRECTIVE and token.args:
+            names.update(references(token.args[1:-1]))
+    return names
+
+
+# ---------------------------------------------------------------------------
+# Evaluation
+# ---------------------------------------------------------------------------
+
+_EXPRESSION_TOKEN = re.compile(r"""\s*(?:
+    (?P<number>\d+\.\d+|\d+)
+  | (?P<string>'[^']*'|"(?:[^"\\]|\\.)*")
+  | (?P<operator>==|!=|<=|>=|&&|\|\||[<>!+\-*/%=(),.\[\]{}$])
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+)""", re.X)
+
+_WORD_OPERATORS = {"eq": "==", "ne": "!=", "lt": "<", "le": "<=", "gt": ">", "ge": ">=", "and": "&&", "or": "||", "not": "!"}
+
+_STRING_METHODS = {
+    "toLowerCase": lambda value: value.lower(),
+    "toUpperCase": lambda value: value.upper(),
+    "trim": lambda value: value.strip(),
+    "length": len,
+    "isEmpty": lambda value: len(value) == 0,
+    "contains": lambda value, part: stringify(part) in value,
+    "startsWith": lambda value, prefix: value.startswith(stringify(prefix)),
+    "endsWith": lambda value, suffix: value.endswith(stringify(suffix)),
+    "equals": lambda value, other: value == stringify(other),
+    "equalsIgnoreCase": lambda value, other: other is not None and value.lower() == stringify(other).lower(),
+    "indexOf": lambda value, part: value.find(stringify(part)),
+    "charAt": lambda value, index: value[index],
+    "concat": lambda value, other: value + stringify(other),
+    "replace": lambda value, old, new: value.replace(stringify(old), stringify(new)),
+    "replaceAll": lambda value, regex, replacement: re.sub(regex, re.sub(r"\$(\d+)", r"\\g<\1>", replacement), value),
+    "matches": lambda value, regex: re.fullmatch(regex, value) is not None,
+    "split": lambda value, regex: re.split(regex, value),
+    "substring": lambda value, begin, end=None: value[begin:end] if end is not None else value[begin:],
+    "toString": lambda value: value,
+}
+
+_LIST_METHODS = {
+    "size": len,
+    "isEmpty": lambda value: len(value) == 0,
+    "get": lambda value, index: value[index],
+    "contains": lambda value, item: item in value,
+}
+
+_MAP_METHODS = {
+    "size": len,
+    "isEmpty": lambda value: len(value) == 0,
+    "get": lambda value, key: value.get(key),
+    "containsKey": lambda value, key: key in value,
+    "keySet": lambda value: list(value.keys()),
+    "values": lambda value: list(value.values()),
+}
+
+
+class _Stop(Exception):
+    """
+    Unwinds rendering for #stop.
+    """
+
+
+class _Break(Exception):
+    """
+    Unwinds the innermost #foreach for #break.
+    """
+
+
+def stringify(value):
+    """
+    Renders a value the way Velocity's toString() would.
+
+    :param value: Any value produced by a template or passed as a variable.
+    :return: The string, or None for null.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join("null" if item is None else stringify(item) for item in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ", ".join("%s=%s" % (stringify(key), stringify(item)) for key, item in value.items()) + "}"
+    return str(value)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _truthy(value):
+    return value is not None and value is not False
+
+
+def _equals(left, right):
+    if left is None or right is None:
+        return left is None and right is None
+    if _is_number(left) and _is_number(right):
+        return left == right
+    return stringify(left) == stringify(right)
+
+
+def _compare(operator, left, right):
+    if operator == "==":
+        return _equals(left, right)
+    if operator == "!=":
+        return not _equals(left, right)
+    if not ((_is_number(left) and _is_number(right)) or (isinstance(left, str) and isinstance(right, str))):
+        return False
+    if operator == "<":
+        return left < right
+    if operator == "<=":
+        return left <= right
+    if operator == ">":
+        return left > right
+    return left >= right
+
+
+def _arithmetic(operator, left, right):
+    if not (_is_number(left) and _is_number(right)):
+        return None
+    if operator == "+":
+        return left + right
+    if operator == "-":
+        return left - right
+    if operator == "*":
+        return left * right
+    if right == 0:
+        return None
+    if isinstance(left, int) and isinstance(right, int):
+        # Java integer semantics: truncate towards zero.
+        quotient = abs(left) // abs(right) * (1 if (left >= 0) == (right >= 0) else -1)
+        return quotient if operator == "/" else left - quotient * right
+    return left / right if operator == "/" else left % right
+
+
+def _call(target, name, args):
+    if target is None:
+        return None
+    if isinstance(target, str):
+        methods = _STRING_METHODS
+    elif isinstance(target, (list, tuple)):
+        methods = _LIST_METHODS
+    elif isinstance(target, dict):
+        methods = _MAP_METHODS
+    elif name == "toString" and not args:
+        return stringify(target)
+    else:
+        # Only the whitelisted String, List and Map methods are callable; anything else renders as null.
+        return None
+    if name not in methods:
+        return None
+    try:
+        return methods[name](target, *args)
+    except (TypeError, IndexError, ValueError, re.error):
+        # Velocity renders a failed call as if the reference were null.
+        return None
+
+
+def _property(target, name):
+    if isinstance(target, dict):
+        return target.get(name)
+    getter = "get" + name[:1].upper() + name[1:]
+    checker = "is" + name[:1].upper() + name[1:]
+    for method in (name, getter, checker):
+        value = _call(target, method, ())
+        if value is not None:
+            return value
+    return None
+
+
+class _ExpressionParser(object):
+    """
+    Recursive-descent parser turning a VTL expression into a closure taking the variable scope.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = []
+        position = 0
+        source = source.rstrip()
+        while position < len(source):
+            match = _EXPRESSION_TOKEN.match(source, position)
+            if match is None or match.end() == position:
+                raise VelocitySyntaxError("Unexpected character in expression %r at position %d." % (self.source, position))
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == "name" and value in _WORD_OPERATORS:
+                kind, value = "operator", _WORD_OPERATORS[value]
+            self.tokens.append((kind, value))
+            position = match.end()
+            if value == "{" and ("operator", "$") in self.tokens[-3:-1] and self.tokens[-2] in (("operator", "$"), ("operator", "!")):
+                # Formal references may contain hyphens ('${first-name}'), like the tokenizer accepts.
+                name = _IDENTIFIER_PATTERN.match(source, position)
+                if name is not None:
+                    self.tokens.append(("name", name.group(0)))
+                    position = name.end()
+        self.position = 0
+        self.steps = 0
+
+    def peek(self, value=None):
+        if self.position >= len(self.tokens):
+            return None
+        token = self.tokens[self.position]
+        if value is not None and token != ("operator", value):
+            return None
+        return token
+
+    def take(self, value=None):
+        token = self.peek(value)
+        if token is None:
+            expected = "%r" % value if value else "more input"
+            raise VelocitySyntaxError("Expected %s in expression %r." % (expected, self.source))
+        self.position += 1
+        return token
+
+    def done(self):
+        if self.position != len(self.tokens):
+            raise VelocitySyntaxError("Unexpected %r in expression %r." % (self.tokens[self.position][1], self.source))
+
+    def expression(self):
+        return self.disjunction()
+
+    def disjunction(self):
+        left = self.conjunction()
+        while self.peek("||"):
+            self.take()
+            right = self.conjunction()
+            left = (lambda left, right: lambda scope: _truthy(left(scope)) or _truthy(right(scope)))(left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.peek("&&"):
+            self.take()
+            right = self.negation()
+            left = (lambda left, right: lambda scope: _truthy(left(scope)) and _truthy(right(scope)))(left, right)
+        return left
+
+    def negation(self):
+        if self.peek("!"):
+            self.take()
+            operand = self.negation()
+            return lambda scope: not _truthy(operand(scope))
+        return self.comparison()
+
+    def comparison(self):
+        left = self.additive()
+        token = self.peek()
+        if token and token[0] == "operator" and token[1] in ("==", "!=", "<", "<=", ">", ">="):
+            self.take()
+            right = self.additive()
+            operator = token[1]
+            return lambda scope: _compare(operator, left(scope), right(scope))
+        return left
+
+    def additive(self):
+        left = self.multiplicative()
+        while self.peek("+") or self.peek("-"):
+            operator = self.take()[1]
+            right = self.multiplicative()
+            left = (lambda left, right, operator: lambda scope: _arithmetic(operator, left(scope), right(scope)))(left, right, operator)
+        return left
+
+    def multiplicative(self):
+        left = self.unary()
+        while self.peek("*") or self.peek("/") or self.peek("%"):
+            operator = self.take()[1]
+            right = self.unary()
+            left = (lambda left, right, operator: lambda scope: _arithmetic(operator, left(scope), right(scope)))(left, right, operator)
+        return left
+
+    def unary(self):
+        if self.peek("-"):
+            self.take()
+            operand = self.unary()
+            return lambda scope: _arithmetic("-", 0, operand(scope))
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            number = float(value) if "." in value else int(value)
+            return lambda scope: number
+        if kind == "string":
+            text = value[1:-1]
+            if value[0] == "'" or ("$" not in text and "#" not in text):
+                text = text.replace('\\"', '"') if value[0] == '"' else text
+                return lambda scope: text
+            template = compile_template(text.replace('\\"', '"'))
+            return template
+        if kind == "name" and value in ("true", "false", "null"):
+            constant = {"true": True, "false": False, "null": None}[value]
+            return lambda scope: constant
+        if (kind, value) == ("operator", "("):
+            inner = self.expression()
+            self.take(")")
+            return inner
+        if (kind, value) == ("operator", "["):
+            items = []
+            while not self.peek("]"):
+                items.append(self.expression())
+                if not self.peek("]"):
+                    self.take(",")
+            self.take("]")
+            return lambda scope: [item(scope) for item in items]
+        if (kind, value) == ("operator", "$"):
+            self.position -= 1
+            return self.reference()[0]
+        raise VelocitySyntaxError("Unexpected %r in expression %r." % (value, self.source))
+
+    def reference(self):
+        """
+        Parses '$name', '$!name', '${name}' and '.property', '.method(args)' and '[index]' chains.
+
+        :return: A tuple (closure, root_name, quiet).
+        """
+        self.take("$")
+        quiet = bool(self.peek("!"))
+        if quiet:
+            self.take()
+        braced = bool(self.peek("{"))
+        if braced:
+            self.take()
+        kind, name = self.take()
+        if kind != "name":
+            raise VelocitySyntaxError("Expected a variable name in %r." % self.source)
+        steps = []
+        while True:
+            if self.peek("."):
+                self.take()
+                kind, member = self.take()
+                if self.peek("("):
+                    self.take()
+                    args = []
+                    while not self.peek(")"):
+                        args.append(self.expression())
+                        if not self.peek(")"):
+                            self.take(",")
+                    self.take(")")
+                    steps.append((member, args))
+                else:
+                    steps.append((member, None))
+            elif self.peek("["):
+                self.take()
+                index = self.expression()
+                self.take("]")
+                steps.append((None, [index]))
+            else:
+                break
+        if braced:
+            self.take("}")
+        self.steps = len(steps)
+
+        def reference(scope):
+            value = scope.get(name)
+            for member, args in steps:
+                if value is None:
+                    return None
+                if member is None:
+                    value = _call(value, "get", [args[0](scope)])
+                elif args is None:
+                    value = _property(value, member)
+                else:
+                    value = _call(value, member, [arg(scope) for arg in args])
+            return value
+
+        return reference, name, quiet
+
+
+def _parse_expression(source):
+    parser = _ExpressionParser(source)
+    expression = parser.expression()
+    parser.done()
+    return expression
+
+
+def _compile_reference(token):
+    parser = _ExpressionParser(token.text)
+    reference, name, quiet = parser.reference()
+    parser.done()
+    literal = token.text
+
+    def render(scope, output):
+        value = reference(scope)
+        if value is None:
+            # Velocity renders undefined references literally unless they are quiet ($!name).
+            if not quiet:
+                output.append(literal)
+        else:
+            output.append(stringify(value))
+
+    return render
+
+
+def _compile_set(args):
+    parser = _ExpressionParser(args[1:-1])
+    reference, name, quiet = parser.reference()
+    if parser.steps:
+        raise VelocitySyntaxError("Only simple variables can be assigned with #set: %r." % args)
+    parser.take("=")
+    value = parser.expression()
+    parser.done()
+
+    def assign(scope, output):
+        scope[name] = value(scope)
+
+    return assign
+
+
+def _compile_block(tokens, position, terminators):
+    """
+    Compiles tokens into render functions until one of the terminator directives is reached.
+
+    :return: A tuple (render, position, terminator) where terminator is the directive token that ended the block.
+    """
+    renderers = []
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token.kind in (TEXT, NEWLINE):
+            text = re.sub(r"\\([#$])", r"\1", token.text)
+            renderers.append(lambda scope, output, text=text: output.append(text))
+        elif token.kind == REFERENCE:
+            renderers.append(_compile_reference(token))
+        elif token.kind == COMMENT:
+            continue
+        elif token.name in terminators:
+            return _sequence(renderers), position, token
+        elif token.name == "if":
+            renderer, position = _compile_if(tokens, position, token)
+            renderers.append(renderer)
+        elif token.name == "foreach":
+            renderer, position = _compile_foreach(tokens, position, token)
+            renderers.append(renderer)
+        elif token.name == "set":
+            if not token.args:
+                raise VelocitySyntaxError("#set requires an assignment.")
+            renderers.append(_compile_set(token.args))
+        elif token.name == "break":
+            renderers.append(_raise(_Break))
+        elif token.name == "stop":
+            renderers.append(_raise(_Stop))
+        else:
+            raise VelocitySyntaxError("Unsupported or misplaced directive #%s." % token.name)
+    if terminators:
+        raise VelocitySyntaxError("Missing #end.")
+    return _sequence(renderers), position, None
+
+
+def _raise(exception):
+    def render(scope, output):
+        raise exception()
+    return render
+
+
+def _sequence(renderers):
+    if len(renderers) == 1:
+        return renderers[0]
+
+    def render(scope, output):
+        for renderer in renderers:
+            renderer(scope, output)
+
+    return render
+
+
+def _compile_if(tokens, position, token):
+    branches = []
+    otherwise = None
+    condition = token
+    while True:
+        if condition.name in ("if", "elseif"):
+            if not condition.args:
+                raise VelocitySyntaxError("#%s requires a condition." % condition.name)
+            test = _parse_expression(condition.args[1:-1])
+            body, position, terminator = _compile_block(tokens, position, ("elseif", "else", "end"))
+            branches.append((test, body))
+        else:
+            otherwise, position, terminator = _compile_block(tokens, position, ("end",))
+        if terminator.name == "end":
+            break
+        if otherwise is not None:
+            raise VelocitySyntaxError("#%s after #else." % terminator.name)
+        condition = terminator
+
+    def render(scope, output):
+        for test, body in branches:
+            if _truthy(test(scope)):
+                body(scope, output)
+                return
+        if otherwise is not None:
+            otherwise(scope, output)
+
+    return render, position
+
+
+def _compile_foreach(tokens, position, token):
+    match = re.match(r"^\(\s*\$\{?(\w+)\}?\s+in\s+(.*)\)$", token.args or "", re.S)
+    if match is None:
+        raise VelocitySyntaxError("#foreach must be written as #foreach( $item in $list ): %r" % token.args)
+    name = match.group(1)
+    items = _parse_expression(match.group(2))
+    body, position, terminator = _compile_block(tokens, position, ("end",))
+
+    def render(scope, output):
+        values = items(scope)
+        if isinstance(values, dict):
+            values = list(values.values())
+        previous = scope.get(name)
+        try:
+            for count, value in enumerate(values or (), 1):
+                scope[name] = value
+                scope["velocityCount"] = count
+                body(scope, output)
+        except _Break:
+            pass
+        scope[name] = previous
+
+    return render, position
+
+
+@functools.lru_cache(maxsize=512)
+def compile_template(source):
+    """
+    Compiles a Velocity template into a closure, once per distinct source text.
+
+    Supported: '$var', '$!var', '${var}', property and method chains with the common Java String, List and Map
+    methods, '#set', '#if'/'#elseif'/'#else', '#foreach', '#break', '#stop', comparison ('==', '!=', '<', ...,
+    and 'eq', 'ne', ...), boolean ('&&', '||', '!') and arithmetic operators. Compiled templates are kept in an
+    LRU cache keyed by the template text.
+
+    :param source: The template text (raw or minified).
+    :return: A function render(variables) returning the rendered string.
+    """
+    body, position, terminator = _compile_block(tokenize(source), 0, ())
+
+    def render(variables=None):
+        scope = dict(variables or {})
+        output = []
+        try:
+            body(scope, output)
+        except _Stop:
+            pass
+        return "".join(output)
+
+    return render
+
+
+def render(source, variables=None):
+    """
+    Renders a Velocity template with the given variables.
+
+    :param source: The template text (raw or minified).
+    :param variables: (optional) Dictionary of variable values.
+    :return: The rendered string.
+    """
+    return compile_template(source)(variables)
+
+
+def assigned_variables(source):
+    """
+    Lists the variable names a Velocity template defines itself, with '#set' or as a '#foreach' loop variable.
+
+    :param source: The template text.
+    :return: A set of variable names.
+    """
+    names = set()
+    for token in tokenize(source):
+        if token.kind == DIRECTIVE and token.name in ("set", "foreach") and token.args:
+            match = re.match(r"\(\s*\$!?\{?(\w+)", token.args)
+            if match:
+                names.add(match.group(1))
+            if token.name == "foreach":
+                names.add("velocityCount")
+    return names
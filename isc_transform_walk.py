@@ -0,0 +1,333 @@
+import argparse
+import json
+import sys
+import time
+
+from isc_transform_analysis import join_path
+from isc_transform_nodes import Node
+
+
+_MAPPINGS = (dict, Node)
+_CONTAINERS = (dict, Node, list, tuple)
+
+# Returned by a visit() handler to skip the children of the node it was called for.
+SKIP = object()
+
+
+def _values(value):
+    return iter(value.values()) if isinstance(value, _MAPPINGS) else iter(value)
+
+
+def _items(value):
+    return iter(value.items()) if isinstance(value, _MAPPINGS) else enumerate(value)
+
+
+def walk(tree, paths=False):
+    """
+    Iterates over every value of a tree in document order (pre-order), without recursion.
+
+    Dictionaries (or frozen Nodes), lists and primitive values are all yielded, so the depth of the tree is only
+    limited by memory, not by the interpreter's recursion limit.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :param paths: (optional) Boolean indicating whether (path, value) tuples are yielded instead of values. Paths
+                  use the format of isc_transform_analysis.join_path ('' is the root). Default is False.
+    :return: A generator of values, or of (path, value) tuples.
+    """
+    if paths:
+        return _walk_paths(tree)
+    return _walk_values(tree)
+
+
+def _walk_values(tree):
+    # A stack of child iterators: each pass of the for loop resumes the innermost container where it left off.
+    stack = [iter((tree,))]
+    while stack:
+        for value in stack[-1]:
+            yield value
+            if isinstance(value, _CONTAINERS):
+                stack.append(_values(value))
+                break
+        else:
+            stack.pop()
+
+
+def _walk_paths(tree):
+    yield "", tree
+    if not isinstance(tree, _CONTAINERS):
+        return
+    stack = [("", _items(tree))]
+    while stack:
+        path, items = stack[-1]
+        for key, value in items:
+            child_path = join_path(path, key)
+            yield child_path, value
+            if isinstance(value, _CONTAINERS):
+                stack.append((child_path, _items(value)))
+                break
+        else:
+            stack.pop()
+
+
+def visit(tree, handlers, default=None):
+    """
+    Calls a handler for every transform node of a tree, parents before children, without recursion.
+
+    Handlers are looked up by node 'type' in a dispatch table. A handler receives the node and its path and may
+    return SKIP to leave the node's children out of the traversal; any other return value is ignored.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :param handlers: Dictionary mapping transform types to handler(node, path) functions.
+    :param default: (optional) Handler for dictionaries whose type has no entry in handlers (including plain
+                    objects such as lookup tables).
+    :return: The number of handler calls.
+    """
+    calls = 0
+    stack = [("", iter(((None, tree),)))]
+    while stack:
+        path, items = stack[-1]
+        for key, value in items:
+            if not isinstance(value, _CONTAINERS):
+                continue
+            child_path = path if key is None else join_path(path, key)
+            if isinstance(value, _MAPPINGS):
+                handler = handlers.get(value.get("type"), default)
+                if handler is not None:
+                    calls += 1
+                    if handler(value, child_path) is SKIP:
+                        continue
+            stack.append((child_path, _items(value)))
+            break
+        else:
+            stack.pop()
+    return calls
+
+
+def fold(tree, function):
+    """
+    Reduces a tree bottom-up (post-order), without recursion.
+
+    function(value, children) is called once per value: children is None for primitive values, a dictionary mapping
+    each key to the folded child for dictionaries, and a list of folded items for lists. This is the shape of
+    analyses such as sizes, depths or Merkle hashes.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :param function: A function(value, children) returning the folded value.
+    :return: The folded value of the root.
+    """
+    if not isinstance(tree, _CONTAINERS):
+        return function(tree, None)
+    # Each frame is (value, iterator over its children, folded children).
+    stack = [(tree, _values(tree), [])]
+    while True:
+        value, children, results = stack[-1]
+        for child in children:
+            if isinstance(child, _CONTAINERS):
+                stack.append((child, _values(child), []))
+                break
+            results.append(function(child, None))
+        else:
+            stack.pop()
+            result = function(value, dict(zip(value, results)) if isinstance(value, _MAPPINGS) else results)
+            if not stack:
+                return result
+            stack[-1][2].append(result)
+
+
+def rewrite(tree, handlers, default=None, paths=False):
+    """
+    Rewrites a tree bottom-up with copy-on-write, without recursion.
+
+    Handlers are looked up by node 'type' like in visit(); a handler receives a node whose children have already
+    been rewritten and returns its replacement (or the node itself to keep it). Only the dictionaries and lists on
+    the path from a replaced node up to the root are copied: every untouched subtree of the result is the very same
+    object as in the input, and the input is never modified. When nothing is replaced, the input itself is returned.
+
+    :param tree: A transform dictionary, or any JSON value made of dictionaries and lists.
+    :param handlers: Dictionary mapping transform types to handler(node) functions.
+    :param default: (optional) Handler for dictionaries whose type has no entry in handlers.
+    :param paths: (optional) Boolean indicating whether handlers are called as handler(node, path), with the path
+                  of the node in the input (see walk()). Default is False.
+    :return: The rewritten tree.
+    """
+    if not isinstance(tree, (dict, list)):
+        return tree
+    # Each frame is [value, iterator over its children, rewritten children, changed, key in the parent].
+    stack = [[tree, _items(tree), [], False, None]]
+    while True:
+        frame = stack[-1]
+        results = frame[2]
+        for key, child in frame[1]:
+            if isinstance(child, (dict, list)):
+                stack.append([child, _items(child), [], False, key])
+                break
+            results.append(child)
+        else:
+            stack.pop()
+            original = value = frame[0]
+            if isinstance(value, dict):
+                if frame[3]:
+                    value = dict(zip(value, results))
+                handler = handlers.get(value.get("type"), default)
+                if handler is not None and paths:
+                    # Paths are only built for the nodes a handler is called for: on deep trees they are long.
+                    path = ""
+                    for ancestor in stack[1:] + [frame]:
+                        path = join_path(path, ancestor[4])
+                    value = handler(value, path)
+                elif handler is not None:
+                    value = handler(value)
+            elif frame[3]:
+                value = results
+            if not stack:
+                return value
+            parent = stack[-1]
+            parent[2].append(value)
+            if value is not original:
+                parent[3] = True
+
+
+def size(tree):
+    """
+    Counts the values of a tree: dictionaries, lists and primitive values.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :return: The number of values, including the root.
+    """
+    count = 0
+    for _ in walk(tree):
+        count += 1
+    return count
+
+
+def depth(tree):
+    """
+    Measures the nesting depth of a tree.
+
+    :param tree: A transform dictionary (or frozen Node), or any JSON value.
+    :return: The number of nested containers on the longest path; 0 for a primitive value.
+    """
+    if not isinstance(tree, _CONTAINERS):
+        return 0
+    deepest = 1
+    stack = [_values(tree)]
+    while stack:
+        for value in stack[-1]:
+            if isinstance(value, _CONTAINERS):
+                stack.append(_values(value))
+                deepest = max(deepest, len(stack))
+                break
+        else:
+            stack.pop()
+    return deepest
+
+
+def _deep_tree(levels):
+    # A firstValid ladder nested through its last value, like long generated fallback chains.
+    tree = {"attributes": {"value": "default"}, "type": "static"}
+    for level in range(levels):
+        tree = {
+            "attributes": {"values": [{"attributes": {"name": "attribute%d" % level}, "type": "identityAttribute"}, tree]},
+            "type": "firstValid",
+        }
+    return tree
+
+
+def _wide_tree(nodes):
+    # A concat of lower(identityAttribute) branches: 7 values per branch (4 dictionaries and 3 strings).
+    branches = max(1, nodes // 7)
+    return {
+        "attributes": {"values": [
+            {"attributes": {"input": {"attributes": {"name": "attribute%d" % index}, "type": "identityAttribute"}}, "type": "lower"}
+            for index in range(branches)
+        ]},
+        "type": "concat",
+    }
+
+
+def _recursive_size(value):
+    if isinstance(value, dict):
+        return 1 + sum(_recursive_size(item) for item in value.values())
+    if isinstance(value, list):
+        return 1 + sum(_recursive_size(item) for item in value)
+    return 1
+
+
+def _timed(function, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            result = function()
+        except RecursionError:
+            return None, None
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _rename_first(tree):
+    # Replaces a single identityAttribute deep in the tree, to measure the cost of copying the spine.
+    state = {"done": False}
+
+    def rename(node):
+        if state["done"]:
+            return node
+        state["done"] = True
+        return {"attributes": {"name": "renamed"}, "type": "identityAttribute"}
+
+    return rewrite(tree, {"identityAttribute": rename})
+
+
+def benchmark(deep=10000, nodes=1000000, repeat=3):
+    """
+    Measures the walker on a deeply nested firstValid ladder and on a large flat tree.
+
+    For each tree, reports the seconds taken (best of repeat runs) by walk(), fold() computing the size, a no-op
+    rewrite() and a rewrite() replacing one node, next to a naive recursive size and json.dumps. Recursive
+    measurements that hit the recursion limit are reported as None.
+
+    :param deep: (optional) Number of nested firstValid transforms in the deep tree. Default is 10000.
+    :param nodes: (optional) Approximate number of values in the large tree. Default is 1000000.
+    :param repeat: (optional) Number of runs per measurement. Default is 3.
+    :return: A dictionary with one entry per tree ('deep' and 'wide'), each holding 'values', 'depth' and the
+             timings.
+    """
+    results = {}
+    for name, tree in (("deep", _deep_tree(deep)), ("wide", _wide_tree(nodes))):
+        walked, count = _timed(lambda: sum(1 for _ in walk(tree)), repeat)
+        folded, _ = _timed(lambda: fold(tree, lambda value, children: 1 + sum(
+            (children.values() if isinstance(children, dict) else children) or ())), repeat)
+        unchanged, same = _timed(lambda: rewrite(tree, {"identityAttribute": lambda node: node}), repeat)
+        replaced, _ = _timed(lambda: _rename_first(tree), repeat)
+        results[name] = {
+            "values": count,
+            "depth": depth(tree),
+            "walk": walked,
+            "fold": folded,
+            "rewrite_unchanged": unchanged,
+            "rewrite_unchanged_is_input": same is tree,
+            "rewrite_one_node": replaced,
+            "recursive_size": _timed(lambda: _recursive_size(tree), repeat)[0],
+            "json_dumps": _timed(lambda: json.dumps(tree), repeat)[0],
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the iterative tree walker.")
+    parser.add_argument("--deep", type=int, default=10000, help="Nesting of the deep firstValid tree (default: 10000).")
+    parser.add_argument("--nodes", type=int, default=1000000, help="Number of values in the large tree (default: 1000000).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (default: 3).")
+    args = parser.parse_args(argv)
+
+    for name, timings in benchmark(args.deep, args.nodes, args.repeat).items():
+        sys.stdout.write("%s tree: %d values, depth %d\n" % (name, timings["values"], timings["depth"]))
+        for key in ("walk", "fold", "rewrite_unchanged", "rewrite_one_node", "recursive_size", "json_dumps"):
+            seconds = timings[key]
+            sys.stdout.write("    %-18s %s\n" % (key, "recursion limit" if seconds is None else "%.3f s" % seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
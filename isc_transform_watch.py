@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import runpy
+import sys
+import tempfile
+import time
+import traceback
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from isc_transform_bulk import file_name
+from isc_transform_cache import local_modules
+
+
+POLL_INTERVAL = 0.2
+
+
+def _warm_worker():
+    # Import the library once per worker so that rebuilding a module only costs executing the module itself.
+    import isc_transform_evaluator
+    import isc_transform_generator
+
+
+def _printed_transforms(text):
+    """
+    Extracts the transforms printed by transform() calls from captured standard output.
+
+    Other output printed by the module is skipped.
+    """
+    decoder = json.JSONDecoder()
+    found = []
+    position = 0
+    while True:
+        position = text.find("{", position)
+        if position < 0:
+            return found
+        if position and text[position - 1] != "\n":
+            position += 1
+            continue
+        try:
+            value, position = decoder.raw_decode(text, position)
+        except Exception:
+            position += 1
+            continue
+        if isinstance(value, dict) and "name" in value and "type" in value:
+            found.append(value)
+
+
+def _inside(path, directory):
+    return os.path.abspath(path).startswith(os.path.join(os.path.abspath(directory), ""))
+
+
+def _evict_modules(directory):
+    # The warm worker keeps imported helper modules cached: forget the ones defined in the watched directory so
+    # that the next import reads their current source.
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and _inside(path, directory):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def build_module(path):
+    """
+    Executes a transform definition module and validates the transforms it prints.
+
+    Definition modules are scripts like the ones in examples/: each transform() call without output_enabled prints
+    one transform. The module is executed in a fresh namespace with its directory on the import path, like a script,
+    and the helper modules of that directory are imported again, so editing either never leaves stale state behind.
+
+    :param path: Path to the definition module.
+    :return: A dictionary with the 'transforms' printed by the module, the 'warnings' it raised and 'errors', a list
+             of messages for the module (an exception while executing it) or for transforms that fail validation.
+    """
+    from isc_transform_evaluator import compile_transform
+
+    directory = os.path.dirname(os.path.abspath(path))
+    _evict_modules(directory)
+    output = io.StringIO()
+    errors = []
+    sys.path.insert(0, directory)
+    with warnings.catch_warnings(record=True) as caught, contextlib.redirect_stdout(output):
+        warnings.simplefilter("always")
+        try:
+            runpy.run_path(path, run_name="__isc_watch__")
+        except BaseException:
+            errors.append(traceback.format_exc(limit=-3).rstrip())
+        finally:
+            sys.path.remove(directory)
+    transforms = _printed_transforms(output.getvalue())
+    for tree in transforms:
+        try:
+            compile_transform(tree)
+        except Exception as exception:
+            errors.append("%s: %s" % (tree["name"], str(exception) or exception.__class__.__name__))
+    return {"transforms": transforms, "warnings": [str(warning.message) for warning in caught], "errors": errors}
+
+
+def write_atomic(path, text):
+    """
+    Replaces a file in one step, so readers never see a partially written file.
+
+    :param path: Destination path.
+    :param text: The new content.
+    :return: True when the file was written, False when it already had this content.
+    """
+    try:
+        with open(path, encoding="utf-8") as current:
+            if current.read() == text:
+                return False
+    except OSError:
+        pass
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w", encoding="utf-8") as output:
+            output.write(text)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return True
+
+
+def _modified(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class Watcher(object):
+    """
+    Regenerates the transforms of a directory of definition modules whenever a module changes.
+
+    Modules are executed by a single warm worker process that keeps the library imported, so a save costs the
+    execution of the modified module only. Saving a helper module of the directory rebuilds every module importing
+    it, directly or indirectly (see isc_transform_cache.local_modules). Output files are written atomically and only when their content changes;
+    transforms that a module no longer produces are removed, and nothing is written for a module that fails.
+    """
+
+    def __init__(self, directory, output, interval=POLL_INTERVAL, log=None):
+        """
+        :param directory: Directory containing the definition modules (*.py, not recursive).
+        :param output: Directory receiving one pretty-printed JSON file per transform; it is created if needed.
+        :param interval: (optional) Seconds between two scans of the directory. Default is 0.2.
+        :param log: (optional) Text file-like object receiving one line per rebuild. Default is standard error.
+        """
+        os.makedirs(output, exist_ok=True)
+        self.directory = directory
+        self.output = output
+        self.interval = interval
+        self.log = log or sys.stderr
+        self.modified = {}
+        self.dependencies = {}
+        self.outputs = {}
+        self.executor = None
+
+    def _submit(self, path):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1, initializer=_warm_worker)
+        try:
+            return self.executor.submit(build_module, path).result()
+        except BrokenProcessPool:
+            self.executor = None
+            return {"transforms": [], "warnings": [], "errors": ["The worker process died while building %s." % path]}
+
+    def scan(self):
+        """
+        Compares the directory with the previous scan.
+
+        :return: A tuple (changed, removed) of sorted module paths.
+        """
+        current = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".py") and entry.is_file():
+                current[entry.path] = entry.stat().st_mtime_ns
+        changed = sorted(path for path, modified in current.items()
+                         if self.modified.get(path) != modified or self._dependencies_changed(path))
+        removed = sorted(set(self.modified) - set(current))
+        for path in removed:
+            self.dependencies.pop(path, None)
+        self.modified = current
+        return changed, removed
+
+    def _dependencies_changed(self, path):
+        return any(_modified(dependency) != modified for dependency, modified in self.dependencies.get(path, {}).items())
+
+    def _record_dependencies(self, path):
+        # Helper modules of the watched directory (including its packages) that the module imports.
+        try:
+            found = local_modules(path)
+        except Exception:
+            found = []
+        self.dependencies[path] = {dependency: _modified(dependency) for dependency in found
+                                   if dependency != os.path.abspath(path) and _inside(dependency, self.directory)}
+
+    def _remove_outputs(self, path, keep=()):
+        for name in self.outputs.pop(path, set()) - set(keep):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.output, name))
+
+    def rebuild(self, path):
+        """
+        Rebuilds one module and updates its output files.
+
+        :param path: Path to the definition module.
+        :return: The dictionary returned by build_module().
+        """
+        self._record_dependencies(path)
+        result = self._submit(path)
+        if result["errors"]:
+            return result
+        names = [file_name(tree["name"]) for tree in result["transforms"]]
+        for name, tree in zip(names, result["transforms"]):
+            write_atomic(os.path.join(self.output, name), json.dumps(tree, indent=4) + "\n")
+        self._remove_outputs(path, keep=names)
+        self.outputs[path] = set(names)
+        return result
+
+    def poll(self):
+        """
+        Scans the directory once and rebuilds the modules that changed.
+
+        :return: The number of modules rebuilt or removed.
+        """
+        changed, removed = self.scan()
+        for path in removed:
+            self._remove_outputs(path)
+            self.log.write("%s: removed\n" % os.path.basename(path))
+        for path in changed:
+            started = time.perf_counter()
+            result = self.rebuild(path)
+            elapsed = (time.perf_counter() - started) * 1000
+            status = "FAILED" if result["errors"] else "%d transform(s)" % len(result["transforms"])
+            self.log.write("%s: %s in %.0f ms\n" % (os.path.basename(path), status, elapsed))
+            for message in result["warnings"] + result["errors"]:
+                self.log.write("    %s\n" % message.replace("\n", "\n    "))
+        self.log.flush()
+        return len(changed) + len(removed)
+
+    def run(self):
+        """
+        Polls the directory until interrupted.
+        """
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate transforms whenever a definition module changes.")
+    parser.add_argument("directory", help="Directory containing the transform definition modules.")
+    parser.add_argument("--output", default="transforms", help="Output directory (default: transforms).")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="Seconds between scans (default: 0.2).")
+    parser.add_argument("--once", action="store_true", help="Build every module once and exit.")
+    args = parser.parse_args(argv)
+
+    watcher = Watcher(args.directory, args.output, args.interval)
+    if args.once:
+        watcher.poll()
+        watcher.close()
+    else:
+        watcher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+
+# The modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _TenantHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *arguments):
+        pass
+
+    def _send(self, status, payload=None, headers=()):
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        tenant = self.server.tenant
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length)) if length else None
+        parts = urlsplit(self.path)
+        with tenant.lock:
+            tenant.requests.append((method, parts.path, self.headers.get("Host")))
+            scripted = tenant.script.pop(0) if tenant.script and method != "GET" else None
+        if scripted is not None:
+            status, headers = scripted
+            return self._send(status, {"error": "scripted"}, headers)
+        if method == "GET":
+            query = parse_qs(parts.query)
+            offset, limit = int(query["offset"][0]), int(query["limit"][0])
+            trees = sorted(tenant.transforms.values(), key=lambda tree: tree["name"])
+            return self._send(200, trees[offset:offset + limit])
+        if method == "POST":
+            with tenant.lock:
+                payload["id"] = "id-%d" % (len(tenant.transforms) + 1)
+                tenant.transforms[payload["id"]] = payload
+            return self._send(201, payload)
+        transform_id = parts.path.rsplit("/", 1)[-1]
+        if transform_id not in tenant.transforms:
+            return self._send(404, {"error": "not found"})
+        payload["id"] = transform_id
+        tenant.transforms[transform_id] = payload
+        return self._send(200, payload)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+
+class StubTenant(object):
+    """
+    In-process transforms API: lists, creates and updates transforms, and answers the next create or update
+    requests with the (status, headers) pairs queued in script.
+    """
+
+    def __init__(self):
+        self.transforms = {}
+        self.script = []
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _TenantHandler)
+        self.server.daemon_threads = True
+        self.server.tenant = self
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def add(self, tree):
+        tree = dict(tree, id="id-%d" % (len(self.transforms) + 1))
+        self.transforms[tree["id"]] = tree
+        return tree
+
+
+@pytest.fixture
+def tenant():
+    stub = StubTenant()
+    thread = threading.Thread(target=stub.server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        yield stub
+    finally:
+        stub.server.shutdown()
+        stub.server.server_close()
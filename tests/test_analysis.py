@@ -0,0 +1,30 @@
+from isc_transform_analysis import infer_periodic_refresh, may_evaluate_to_now, time_dependencies
+from isc_transform_generator import dateCompare, dateMath, firstValid, identityAttribute, lookup, reference, static
+
+
+def test_date_compare_against_literal_now():
+    tree = dateCompare(identityAttribute("end"), "now", "LT")
+    assert time_dependencies(tree) == [("attributes.secondDate", "dateCompare against now")]
+
+
+def test_date_compare_against_operand_evaluating_to_now():
+    tree = dateCompare(static("now"), "2025-01-01T00:00:00Z", "GT")
+    assert time_dependencies(tree) == [("attributes.firstDate", "dateCompare operand may evaluate to now")]
+    assert infer_periodic_refresh(firstValid([identityAttribute("a"), static("now")]))[0] is False
+    assert time_dependencies(dateCompare(static("Snow"), identityAttribute("a"), "LT")) == []
+    assert infer_periodic_refresh(dateCompare(firstValid([identityAttribute("a"), "now"]), "2025-01-01", "GT"))[0]
+
+
+def test_may_evaluate_to_now():
+    assert may_evaluate_to_now("now")
+    assert not may_evaluate_to_now("NOW")
+    assert may_evaluate_to_now(static("#if($a)now#{else}$a#end", {"a": identityAttribute("a")}))
+    assert not may_evaluate_to_now(static("Snow"))
+    assert not may_evaluate_to_now(static("now and then"))
+    assert not may_evaluate_to_now(static("Snow $a", {"a": identityAttribute("a")}))
+    assert may_evaluate_to_now(lookup({"x": "2025-01-01", "default": "now"}, input=identityAttribute("a")))
+    assert may_evaluate_to_now(reference("R"), {"R": static("now")})
+    assert not may_evaluate_to_now(reference("R"))
+    assert not may_evaluate_to_now(identityAttribute("end"))
+    assert not may_evaluate_to_now(dateMath("now-1d"))
+    assert not may_evaluate_to_now("2025-01-01T00:00:00Z")
@@ -0,0 +1,105 @@
+import asyncio
+
+import isc_transform_async
+from isc_transform_async import AsyncTransformClient
+
+
+def _sleeps(monkeypatch):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record(delay, *arguments):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(isc_transform_async.asyncio, "sleep", record)
+    return delays
+
+
+def _static(name, value):
+    return {"name": name, "type": "static", "attributes": {"value": value}}
+
+
+def _deploy(client, transforms):
+    async def run():
+        async with client:
+            return await client.deploy_many(transforms)
+
+    return asyncio.run(run())
+
+
+def test_deploy_many(tenant, monkeypatch):
+    _sleeps(monkeypatch)
+    tenant.add(_static("Kept", "same"))
+    changed = tenant.add(_static("Changed", "old"))
+    results = _deploy(AsyncTransformClient(tenant.url, token="token"),
+                      [_static("Kept", "same"), _static("Changed", "new"), _static("Added", "C")])
+    assert [(result.name, result.action) for result in results] == [("Kept", "unchanged"), ("Changed", "updated"),
+                                                                    ("Added", "created")]
+    assert tenant.transforms[changed["id"]]["attributes"]["value"] == "new"
+
+
+def test_host_header_names_the_port(tenant):
+    _deploy(AsyncTransformClient(tenant.url, token="token"), [])
+    port = tenant.url.rsplit(":", 1)[1]
+    assert tenant.requests and all(host == "127.0.0.1:" + port for method, path, host in tenant.requests)
+
+
+def test_retry_after_is_not_capped_by_max_backoff(tenant, monkeypatch):
+    delays = _sleeps(monkeypatch)
+    tenant.script = [(429, [("Retry-After", "5")])]
+    client = AsyncTransformClient(tenant.url, token="token", max_backoff=0.01)
+    assert [result.action for result in _deploy(client, [_static("Name", "A")])] == ["created"]
+    assert client.retries == 1 and delays and 4.5 <= delays[0] <= 6.25
+
+
+def test_retries_exhausted(tenant, monkeypatch):
+    _sleeps(monkeypatch)
+    tenant.script = [(503, [])] * 3
+    client = AsyncTransformClient(tenant.url, token="token", max_retries=2)
+    results = _deploy(client, [_static("Name", "A")])
+    assert results[0].action == "failed" and "HTTP 503" in results[0].error and client.retries == 2
+
+
+def test_connection_errors_fail_only_their_transform(tenant, monkeypatch):
+    request = isc_transform_async._HostPool.request
+
+    async def flaky(pool, method, path, body, headers):
+        if method == "POST" and b'"Broken"' in body:
+            raise ConnectionRefusedError("Connection refused")
+        return await request(pool, method, path, body, headers)
+
+    monkeypatch.setattr(isc_transform_async._HostPool, "request", flaky)
+    results = _deploy(AsyncTransformClient(tenant.url, token="token"), [_static("Broken", "A"), _static("Fine", "B")])
+    assert [(result.name, result.action) for result in results] == [("Broken", "failed"), ("Fine", "created")]
+    assert "Connection refused" in results[0].error
+
+
+def test_bodiless_responses_do_not_wait_for_the_connection_to_close():
+    replies = [b"HTTP/1.1 204 No Content\r\n\r\n",
+               b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 304 Not Modified\r\nContent-Length: 7\r\n\r\n",
+               b"HTTP/1.1 200 OK\r\nContent-Length: 7\r\n\r\n"]
+
+    async def run():
+        async def reply(reader, writer):
+            # Every reply keeps the connection open: reading a body until it closes would time out.
+            for response in replies:
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                writer.write(response)
+                await writer.drain()
+            await reader.read()
+            writer.close()
+
+        server = await asyncio.start_server(reply, "127.0.0.1", 0)
+        pool = isc_transform_async._HostPool("127.0.0.1", server.sockets[0].getsockname()[1], False, 1, 2)
+        try:
+            responses = [(await pool.request(method, "/", None, {}))[::2] for method in ("DELETE", "GET", "HEAD")]
+            return responses, pool.opened
+        finally:
+            pool.close()
+            server.close()
+
+    responses, opened = asyncio.run(run())
+    assert responses == [(204, b""), (304, b""), (200, b"")]
+    assert opened == 1
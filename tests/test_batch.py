@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from isc_transform_batch import columns_from_identities, evaluate_batch
+from isc_transform_evaluator import compile_transform
+from isc_transform_generator import (accountAttribute, concat, conditional, dateCompare, firstValid,
+                                     getReferenceIdentityAttribute, identityAttribute, reference, static, substring, upper)
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+IDENTITIES = [
+    {"attributes": {"x": "ab"}, "accounts": {"HR": [{"id": None, "n": "1"}, {"id": "b", "n": "2"}]}},
+    {"attributes": {"x": "abcdef"}, "accounts": {"HR": [{"id": "a", "n": "2"}, {"id": "b", "n": "1"}]}},
+    {"attributes": {"x": None}, "accounts": {"HR": [{"id": "c"}]}},
+    {"attributes": {}, "accounts": {}},
+]
+
+
+def _assert_parity(tree, identities=IDENTITIES):
+    run = compile_transform(tree)
+    expected = [run(identity, now=NOW) for identity in identities]
+    columns = columns_from_identities(tree, identities)
+    assert evaluate_batch(tree, columns, size=len(identities), now=NOW) == expected
+    return expected
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"account_return_first_link": True},
+    {"account_sort_attribute": "n"},
+    {"account_sort_attribute": "n", "account_sort_descending": True},
+    {"account_sort_attribute": "n", "account_sort_descending": True, "account_return_first_link": True},
+])
+def test_account_selection_matches_evaluator(options):
+    _assert_parity(accountAttribute("HR", "id", **options))
+
+
+def test_account_return_first_link_returns_null_of_first_account():
+    assert _assert_parity(accountAttribute("HR", "id", account_return_first_link=True))[0] is None
+
+
+def test_account_sort_descending():
+    assert _assert_parity(accountAttribute("HR", "id", account_sort_attribute="n", account_sort_descending=True))[1] == "a"
+
+
+def test_same_account_attribute_with_different_selection_rules():
+    tree = conditional("$a eq $b", "same", "different",
+                       a=accountAttribute("HR", "id"), b=accountAttribute("HR", "id", account_return_first_link=True))
+    assert _assert_parity(tree)[:2] == ["different", "same"]
+
+
+def test_conditional_evaluates_branches_only_for_their_rows():
+    identities = [{"attributes": {"x": "ab", "k": "a"}}, {"attributes": {"x": "abcdef", "k": "b"}}]
+    tree = conditional("$k eq a", static("no"), substring(1, 5, input=identityAttribute("x")), k=identityAttribute("k"))
+    assert _assert_parity(tree, identities) == ["no", "bcde"]
+
+
+def test_date_compare_evaluates_branches_only_for_their_rows():
+    identities = [{"attributes": {"d": "2020-01-01T00:00:00Z", "x": "ab"}},
+                  {"attributes": {"d": "2030-01-01T00:00:00Z", "x": "abcdef"}}]
+    tree = dateCompare(identityAttribute("d"), "now", "LT", static("past"), substring(1, 5, input=identityAttribute("x")))
+    assert _assert_parity(tree, identities) == ["past", "bcde"]
+
+
+def test_reference_identity_attributes_match_evaluator():
+    identities = [{"attributes": {}, "references": {"manager": {"email": "m@x"}}}, {"attributes": {}}]
+    tree = concat([getReferenceIdentityAttribute("manager", "email"), static("x")])
+    assert _assert_parity(tree, identities) == ["m@xx", "x"]
+
+
+def test_reference_transforms_match_evaluator():
+    transforms = {"Email": firstValid([accountAttribute("HR", "id"), identityAttribute("x")]),
+                  "Manager": getReferenceIdentityAttribute("manager", "email")}
+    identities = IDENTITIES + [{"attributes": {"x": "y"}, "references": {"manager": {"email": "m@x"}}}]
+    tree = concat([upper(reference("Email")), static("/"), reference("Manager")])
+    run = compile_transform(tree, transforms)
+    expected = [run(identity, now=NOW) for identity in identities]
+    columns = columns_from_identities(tree, identities, transforms)
+    assert evaluate_batch(tree, columns, size=len(identities), now=NOW, transforms=transforms) == expected
+    assert expected[0] == "B/" and expected[-1] == "Y/m@x"
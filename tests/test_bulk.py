@@ -0,0 +1,80 @@
+import io
+import json
+import os
+
+import pytest
+
+from isc_transform_bulk import file_name, generate, load_spec, main, write_directory, write_ndjson
+
+TEMPLATE = '''from isc_transform_generator import identityAttribute, lookup, transform
+from isc_transform_walk import _deep_tree
+
+
+def generate(name, department, **row):
+    return transform(name, lookup({department: "yes", "default": "no"}, input=identityAttribute("department")),
+                     output_enabled=True)
+
+
+def deep(name):
+    return transform(name, _deep_tree(500), output_enabled=True)
+'''
+
+ROWS = [{"name": "Department %d: HR/AD" % index, "department": "D%d" % index} for index in range(40)]
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "department_template.py"
+    path.write_text(TEMPLATE, encoding="utf-8")
+    return str(path)
+
+
+def test_generate_keeps_the_row_order(template):
+    results = list(generate(ROWS, template, workers=1))
+    assert [name for name, text in results] == [row["name"] for row in ROWS]
+    assert json.loads(results[3][1])["attributes"]["table"] == {"D3": "yes", "default": "no"}
+    assert list(generate(ROWS, template, workers=2)) == results
+
+
+def test_generate_formats(template):
+    name, text = next(generate(ROWS[:1], template, workers=1, output_format="pretty"))
+    assert text == json.dumps(json.loads(text), indent=4)
+    name, text = next(generate(ROWS[:1], template, workers=1))
+    assert text == json.dumps(json.loads(text), separators=(",", ":"))
+
+
+def test_generate_deep_trees(template):
+    name, text = next(generate([{"name": "Deep"}], template, "deep", workers=1))
+    assert name == "Deep" and text.startswith('{"name":"Deep","type":"firstValid"')
+
+
+def test_write_ndjson_keeps_the_order(template):
+    output = io.StringIO()
+    assert write_ndjson(generate(ROWS, template, workers=2), output) == len(ROWS)
+    assert [json.loads(line)["name"] for line in output.getvalue().splitlines()] == [row["name"] for row in ROWS]
+
+
+def test_file_names():
+    assert file_name("Department 3: HR/AD") == "Department_3_HR_AD.json"
+    assert file_name("Lifecycle-State.v2") == "Lifecycle-State.v2.json"
+    assert file_name("  Région ") == "Région.json"
+
+
+def test_write_directory(template, tmp_path):
+    directory = str(tmp_path / "transforms")
+    assert write_directory(generate(ROWS[:3], template, workers=1, output_format="pretty"), directory) == 3
+    assert sorted(os.listdir(directory)) == ["Department_%d_HR_AD.json" % index for index in range(3)]
+    with open(os.path.join(directory, "Department_1_HR_AD.json"), encoding="utf-8") as transform_file:
+        assert json.load(transform_file)["name"] == "Department 1: HR/AD"
+    with pytest.raises(ValueError):
+        write_directory([("a/b", "{}"), ("a b", "{}")], str(tmp_path / "clash"))
+
+
+def test_main_reads_a_csv_spec(template, tmp_path, capsys):
+    spec = tmp_path / "spec.csv"
+    spec.write_text("name,department\nFirst,D1\nSecond,D2\n", encoding="utf-8")
+    assert load_spec(str(spec)) == [{"name": "First", "department": "D1"}, {"name": "Second", "department": "D2"}]
+    output = str(tmp_path / "transforms.ndjson")
+    main([str(spec), template, "--workers", "1", "--output", output])
+    with open(output, encoding="utf-8") as output_file:
+        assert [json.loads(line)["name"] for line in output_file] == ["First", "Second"]
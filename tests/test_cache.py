@@ -0,0 +1,36 @@
+import os
+
+from isc_transform_cache import library_modules, local_modules, module_hash
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as source:
+        source.write(text)
+
+
+def test_module_hash_follows_local_imports(tmp_path):
+    template = str(tmp_path / "template.py")
+    _write(template, "from helpers.names import display\nimport isc_transform_generator\n\n"
+                     "def generate(**row):\n    return display(row)\n")
+    os.makedirs(str(tmp_path / "helpers"))
+    _write(str(tmp_path / "helpers" / "__init__.py"), "")
+    helper = str(tmp_path / "helpers" / "names.py")
+    _write(helper, "from .common import SEPARATOR\n\ndef display(row):\n    return row\n")
+    common = str(tmp_path / "helpers" / "common.py")
+    _write(common, "SEPARATOR = ' '\n")
+
+    found = local_modules(template)
+    assert helper in found and common in found
+    assert any(path.endswith("isc_transform_generator.py") for path in found)
+    assert any(path.endswith("isc_transform_nodes.py") for path in found)
+
+    before = module_hash(template)
+    _write(common, "SEPARATOR = '-'\n")
+    assert module_hash(template) != before
+
+
+def test_library_modules_include_the_serialization_code():
+    names = set(os.path.basename(path) for path in library_modules())
+    assert {"isc_transform_generator.py", "isc_transform_bulk.py", "isc_transform_serializer.py",
+            "isc_transform_cache.py", "isc_transform_vtl.py", "isc_transform_nodes.py",
+            "isc_transform_analysis.py"} <= names
@@ -0,0 +1,74 @@
+import contextlib
+import io
+import json
+import os
+import runpy
+
+import pytest
+
+from isc_transform_cache import canonical_json
+from isc_transform_decompile import _render, decompile, decompile_many, iter_export
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+def _example_exports():
+    # The examples print their transforms; each one is exported as the tenant would, with its metadata.
+    decoder = json.JSONDecoder()
+    exports = []
+    for name in sorted(os.listdir(EXAMPLES)):
+        if not name.endswith(".py"):
+            continue
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            runpy.run_path(os.path.join(EXAMPLES, name))
+        text = output.getvalue().strip()
+        position = 0
+        while position < len(text):
+            tree, end = decoder.raw_decode(text, position)
+            position = len(text) - len(text[end:].lstrip())
+            exports.append(dict(tree, id="id-%d" % len(exports), created="2025-01-01T00:00:00Z"))
+    return exports
+
+
+EXPORTS = _example_exports()
+
+
+def _configuration_export(transforms):
+    objects = []
+    for tree in transforms:
+        objects.append({"self": {"type": "TRANSFORM", "id": tree["id"], "name": tree["name"]}, "object": tree})
+        objects.append({"self": {"type": "SOURCE", "name": "HR"}, "object": {"name": 'HR "main" {]', "owner": None}})
+    return {"version": 1, "timestamp": "2025-01-01T00:00:00Z", "options": {"includeTypes": ["TRANSFORM"]},
+            "objects": objects}
+
+
+@pytest.mark.parametrize("tree", EXPORTS, ids=[tree["name"] for tree in EXPORTS])
+def test_examples_round_trip(tree):
+    source, exact = decompile(tree)
+    assert exact
+    assert source.startswith("from isc_transform_generator import *")
+    expected = {key: value for key, value in tree.items() if key not in ("id", "created")}
+    assert canonical_json(_render(source)) == canonical_json(expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64, 4096])
+def test_iter_export_reads_any_chunking(chunk_size):
+    assert len(EXPORTS) >= 5
+    text = json.dumps(EXPORTS, indent=2)
+    assert list(iter_export(io.StringIO(text), chunk_size)) == EXPORTS
+    # Only transforms are read from a configuration export, whatever the other objects hold.
+    text = json.dumps(_configuration_export(EXPORTS), indent=2, ensure_ascii=False)
+    assert list(iter_export(io.StringIO(text), chunk_size)) == EXPORTS
+
+
+def test_iter_export_rejects_truncated_files():
+    text = json.dumps(EXPORTS)
+    with pytest.raises(ValueError):
+        list(iter_export(io.StringIO(text[:len(text) // 2]), 16))
+
+
+def test_decompile_many_keeps_the_export_order():
+    expected = [(tree["name"],) + decompile(tree) for tree in EXPORTS]
+    assert list(decompile_many(iter(EXPORTS), workers=1, batch_size=2)) == expected
+    assert list(decompile_many(iter(EXPORTS * 3), workers=2, batch_size=2)) == expected * 3
@@ -0,0 +1,107 @@
+import isc_transform_deploy
+from isc_transform_deploy import TransformClient, parse_retry_after
+
+
+def _sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(isc_transform_deploy.time, "sleep", delays.append)
+    return delays
+
+
+def _static(name, value):
+    return {"name": name, "type": "static", "attributes": {"value": value}}
+
+
+def test_retry_after_is_not_capped_by_max_backoff(tenant, monkeypatch):
+    delays = _sleeps(monkeypatch)
+    tenant.script = [(429, [("Retry-After", "5")])]
+    client = TransformClient(tenant.url, token="token", max_backoff=0.01)
+    client.create(_static("Name", "A"))
+    client.close()
+    assert client.retries == 1 and delays and 5 <= delays[0] <= 6.25
+
+
+def test_retry_after_explicit_cap(tenant, monkeypatch):
+    delays = _sleeps(monkeypatch)
+    tenant.script = [(429, [("Retry-After", "120")])]
+    client = TransformClient(tenant.url, token="token", max_retry_after=2)
+    client.create(_static("Name", "A"))
+    client.close()
+    assert delays and 2 <= delays[0] <= 2.5
+
+
+def test_retry_after_http_date_and_invalid_values(tenant, monkeypatch):
+    delays = _sleeps(monkeypatch)
+    in_a_minute = isc_transform_deploy.email.utils.formatdate(isc_transform_deploy.time.time() + 60, usegmt=True)
+    tenant.script = [(429, [("Retry-After", in_a_minute)]), (429, [("Retry-After", "Wed, 32 Oct 2015 07:28:00 GMT")]),
+                     (429, [("Retry-After", "inf")])]
+    client = TransformClient(tenant.url, token="token", backoff=0.01, max_backoff=0.1)
+    client.create(_static("Name", "A"))
+    client.close()
+    assert client.retries == 3
+    # The HTTP date pauses every request (time.sleep is not really sleeping here, so the pause is still pending).
+    assert all(55 <= delay <= 75 for delay in delays[::2])
+    # Headers that do not parse fall back to the exponential backoff instead of failing or stalling the request.
+    assert len(delays[1::2]) == 2 and all(delay <= 0.1 for delay in delays[1::2])
+
+
+def test_connection_errors_fail_only_their_transform(tenant, monkeypatch):
+    client = TransformClient(tenant.url, token="token")
+    request = client.pool.request
+
+    def flaky(method, path, body=None, headers=None):
+        if method == "POST" and b'"Broken"' in body:
+            raise ConnectionRefusedError("Connection refused")
+        return request(method, path, body, headers)
+
+    monkeypatch.setattr(client.pool, "request", flaky)
+    results = client.deploy([_static("Broken", "A"), _static("Fine", "B")])
+    client.close()
+    assert [(result.name, result.action) for result in results] == [("Broken", "failed"), ("Fine", "created")]
+    assert "Connection refused" in results[0].error
+
+
+def test_parse_retry_after():
+    now = isc_transform_deploy.time.time()
+    in_a_minute = isc_transform_deploy.email.utils.formatdate(now + 60, usegmt=True)
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("-3") == 0.0
+    assert 55 <= parse_retry_after(in_a_minute) <= 60
+    assert 55 <= parse_retry_after(in_a_minute.replace("GMT", "-0000")) <= 60
+    for value in (None, "", "soon", "inf", "nan", "Wed, 32 Oct 2015 07:28:00 GMT", "Wed, 21 Oct 99999 07:28:00 GMT"):
+        assert parse_retry_after(value) is None
+
+
+def test_deploy_creates_updates_and_skips_unchanged(tenant, monkeypatch):
+    _sleeps(monkeypatch)
+    kept = tenant.add(_static("Kept", "same"))
+    changed = tenant.add(_static("Changed", "old"))
+    client = TransformClient(tenant.url, token="token", workers=2)
+    results = client.deploy([_static("Kept", "same"), _static("Changed", "new"), _static("Added", "C")])
+    client.close()
+    assert [(result.name, result.action) for result in results] == [("Kept", "unchanged"), ("Changed", "updated"),
+                                                                    ("Added", "created")]
+    assert results[0].id == kept["id"] and results[1].id == changed["id"]
+    assert tenant.transforms[changed["id"]]["attributes"]["value"] == "new"
+    assert not any(method == "PUT" and path.endswith(kept["id"]) for method, path, host in tenant.requests)
+    assert sum(1 for method, path, host in tenant.requests if method == "POST") == 1
+
+
+def test_transient_errors_are_retried(tenant, monkeypatch):
+    delays = _sleeps(monkeypatch)
+    tenant.script = [(503, []), (502, [])]
+    client = TransformClient(tenant.url, token="token", backoff=0.1, max_backoff=0.15)
+    results = client.deploy([_static("Name", "A")])
+    client.close()
+    assert results[0].action == "created" and client.retries == 2
+    assert len(delays) == 2 and all(delay <= 0.15 for delay in delays)
+
+
+def test_retries_exhausted(tenant, monkeypatch):
+    _sleeps(monkeypatch)
+    tenant.script = [(503, [])] * 3
+    client = TransformClient(tenant.url, token="token", max_retries=2)
+    results = client.deploy([_static("Name", "A")])
+    client.close()
+    assert results[0].action == "failed" and "HTTP 503" in results[0].error
+    assert not tenant.transforms and client.retries == 2
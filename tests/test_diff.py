@@ -0,0 +1,31 @@
+from isc_transform_diff import diff
+from isc_transform_walk import _deep_tree
+
+
+def _static(value):
+    return {"type": "static", "attributes": {"value": value}}
+
+
+def test_template_formatting_is_cosmetic():
+    old = _static("## comment\n#if($a)\n    yes\n#end")
+    new = _static("#if($a)yes#end")
+    changes = diff(old, new)
+    assert changes and not any(change.semantic for change in changes)
+
+
+def test_whitespace_in_plain_values_is_semantic():
+    for old, new in (("Hello World ", "Hello World"), ("A\nB", "AB")):
+        changes = diff(_static(old), _static(new))
+        assert [change.semantic for change in changes] == [True]
+
+
+def test_deep_ladder():
+    old, new = _deep_tree(5000), _deep_tree(5000)
+    node = new
+    for level in range(4999):
+        node = node["attributes"]["values"][1]
+    node["attributes"]["values"][1]["attributes"]["value"] = "other"
+    changes = diff(old, new)
+    assert [(change.kind, change.old, change.new, change.semantic) for change in changes] == \
+        [("changed", "default", "other", True)]
+    assert changes[0].path.endswith("attributes.values[1].attributes.value")
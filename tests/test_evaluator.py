@@ -0,0 +1,132 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from isc_transform_evaluator import TransformEvaluationError, compile_transform, evaluate
+from isc_transform_generator import (accountAttribute, concat, conditional, dateCompare, dateMath, firstValid,
+                                     getReferenceIdentityAttribute, identityAttribute, lower, randomNumeric, reference,
+                                     split, static, substring)
+from isc_transform_walk import _deep_tree
+
+NOW = datetime(2025, 6, 15, 13, 45, 30, tzinfo=timezone.utc)
+
+# A lookup without default, which the lookup() builder refuses to create.
+STRICT_LOOKUP = {"type": "lookup", "attributes": {"table": {"a": "1"}, "input": identityAttribute("a")}}
+
+
+def test_repeated_subtrees_are_memoized():
+    tree = concat([lower(identityAttribute("a")), "-", lower(identityAttribute("a"))])
+    stats = {}
+    assert evaluate(tree, {"attributes": {"a": "X"}}, stats=stats) == "x-x"
+    assert stats["cache_hits"] == 1
+
+
+def test_random_subtrees_are_not_memoized():
+    identity = {"attributes": {}}
+    direct = evaluate(concat([randomNumeric(8), randomNumeric(8)]), identity, seed=1)
+    assert direct[:8] != direct[8:]
+    referenced = evaluate(concat([reference("R"), reference("R")]), identity, seed=1,
+                          transforms={"R": static("$n", {"n": randomNumeric(8)})})
+    assert referenced[:8] != referenced[8:]
+
+
+def test_compile_deep_ladder():
+    run = compile_transform(_deep_tree(800))
+    assert run({"attributes": {"attribute0": "deepest"}}) == "deepest"
+    assert run({"attributes": {}}) == "default"
+
+
+def test_compile_deep_referenced_transform():
+    run = compile_transform(reference("Deep"), {"Deep": _deep_tree(800)})
+    assert run({"attributes": {"attribute799": "first"}}) == "first"
+
+
+def test_first_valid():
+    tree = firstValid([identityAttribute("a"), identityAttribute("b"), "x"])
+    assert evaluate(tree, {"attributes": {"b": "B"}}) == "B"
+    assert evaluate(tree, {"attributes": {}}) == "x"
+    assert evaluate(firstValid([identityAttribute("a")]), {"attributes": {}}) is None
+    identity = {"attributes": {"a": "z"}}
+    assert evaluate(firstValid([STRICT_LOOKUP, "fallback"], ignore_errors=True), identity) == "fallback"
+    with pytest.raises(TransformEvaluationError):
+        evaluate(firstValid([STRICT_LOOKUP, "fallback"]), identity)
+
+
+def test_conditional():
+    tree = conditional("$d eq IT", "yes", "no", d=identityAttribute("d"))
+    assert evaluate(tree, {"attributes": {"d": "IT"}}) == "yes"
+    assert evaluate(tree, {"attributes": {"d": "it"}}) == "no"
+    # A null variable is not substituted: '$d' never equals the constant.
+    assert evaluate(tree, {"attributes": {}}) == "no"
+    tree = conditional("$d eq $e", identityAttribute("d"), static("none"), d=identityAttribute("d"),
+                       e=identityAttribute("e"))
+    assert evaluate(tree, {"attributes": {"d": "1", "e": "1"}}) == "1"
+    assert evaluate(tree, {"attributes": {"d": "1", "e": "2"}}) == "none"
+
+
+def test_date_math_with_a_fixed_now():
+    assert evaluate(dateMath("now"), {}, now=NOW) == "2025-06-15T13:45:30.000Z"
+    assert evaluate(dateMath("now-1d/d"), {}, now=NOW) == "2025-06-14T00:00:00.000Z"
+    assert evaluate(dateMath("now+1M/M", round_up=True), {}, now=NOW) == "2025-07-31T23:59:59.999Z"
+    # Adding months clamps the day to the end of the month.
+    tree = dateMath("+3M", input=identityAttribute("hired"))
+    assert evaluate(tree, {"attributes": {"hired": "2025-01-31T00:00:00Z"}}, now=NOW) == "2025-04-30T00:00:00.000Z"
+    assert evaluate(tree, {"attributes": {}}, now=NOW) is None
+
+
+def test_date_compare_with_a_fixed_now():
+    tree = dateCompare(identityAttribute("end"), "now", "LT", "past", "future")
+    assert evaluate(tree, {"attributes": {"end": "2025-06-15T13:45:29Z"}}, now=NOW) == "past"
+    assert evaluate(tree, {"attributes": {"end": "2025-06-15T13:45:30Z"}}, now=NOW) == "future"
+    tree = dateCompare(identityAttribute("end"), dateMath("now-30d"), "GTE")
+    assert evaluate(tree, {"attributes": {"end": "2025-05-16T13:45:30Z"}}, now=NOW) == "yes"
+    assert evaluate(tree, {"attributes": {"end": "2025-05-16T13:45:29Z"}}, now=NOW) == "no"
+
+
+def test_account_selection_options():
+    identity = {"accounts": {"HR": [{"id": "b", "n": "2"}, {"id": None, "n": "1"}, {"id": "a", "n": "3"}]}}
+    assert evaluate(accountAttribute("HR", "id"), identity) == "b"
+    assert evaluate(accountAttribute("HR", "id", account_sort_attribute="n"), identity) == "b"
+    assert evaluate(accountAttribute("HR", "id", account_sort_attribute="n", account_return_first_link=True),
+                    identity) is None
+    assert evaluate(accountAttribute("HR", "id", account_sort_attribute="n", account_sort_descending=True),
+                    identity) == "a"
+    # Accounts may also be listed with their source, as in the identity API.
+    identity = {"accounts": [{"sourceName": "HR", "attributes": {"id": "x"}},
+                             {"sourceName": "AD", "attributes": {"id": "y"}}]}
+    assert evaluate(accountAttribute("AD", "id"), identity) == "y"
+    assert evaluate(accountAttribute("Missing", "id"), identity) is None
+    fetched = []
+
+    def fetch(record, source_name):
+        fetched.append(source_name)
+        return [{"id": source_name.lower()}]
+
+    assert evaluate(concat([accountAttribute("AD", "id"), accountAttribute("AD", "id")]), {},
+                    fetch_accounts=fetch) == "adad"
+    assert fetched == ["AD"]
+
+
+def test_references():
+    identity = {"attributes": {"a": "X"}, "references": {"manager": {"email": "m@example.com"}}}
+    assert evaluate(reference("R", input=identityAttribute("a")), identity, transforms={"R": lower()}) == "x"
+    assert evaluate(getReferenceIdentityAttribute("manager", "email"), identity) == "m@example.com"
+    assert evaluate(getReferenceIdentityAttribute("buddy", "email"), identity) is None
+
+
+@pytest.mark.parametrize("tree, transforms, message", [
+    (reference("Missing"), None, "Referenced transform 'Missing' is not available locally."),
+    (reference("A"), {"A": reference("B"), "B": reference("A")}, "Circular reference to transform 'A'."),
+    (conditional("$a", "y", "n", a="1"), None, "Conditional expression must be formatted as 'ValueA eq ValueB'"),
+    (dateCompare(identityAttribute("x"), "now", "LT"), None, "dateCompare received a null date."),
+    (dateMath("now+1q"), None, "Unsupported dateMath expression 'now+1q'."),
+    (STRICT_LOOKUP, None, "No lookup table entry matches None and no default is defined."),
+    ({"type": "bogus"}, None, "Unsupported transform type: 'bogus'"),
+    ({"type": "rule", "attributes": {"operation": "nope"}}, None, "Rule operation 'nope' cannot be evaluated locally."),
+    (substring(5, input="abc"), None, "Substring bounds [5, 3) are out of range for 'abc'."),
+    (split(",", 3, input="a,b"), None, "Split index 3 is out of range for 'a,b'."),
+])
+def test_errors(tree, transforms, message):
+    with pytest.raises(TransformEvaluationError) as raised:
+        evaluate(tree, {"attributes": {}}, transforms=transforms, now=NOW)
+    assert str(raised.value).startswith(message)
@@ -0,0 +1,109 @@
+import io
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+from isc_transform_generator import concat, identityAttribute, lookup, randomNumeric, static, substring
+from isc_transform_impact import ERROR, Difference, impact, main, summarize
+from isc_transform_snapshot import Snapshot, snapshot_records, write_snapshot
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+DEPARTMENTS = ["IT", "HR", "Sales", "Legal"]
+
+IDENTITIES = [{"id": "id-%02d" % index,
+               "attributes": {"department": DEPARTMENTS[index % 4], "code": "xx" if index % 5 else ""}}
+              for index in range(50)]
+
+OLD = concat([lookup({"IT": "1", "HR": "2", "default": "0"}, input=identityAttribute("department")), static("-"),
+              randomNumeric(6), identityAttribute("code")])
+# Sales moves from 0 to 3, and identities without a code now fail.
+NEW = concat([lookup({"IT": "1", "HR": "2", "Sales": "3", "default": "0"}, input=identityAttribute("department")),
+              static("-"), randomNumeric(6), substring(0, 2, input=identityAttribute("code"))])
+
+
+def _expected():
+    differences = []
+    for identity in IDENTITIES:
+        department, code = identity["attributes"]["department"], identity["attributes"]["code"]
+        if not code or department == "Sales":
+            differences.append((identity["id"], department, not code))
+    return differences
+
+
+def _check(differences, stats):
+    expected = _expected()
+    assert [(difference.identity, difference.new_error is not None) for difference in differences] == [
+        (identity, failed) for identity, department, failed in expected]
+    for difference, (identity, department, failed) in zip(differences, expected):
+        assert difference.old_error is None
+        # The random suffix is the same for both versions: only the definition change shows.
+        assert difference.old.startswith({"IT": "1-", "HR": "2-"}.get(department, "0-"))
+        if not failed:
+            assert difference.new == "3" + difference.old[1:]
+    assert stats == {"identities": 50, "changed": len(expected), "errors": sum(failed for *rest, failed in expected)}
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("impact") / "identities.snapshot")
+    write_snapshot(IDENTITIES, path)
+    with Snapshot(path) as mapped:
+        yield mapped
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_impact_on_records_and_ndjson(workers):
+    stats = {}
+    differences = list(impact(OLD, NEW, IDENTITIES, now=NOW, workers=workers, shard_size=7, stats=stats))
+    _check(differences, stats)
+    lines = io.StringIO("".join(json.dumps(identity) + "\n" for identity in IDENTITIES))
+    stats = {}
+    assert list(impact(OLD, NEW, snapshot_records(lines), now=NOW, workers=workers, shard_size=7,
+                       stats=stats)) == differences
+    _check(differences, stats)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_impact_on_a_snapshot(snapshot, workers):
+    stats = {}
+    differences = list(impact(OLD, NEW, snapshot, now=NOW, workers=workers, shard_size=7, stats=stats))
+    _check(differences, stats)
+    assert differences == list(impact(OLD, NEW, IDENTITIES, now=NOW, workers=1))
+
+
+def test_identical_versions_do_not_differ(snapshot):
+    stats = {"identities": 10}
+    assert list(impact(OLD, OLD, snapshot, now=NOW, workers=1, stats=stats)) == []
+    assert stats == {"identities": 60, "changed": 0, "errors": 0}
+
+
+def test_identity_keys_fall_back_to_name_and_position():
+    records = [{"name": "Ann", "attributes": {"department": "Sales"}}, {"attributes": {"department": "Sales"}}]
+    assert [difference.identity for difference in impact(OLD, NEW, records, now=NOW, workers=1)] == ["Ann", 1]
+
+
+def test_summarize():
+    differences = [Difference("1", "0", "3", None, None), Difference("2", "0", "3", None, None),
+                   Difference("3", "1", None, None, "Substring bounds"), Difference("4", ["a", "b"], ["a"], None, None)]
+    assert summarize(differences) == Counter({("0", "3"): 2, ("1", ERROR): 1, (("a", "b"), ("a",)): 1})
+    stats = {}
+    summary = summarize(impact(OLD, NEW, IDENTITIES, now=NOW, workers=1, stats=stats))
+    assert sum(summary.values()) == stats["changed"]
+    assert sum(count for (old, new), count in summary.items() if new == ERROR) == stats["errors"] > 0
+    assert all(new == ERROR or (old[0], new[0]) == ("0", "3") for old, new in summary)
+
+
+def test_main(snapshot, tmp_path, capsys):
+    old, new = tmp_path / "old.json", tmp_path / "new.json"
+    old.write_text(json.dumps(OLD), encoding="utf-8")
+    new.write_text(json.dumps(NEW), encoding="utf-8")
+    output = tmp_path / "changed.ndjson"
+    arguments = [str(old), str(new), snapshot.path, "--workers", "1", "--now", "2025-06-01T00:00:00Z"]
+    assert main(arguments + ["--output", str(output)]) == 1
+    changed = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert [record["identity"] for record in changed] == [identity for identity, *rest in _expected()]
+    assert "%d of 50 identities change" % len(changed) in capsys.readouterr().err
+    assert main([str(old), str(old), snapshot.path, "--workers", "1"]) == 0
@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+
+from isc_transform_generator import accountAttribute, dateCompare, dateMath, identityAttribute, lower
+from isc_transform_incremental import IncrementalEngine
+
+BEFORE = datetime(2025, 1, 1, tzinfo=timezone.utc)
+AFTER = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+TRANSFORMS = {
+    "ended": dateCompare(identityAttribute("end"), dateMath("now"), "LT", "yes", "no"),
+    "name": lower(identityAttribute("name")),
+}
+
+
+def _identity(identity_id):
+    return {"id": identity_id, "attributes": {"end": "2025-03-01T00:00:00Z", "name": "Ann", "phone": "1"}}
+
+
+def test_time_dependent_transforms_are_refreshed(tmp_path):
+    with IncrementalEngine(str(tmp_path / "results.db"), TRANSFORMS) as engine:
+        assert engine.time_dependent == {"ended"}
+        engine.load([_identity("1"), _identity("2")], now=BEFORE)
+        assert engine.result("1", "ended") == ("no", None)
+
+        # An unrelated change still re-evaluates the time-dependent transform, but not the others.
+        updates = engine.apply([{"id": "1", "attributes": {"phone": "2"}}], now=AFTER)
+        assert [(update.identity, update.transform, update.new) for update in updates] == [("1", "ended", "yes")]
+        assert engine.stats["skipped"] == 1
+        assert engine.result("2", "ended") == ("no", None)
+
+        updates = engine.refresh(now=AFTER)
+        assert [(update.identity, update.transform, update.new) for update in updates] == [("2", "ended", "yes")]
+
+
+def test_account_changes_only_reevaluate_their_readers(tmp_path):
+    transforms = {
+        "department": accountAttribute("HR", "department"),
+        "filtered": accountAttribute("HR", "department", account_filter="status == \"active\""),
+        "name": lower(identityAttribute("name")),
+    }
+    identity = {"id": "1", "attributes": {"name": "Ann"}, "accounts": {"HR": [{"department": "IT", "phone": "1"}]}}
+    with IncrementalEngine(str(tmp_path / "results.db"), transforms) as engine:
+        engine.load([identity], now=BEFORE)
+
+        # Only the filtered read depends on every attribute of the source.
+        engine.apply([{"id": "1", "accounts": {"HR": [{"department": "IT", "phone": "2"}]}}], now=BEFORE)
+        assert engine.stats == {"evaluations": 4, "skipped": 2}
+
+        engine.apply([{"id": "1", "accounts": {"HR": [{"department": "Sales", "phone": "2"}]}}], now=BEFORE)
+        assert engine.stats == {"evaluations": 6, "skipped": 3}
+        assert engine.result("1", "department") == ("Sales", None)
+
+        # Reordering accounts changes which one is selected first.
+        accounts = [{"department": "Sales", "phone": "2"}, {"department": "IT"}]
+        engine.apply([{"id": "1", "accounts": {"HR": accounts}}], now=BEFORE)
+        engine.apply([{"id": "1", "accounts": {"HR": accounts[::-1]}}], now=BEFORE)
+        assert engine.stats == {"evaluations": 10, "skipped": 5}
+        assert engine.result("1", "department") == ("IT", None)
@@ -0,0 +1,40 @@
+import json
+
+from isc_transform_evaluator import evaluate
+from isc_transform_generator import dateMath, firstValid, identityAttribute, lower, reference, static, transform
+from isc_transform_nodes import Node, freeze, thaw
+from isc_transform_walk import _deep_tree, walk
+
+
+def test_freeze_thaw_round_trip():
+    tree = firstValid([lower(identityAttribute("a")), static("x")])
+    assert freeze(tree) is freeze(json.loads(json.dumps(tree)))
+    assert thaw(freeze(tree)) == tree
+
+
+def test_thaw_nested_nodes():
+    tree = firstValid([freeze(lower(identityAttribute("a"))), static("x")])
+    thawed = thaw(tree)
+    assert thawed == firstValid([lower(identityAttribute("a")), static("x")])
+    assert not any(isinstance(value, Node) for value in walk(thawed))
+
+
+def test_transform_thaws_nested_frozen_input():
+    result = transform("T", firstValid([freeze(dateMath(expression="now-30d/d")), static("x")]), output_enabled=True)
+    assert not any(isinstance(value, Node) for value in walk(result))
+    assert result["attributes"]["requiresPeriodicRefresh"] is True
+    json.dumps(result)
+
+
+def test_evaluate_frozen_trees():
+    identity = {"attributes": {"a": "ABC"}}
+    assert evaluate(freeze(lower(identityAttribute("a"))), identity) == "abc"
+    assert evaluate(firstValid([freeze(lower(identityAttribute("a"))), static("x")]), identity) == "abc"
+    assert evaluate(reference("R"), identity, transforms={"R": freeze(lower(identityAttribute("a")))}) == "abc"
+
+
+def test_freeze_thaw_deep_tree():
+    tree = _deep_tree(5000)
+    frozen = freeze(tree)
+    assert frozen.type == "firstValid" and frozen is freeze(_deep_tree(5000))
+    assert frozen.to_dict()["attributes"]["values"][0] == tree["attributes"]["values"][0]
@@ -0,0 +1,145 @@
+from datetime import datetime, timezone
+
+from isc_transform_evaluator import evaluate
+from isc_transform_generator import (accountAttribute, concat, conditional, dateCompare, dateMath, firstValid,
+                                     identityAttribute, static, transform)
+from isc_transform_optimizer import (deduplicate_variables, eliminate_dead_variables, fold_constants, optimize,
+                                     rewrite_ladders)
+from isc_transform_walk import _deep_tree
+
+IDENTITY = {"attributes": {"q": "Q"}}
+
+
+def test_deduplicate_variables_merges_identical_variables():
+    tree = static("$a-$b", {"a": identityAttribute("q"), "b": identityAttribute("q")})
+    new_tree, report = deduplicate_variables(tree)
+    assert report["deduplicated"] == 1
+    assert set(new_tree["attributes"]) == {"a", "value"}
+    assert evaluate(new_tree, IDENTITY) == evaluate(tree, IDENTITY) == "Q-Q"
+
+
+def test_deduplicate_variables_keeps_reassigned_variables():
+    tree = static('#set($b = "z")$a-$b#if(true)#end', {"a": identityAttribute("q"), "b": identityAttribute("q")})
+    new_tree, report = deduplicate_variables(tree)
+    assert report["deduplicated"] == 0
+    assert evaluate(new_tree, IDENTITY) == "Q-z"
+    assert evaluate(optimize(tree)[0], IDENTITY) == "Q-z"
+
+
+def test_deduplicate_variables_leaves_conditional_branches_alone():
+    tree = conditional("$a eq yes", static("yes"), static("no"), a=static("yes"))
+    new_tree, report = deduplicate_variables(tree)
+    assert report["deduplicated"] == 0 and new_tree == tree
+    same = conditional("$a eq b", static("x"), static("x"), a=identityAttribute("q"))
+    new_tree, report = deduplicate_variables(same)
+    assert report["deduplicated"] == 0 and new_tree == same
+    assert evaluate(optimize(tree)[0], IDENTITY) == evaluate(tree, IDENTITY) == "yes"
+
+
+def test_eliminate_dead_variables_removes_unreferenced_variables():
+    tree = static("$a-$b", {"a": identityAttribute("q"), "b": identityAttribute("q"),
+                            "unused": accountAttribute("HR", "id")})
+    new_tree, report = eliminate_dead_variables(tree)
+    assert report == {"removed": [("attributes.unused", "unused")], "undefined": [], "evaluations_avoided": 1}
+    assert set(new_tree["attributes"]) == {"a", "b", "value"}
+    assert evaluate(new_tree, IDENTITY) == evaluate(tree, IDENTITY) == "Q-Q"
+    assert "unused" in tree["attributes"]
+
+
+def test_eliminate_dead_variables_follows_variables_of_variables():
+    # 'b' is only read by the template of 'a'; 'd' only by 'c', which nothing reads, so it goes away with 'c'.
+    tree = static("$a", {"a": static("<$b>", {"b": identityAttribute("q")}),
+                         "c": static("$d", {"d": accountAttribute("HR", "id"), "e": identityAttribute("e")})})
+    new_tree, report = eliminate_dead_variables(tree)
+    assert report["removed"] == [("attributes.c.attributes.e", "e"), ("attributes.c", "c")]
+    assert report["evaluations_avoided"] == 3
+    assert new_tree == static("$a", {"a": static("<$b>", {"b": identityAttribute("q")})})
+    assert evaluate(new_tree, IDENTITY) == "<Q>"
+
+
+def test_eliminate_dead_variables_reports_undefined_variables():
+    tree = static("#set($x = 1)$x $date $missing#foreach($item in $items)$item#end", {"items": identityAttribute("q")})
+    new_tree, report = eliminate_dead_variables(tree)
+    assert new_tree == tree
+    assert report == {"removed": [], "undefined": [("attributes.value", "missing")], "evaluations_avoided": 0}
+
+
+def test_fold_constants_keeps_velocity_characters_out_of_statics():
+    for tree in (concat(["##", static("x")]), concat(["$a", static("x"), "y"]), concat(["#"])):
+        folded = fold_constants(tree)[0]
+        assert evaluate(folded, {}) == evaluate(tree, {})
+    assert fold_constants(concat(["a", static("x"), "y"]))[0] == static("axy")
+
+
+def test_fold_constants_does_not_fold_date_compare_against_now():
+    tree = dateCompare(static("now"), "2025-01-01T00:00:00Z", "GT", "after", "before")
+    folded = fold_constants(tree)[0]
+    assert folded == tree
+    assert evaluate(folded, {}, now=datetime(2024, 1, 1, tzinfo=timezone.utc)) == "before"
+
+
+def test_fold_constants_folds_constant_date_compare():
+    tree = dateCompare(static("2026-01-01T00:00:00Z"), "2025-01-01T00:00:00Z", "GT", "after", "before")
+    assert fold_constants(tree)[0] == static("after")
+
+
+def test_optimize_deep_ladder():
+    for levels in (200, 2000):
+        tree = _deep_tree(levels)
+        optimized, report = optimize(tree)
+        assert report["nodes_after"] == levels + 2
+        identity = {"attributes": {"attribute%d" % (levels // 2): "found"}}
+        assert evaluate(optimized, identity) == "found"
+        assert evaluate(optimized, {}) == "default"
+
+
+def test_fold_constants_keeps_root_attributes_when_the_root_collapses():
+    for node in (firstValid([dateMath("now")]), concat([dateMath("now")])):
+        new_tree, report = fold_constants(transform("x", node, output_enabled=True))
+        assert new_tree["name"] == "x" and new_tree["internal"] is False
+        assert new_tree["attributes"]["requiresPeriodicRefresh"] is True
+    new_tree, report = fold_constants(transform("x", firstValid([dateMath("now")]), output_enabled=True))
+    assert report["flattened"] == 1
+    assert new_tree == {"name": "x", "type": "dateMath",
+                        "attributes": {"requiresPeriodicRefresh": True, "expression": "now"}, "internal": False}
+
+
+def _ladder(first="A"):
+    return conditional("$x eq %s" % first, "1", conditional("$x eq B", "2", "3", x=identityAttribute("q")),
+                       x=identityAttribute("q"))
+
+
+def test_rewrite_ladders_keeps_the_root_of_transform_output():
+    tree = transform("ladder", _ladder(), output_enabled=True)
+    new_tree, report = rewrite_ladders(tree)
+    assert report == {"rewritten": [("", 2, 4)], "rejected": []}
+    assert new_tree["name"] == "ladder" and new_tree["internal"] is False
+    assert new_tree["type"] == "lookup"
+    assert new_tree["attributes"]["table"] == {"A": "1", "B": "2", "default": "3"}
+    for value in ("A", "B", "C", None):
+        identity = {"attributes": {"q": value}}
+        assert evaluate(new_tree, identity) == evaluate(tree, identity)
+
+
+def test_rewrite_ladders_keeps_periodic_refresh_on_the_root():
+    ladder = static("#if($x == 'A')1#elseif($x == 'B')2#else3#end", {"x": dateMath("now")})
+    new_tree, report = rewrite_ladders(transform("ladder", ladder, output_enabled=True))
+    assert len(report["rewritten"]) == 1
+    assert new_tree["type"] == "lookup"
+    assert new_tree["attributes"]["requiresPeriodicRefresh"] is True
+
+
+def test_rewrite_ladders_rewrites_nested_ladders():
+    tree = concat(["<", _ladder(), ">"])
+    new_tree, report = rewrite_ladders(tree)
+    assert report["rewritten"] == [("attributes.values[1]", 2, 4)]
+    assert new_tree["attributes"]["values"][1]["type"] == "lookup"
+    assert evaluate(new_tree, IDENTITY) == evaluate(tree, IDENTITY) == "<3>"
+
+
+def test_rewrite_ladders_rejects_unproven_rewrites():
+    # A 'default' constant cannot be a lookup key: the rewrite is rejected and the ladder kept.
+    tree = _ladder(first="default")
+    new_tree, report = rewrite_ladders(tree)
+    assert report == {"rewritten": [], "rejected": [""]}
+    assert new_tree == tree
@@ -0,0 +1,18 @@
+from isc_transform_evaluator import compile_transform
+from isc_transform_generator import concat, identityAttribute, lower, reference, static, upper
+from isc_transform_result_cache import ResultCache
+
+IDENTITY = {"attributes": {"a": "abc"}}
+
+
+def _run(path, references):
+    with ResultCache(path, min_nodes=1) as cache:
+        run = compile_transform(upper(lower(reference("R"))), references, cache=cache)
+        return run(IDENTITY), cache.hits
+
+
+def test_editing_a_referenced_transform_misses_the_cache(tmp_path):
+    path = str(tmp_path / "results.db")
+    assert _run(path, {"R": identityAttribute("a")}) == ("ABC", 0)
+    assert _run(path, {"R": identityAttribute("a")})[1] > 0
+    assert _run(path, {"R": concat([identityAttribute("a"), static("-new")])})[0] == "ABC-NEW"
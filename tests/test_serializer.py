@@ -0,0 +1,76 @@
+import io
+import json
+import sys
+
+import pytest
+
+from isc_transform_generator import concat, firstValid, identityAttribute, lookup, static, transform
+from isc_transform_nodes import freeze
+from isc_transform_serializer import dump, dump_many, dumps, iter_ndjson
+from isc_transform_walk import _deep_tree
+
+TREES = [
+    transform("Display Name", concat([identityAttribute("firstname"), " ", identityAttribute("lastname")]),
+              output_enabled=True),
+    transform("Région", firstValid([lookup({"é": "ü", "1": "\"quoted\"\n", "default": "—"},
+                                           input=identityAttribute("r")),
+                                    static("#if($a)x#end", {"a": identityAttribute("a")})]), output_enabled=True),
+    {"name": "Values", "type": "static", "attributes": {"value": "", "n": 1, "f": 0.5, "t": True, "z": None,
+                                                       "empty": {}, "list": [], "nested": [[{}], [1, [2]]]}},
+]
+
+FORMATS = {
+    "pretty": {"indent": 4},
+    "compact": {"separators": (",", ":")},
+    "ndjson": {"separators": (",", ":")},
+}
+
+
+@pytest.mark.parametrize("output_format", sorted(FORMATS))
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_dump_matches_json_dumps(output_format, ensure_ascii):
+    for tree in TREES:
+        expected = json.dumps(tree, ensure_ascii=ensure_ascii, **FORMATS[output_format])
+        output = io.StringIO()
+        dump(tree, output, output_format, ensure_ascii)
+        assert output.getvalue() == expected + ("\n" if output_format == "ndjson" else "")
+        assert dumps(tree, output_format, ensure_ascii) == expected
+        # Frozen nodes are written like the dictionaries they were made from.
+        assert dumps(freeze(tree), output_format, ensure_ascii) == expected
+
+
+@pytest.mark.parametrize("count", [0, 1, 3])
+def test_dump_many_matches_json_dumps(count):
+    trees = TREES[:count]
+    for output_format in ("pretty", "compact"):
+        output = io.StringIO()
+        assert dump_many(iter(trees), output, output_format) == count
+        assert output.getvalue() == json.dumps(trees, **FORMATS[output_format])
+    output = io.StringIO()
+    assert dump_many(iter(trees), output) == count
+    assert output.getvalue() == "".join(json.dumps(tree, separators=(",", ":")) + "\n" for tree in trees)
+    assert list(iter_ndjson(io.StringIO(output.getvalue()))) == trees
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        dump(TREES[0], io.StringIO(), "yaml")
+
+
+@pytest.mark.parametrize("output_format", sorted(FORMATS))
+def test_deep_trees(output_format):
+    # Deeper than json.dumps() allows with the default recursion limit.
+    tree = _deep_tree(500)
+    with pytest.raises(RecursionError):
+        json.dumps(tree)
+    output = io.StringIO()
+    dump(tree, output, output_format)
+    text = dumps(tree, output_format)
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(10000)
+    try:
+        expected = json.dumps(tree, **FORMATS[output_format])
+    finally:
+        sys.setrecursionlimit(limit)
+    assert text == expected
+    assert output.getvalue() == expected + ("\n" if output_format == "ndjson" else "")
@@ -0,0 +1,68 @@
+import os
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from isc_transform_batch import columns_from_identities, columns_from_snapshot
+from isc_transform_evaluator import compile_transform
+from isc_transform_generator import accountAttribute, concat, getReferenceIdentityAttribute, reference, static, upper
+from isc_transform_shard import evaluate_sharded
+from isc_transform_snapshot import Snapshot, write_snapshot
+
+NOW = datetime(2025, 6, 1, tzinfo=timezone.utc)
+
+OPTIONS = [
+    {},
+    {"account_return_first_link": True},
+    {"account_sort_attribute": "n"},
+    {"account_sort_attribute": "n", "account_sort_descending": True, "account_return_first_link": True},
+]
+
+
+def _identities(count):
+    generator = random.Random(7)
+    identities = []
+    for index in range(count):
+        accounts = [{"id": generator.choice([None, "u%d" % index, "v%d" % index]), "n": str(generator.randint(0, 9))}
+                    for _ in range(generator.randint(0, 3))]
+        identities.append({"id": str(index), "attributes": {}, "accounts": {"HR": accounts}})
+    return identities
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    identities = _identities(5000)
+    path = str(tmp_path_factory.mktemp("shard") / "identities.snapshot")
+    write_snapshot(identities, path)
+    with Snapshot(path) as mapped:
+        yield identities, mapped
+
+
+@pytest.mark.parametrize("options", OPTIONS)
+def test_snapshot_columns_apply_account_selection(snapshot, options):
+    identities, mapped = snapshot
+    tree = accountAttribute("HR", "id", **options)
+    assert columns_from_snapshot(tree, mapped) == columns_from_identities(tree, identities)
+
+
+def test_sharded_batch_matches_evaluator(snapshot):
+    identities, mapped = snapshot
+    tree = concat([accountAttribute("HR", "id", account_return_first_link=True), static("-"),
+                   accountAttribute("HR", "id", account_sort_attribute="n", account_sort_descending=True)])
+    run = compile_transform(tree)
+    expected = [run(identity, now=NOW) for identity in identities]
+    assert evaluate_sharded(tree, mapped, workers=min(2, os.cpu_count() or 1), now=NOW) == expected
+
+
+def test_sharded_batch_follows_references():
+    identities = [{"id": str(index), "attributes": {}, "accounts": {"HR": [{"id": "u%d" % index}]},
+                   "references": {"manager": {"name": "m%d" % (index % 3)}} if index % 2 else {}}
+                  for index in range(40)]
+    transforms = {"Manager": upper(getReferenceIdentityAttribute("manager", "name"))}
+    tree = concat([reference("Manager"), static(":"), accountAttribute("HR", "id")])
+    run = compile_transform(tree, transforms)
+    expected = [run(identity, now=NOW) for identity in identities]
+    assert expected[:2] == [":u0", "M1:u1"]
+    assert evaluate_sharded(tree, identities, workers=min(2, os.cpu_count() or 1), transforms=transforms,
+                            now=NOW) == expected
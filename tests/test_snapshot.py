@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from isc_transform_batch import REFERENCE, columns_from_identities, columns_from_snapshot
+from isc_transform_evaluator import evaluate
+from isc_transform_generator import accountAttribute, concat, getReferenceIdentityAttribute, identityAttribute
+from isc_transform_snapshot import Snapshot, SnapshotError, main, write_snapshot
+
+IDENTITIES = [
+    {"id": "1", "attributes": {"name": "Ann", "age": 31, "active": True, "score": 1.0, "tags": ["a", "b"],
+                               "manager": {"id": "9"}, "empty": ""},
+     "accounts": {"HR": [{"id": "h1", "n": "2"}, {"id": "h2", "n": "1", "extra": 1}], "AD": [{"login": "ann"}]},
+     "references": {"manager": {"name": "Bob", "level": 3}}},
+    {"id": "2", "attributes": {"name": "Cid", "age": "31"},
+     "accounts": [{"sourceName": "AD", "attributes": {"login": "cid"}}]},
+    {"id": "3", "attributes": {"name": None, "age": 1},
+     "accounts": {"HR": [{"n": "5"}]},
+     "references": {"manager": {"name": "Dee"}, "buddy": {"name": "Eve"}}},
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "identities.snapshot")
+    assert write_snapshot(IDENTITIES, path) == len(IDENTITIES)
+    with Snapshot(path) as mapped:
+        yield mapped
+
+
+def test_attributes_round_trip(snapshot):
+    assert len(snapshot) == 3
+    assert [snapshot.identity_id(index) for index in range(3)] == ["1", "2", "3"]
+    assert set(snapshot.attribute_names) == {"name", "age", "active", "score", "tags", "manager", "empty"}
+    for identity, record in zip(IDENTITIES, snapshot):
+        assert {name: value for name, value in record["attributes"].items() if value is not None} == \
+            {name: value for name, value in identity["attributes"].items() if value is not None}
+
+
+def test_json_values_keep_their_types(snapshot):
+    attributes = snapshot.identity(0)["attributes"]
+    assert attributes["age"] == 31 and attributes["active"] is True and attributes["tags"] == ["a", "b"]
+    assert isinstance(attributes["score"], float) and attributes["manager"] == {"id": "9"}
+    assert attributes["empty"] == ""
+    # The string "31" and the number 31 are distinct values.
+    assert snapshot.column("age") == [31, "31", 1]
+
+
+def test_accounts_round_trip(snapshot):
+    assert set(snapshot.source_names) == {"HR", "AD"}
+    assert snapshot.accounts(0, "HR") == [{"id": "h1", "n": "2"}, {"id": "h2", "n": "1", "extra": 1}]
+    assert snapshot.accounts(1, "HR") == []
+    assert snapshot.accounts(1, "AD") == [{"login": "cid"}]
+    assert snapshot.accounts(2, "Missing") == []
+    assert dict(snapshot.identity(2)["accounts"]) == {"HR": [{"n": "5"}], "AD": []}
+
+
+def test_references_round_trip(snapshot):
+    assert snapshot.references(0, "manager") == {"name": "Bob", "level": 3}
+    assert snapshot.references(1, "manager") == {}
+    assert dict(snapshot.identity(2)["references"]) == {"manager": {"name": "Dee"}, "buddy": {"name": "Eve"}}
+    assert snapshot.column((REFERENCE, "manager", "name")) == ["Bob", None, "Dee"]
+    assert snapshot.column((REFERENCE, "missing", "name"), 1) == [None, None]
+    tree = getReferenceIdentityAttribute("manager", "name")
+    assert [evaluate(tree, record) for record in snapshot] == ["Bob", None, "Dee"]
+
+
+def test_columns_match_identity_records(snapshot):
+    tree = concat([identityAttribute("name"), accountAttribute("HR", "id"), accountAttribute("AD", "login"),
+                   accountAttribute("HR", "id", account_sort_attribute="n", account_return_first_link=True),
+                   getReferenceIdentityAttribute("manager", "level")])
+    assert columns_from_snapshot(tree, snapshot) == columns_from_identities(tree, IDENTITIES)
+    assert columns_from_snapshot(tree, snapshot, 1, 2) == columns_from_identities(tree, IDENTITIES[1:2])
+
+
+def test_csv_export(tmp_path, capsys):
+    export = tmp_path / "identities.csv"
+    export.write_text("id,name,department\n1,Ann,IT\n2,Bob,\n", encoding="utf-8")
+    path = str(tmp_path / "identities.snapshot")
+    assert main([str(export), path]) == 0
+    with Snapshot(path) as mapped:
+        assert [(record["id"], dict(record["attributes"])) for record in mapped] == [
+            ("1", {"name": "Ann", "department": "IT"}), ("2", {"name": "Bob", "department": None})]
+
+
+def test_json_list_export(tmp_path, capsys):
+    export = tmp_path / "identities.json"
+    export.write_text(json.dumps(IDENTITIES), encoding="utf-8")
+    path = str(tmp_path / "identities.snapshot")
+    assert main([str(export), path]) == 0
+    with Snapshot(path) as mapped:
+        assert [mapped.references(index, "manager") for index in range(3)] == [
+            {"name": "Bob", "level": 3}, {}, {"name": "Dee"}]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "identities.json"
+    path.write_text("[]", encoding="utf-8")
+    with pytest.raises(SnapshotError):
+        Snapshot(str(path))
@@ -0,0 +1,69 @@
+import contextlib
+import io
+import itertools
+import os
+import runpy
+
+import isc_transform_generator
+from isc_transform_vtl import minify, references, render
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+def _legacy_minify(source):
+    # The minifier static() used before the tokenizer.
+    return isc_transform_generator.fix_velocity_pattern(isc_transform_generator.flatten_text(source))
+
+
+def _example_templates(monkeypatch):
+    templates = []
+    monkeypatch.setattr(isc_transform_generator, "_minify_velocity",
+                        lambda source: templates.append(source) or minify(source))
+    for name in sorted(os.listdir(EXAMPLES)):
+        if name.endswith(".py"):
+            with contextlib.redirect_stdout(io.StringIO()):
+                runpy.run_path(os.path.join(EXAMPLES, name))
+    monkeypatch.undo()
+    return templates
+
+
+def test_formal_reference_with_hyphen():
+    assert references("${first-name}") == {"first-name"}
+    assert render("${first-name}!", {"first-name": "Ann"}) == "Ann!"
+    assert render("$!{first-name}", {}) == ""
+    assert render("${first-name}", {}) == "${first-name}"
+    assert render('#if(${first-name} == "Ann")yes#end', {"first-name": "Ann"}) == "yes"
+
+
+def test_informal_reference_stops_at_hyphen():
+    assert render("$first-name", {"first": "A"}) == "A-name"
+    assert render("#set($c = $a - $b)$c", {"a": 5, "b": 2}) == "3"
+
+
+def test_only_whitelisted_methods_are_called():
+    class Target(object):
+        def secret(self):
+            return "leak"
+
+        def getName(self):
+            return "leak"
+
+    assert render("$x.secret()", {"x": Target()}) == "$x.secret()"
+    assert render("$!x.name", {"x": Target()}) == ""
+    assert render("$s.toUpperCase()-$n.toString()", {"s": "ab", "n": 3}) == "AB-3"
+
+
+def test_minify_braces_elseif_and_else_like_the_legacy_minifier():
+    source = "#if($a == 'x')\n    X\n#elseif($a == 'y')\n    #if($b)B#else\n    b#end\n#else\n    Z\n#end\n"
+    expected = "#if($a == 'x')X#{elseif}($a == 'y')#if($b)B#{else}b#end#{else}Z#end"
+    assert minify(source) == _legacy_minify(source) == expected
+    for a, b in itertools.product(["x", "y", "z"], [True, False]):
+        assert render(minify(source), {"a": a, "b": b}) == render(_legacy_minify(source), {"a": a, "b": b})
+
+
+def test_minify_matches_the_legacy_minifier_on_the_examples(monkeypatch):
+    templates = _example_templates(monkeypatch)
+    assert len(templates) >= 2 and all("#elseif" in source and "#else" in source for source in templates)
+    for source in templates:
+        assert minify(source) == _legacy_minify(source)
+        assert isc_transform_generator.static(source)["attributes"]["value"] == _legacy_minify(source)
@@ -0,0 +1,35 @@
+import io
+import json
+import os
+
+from isc_transform_watch import Watcher
+
+
+def _write(path, text, stamp):
+    with open(path, "w", encoding="utf-8") as source:
+        source.write(text)
+    os.utime(path, ns=(stamp, stamp))
+
+
+def _value(output):
+    with open(os.path.join(output, "Greeting.json"), encoding="utf-8") as result:
+        return json.load(result)["attributes"]["value"]
+
+
+def test_helper_change_rebuilds_dependents(tmp_path):
+    directory, output = str(tmp_path / "definitions"), str(tmp_path / "transforms")
+    os.makedirs(directory)
+    helper = os.path.join(directory, "greetings.py")
+    _write(helper, "TEXT = 'Hello'\n", 1000000000)
+    _write(os.path.join(directory, "greeting.py"), "from isc_transform_generator import static, transform\n"
+                                                   "from greetings import TEXT\n\n"
+                                                   "transform('Greeting', static(TEXT))\n", 1000000000)
+    watcher = Watcher(directory, output, log=io.StringIO())
+    try:
+        watcher.poll()
+        assert _value(output) == "Hello"
+        _write(helper, "TEXT = 'Bonjour'\n", 2000000000)
+        assert watcher.poll() == 2
+        assert _value(output) == "Bonjour"
+    finally:
+        watcher.close()